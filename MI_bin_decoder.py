@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import argparse
+import tarfile
+import zipfile
+
+import MI_bin_generator as mi_gen
+import mi_container
+import mi_layouts
+import mi_mac_pool
+
+VERSION_STRING = "v1.0"
+
+BIN_EXT = ".bin"
+
+def make_verifier(layout, template=None, mac_ranges=None):
+    """Return verify(data) -> list of problems (empty if the MI image follows the layout rules)
+
+    Always checked: image size, 'size' header, CRC, string fields (UTF-8, nothing after the null padding).
+    With a prepared template: static fields must match it and dynamic values must pass the generator checks.
+    mac_ranges: {field: (first, last)} of a MAC pool (mi_mac_pool.load_ranges()); these fields are not
+    static, each must hold an address of its range, given to no other board verified by this verifier.
+    """
+    str_fields = [field for field in layout if field.type == 'str']
+    mac_ranges = mac_ranges or {}
+    mac_fields = [(layout[fld], first, last) for fld, (first, last) in mac_ranges.items() if fld in layout]
+    macs_seen = {}
+    static_fields = []
+    if template is not None:
+        reference = template.image
+        static_fields = [(layout[fld], bytes(reference[layout[fld].offset:layout[fld].offset + layout[fld].size]))
+                         for fld in template.values if fld not in template.dynamic_sizes and fld not in mac_ranges]
+
+    def verify(data):
+        if len(data) != layout.size:
+            return ["size {} bytes, config expects {}".format(len(data), layout.size)]
+        problems = []
+        if not mi_gen.check_crc(data, layout):
+            problems.append("CRC mismatch")
+        if mi_gen.MI_SIZE_FIELD in layout:
+            size_field = layout[mi_gen.MI_SIZE_FIELD]
+            size_value = size_field.packer.unpack_from(data, size_field.offset)[0]
+            if size_value != layout.size:
+                problems.append("'{}' header {} does not match config size {}".format(
+                    mi_gen.MI_SIZE_FIELD, size_value, layout.size))
+        for field in str_fields:
+            text = data[field.offset:field.offset + field.size].rstrip(b'\0')
+            if b'\0' in text:
+                problems.append("{}: data after null padding".format(field.name))
+            try:
+                text.decode('utf-8')
+            except UnicodeDecodeError:
+                problems.append("{}: not valid UTF-8".format(field.name))
+        for field, expected in static_fields:
+            if data[field.offset:field.offset + field.size] != expected:
+                problems.append("{}: static value differs from template".format(field.name))
+        for field, first, last in mac_fields:
+            mac = int.from_bytes(data[field.offset:field.offset + field.size], 'big')
+            if not first <= mac <= last:
+                problems.append("{}: {} is outside the MAC pool range".format(field.name, mi_mac_pool.format_mac(mac)))
+            elif (field.name, mac) in macs_seen:
+                problems.append("{}: {} also used by {}".format(
+                    field.name, mi_mac_pool.format_mac(mac), macs_seen[(field.name, mac)]))
+            else:
+                macs_seen[(field.name, mac)] = mi_gen.decode_field(layout[template.name_field], data) \
+                    if template is not None else "another board"
+        if template is not None:
+            values = mi_gen.parse_mi(data, layout)
+            for fld, max_size in template.dynamic_sizes.items():
+                value = str(values[fld])
+                err = "{} is empty".format(fld) if value == "" else \
+                    mi_gen.check_value(fld, value, max_size, layout[fld].type, fld == template.name_field)
+                if err:
+                    problems.append(err)
+        return problems
+
+    return verify
+
+def iter_bins(paths, max_size):
+    """Yield (name, data) for every .bin in the given files, folders (recursive), zip/tar archives and
+    MI containers (one item per record, named <container>#<record number>)
+
+    Files larger than max_size are not read, data is then None and the caller reports the size.
+    Only one file is held in memory at a time.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            stack = [path]
+            while stack:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in sorted(entries, key=lambda e: e.name):
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                        elif entry.name.lower().endswith(BIN_EXT):
+                            yield entry.path, read_bin(entry.path, max_size)
+        elif mi_container.is_container(path):
+            with mi_container.Container(path) as container:
+                for record_no in range(len(container)):
+                    name = "{}#{}".format(path, record_no)
+                    yield name, None if container.record_size > max_size else container.record(record_no)
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(BIN_EXT):
+                        continue
+                    name = "{}:{}".format(path, info.filename)
+                    if info.file_size > max_size:
+                        yield name, None
+                    else:
+                        with archive.open(info) as f:
+                            yield name, f.read()
+        elif tarfile.is_tarfile(path):
+            # Stream mode: members are read in archive order without building the full member list
+            with tarfile.open(path, "r|*") as archive:
+                for member in archive:
+                    if not member.isfile() or not member.name.lower().endswith(BIN_EXT):
+                        continue
+                    name = "{}:{}".format(path, member.name)
+                    if member.size > max_size:
+                        yield name, None
+                    else:
+                        yield name, archive.extractfile(member).read()
+        else:
+            yield path, read_bin(path, max_size)
+
+def read_bin(path, max_size):
+    with open(path, "rb") as f:
+        data = f.read(max_size + 1)
+    return None if len(data) > max_size else data
+
+def decode(args, layout, registry=None):
+    """Print the fields of every bin; with a registry each image is decoded with the layout its header selects"""
+    ret = 0
+    for name, data in iter_bins(args.bins, registry.max_size if registry else layout.size):
+        if registry is not None and data is not None:
+            try:
+                layout = registry.layout(registry.for_image(data))
+            except mi_gen.LayoutError as e:
+                print("[ERROR] - {}: {}".format(name, e))
+                ret = 1
+                continue
+        if data is None or len(data) != layout.size:
+            print("[ERROR] - {}: not a {} byte MI image".format(name, layout.size))
+            ret = 1
+            continue
+        values = mi_gen.parse_mi(data, layout)
+        if args.json:
+            values['crc_ok'] = mi_gen.check_crc(data, layout)
+            print(json.dumps(dict(file=name, **values)))
+            continue
+        print("[INFO] - {}".format(name))
+        for field in layout:
+            value = values[field.name]
+            if field.type == 'array':
+                value = ",".join("0x{:02X}".format(b) for b in value)
+            elif field.type != 'str':
+                value = "{} (0x{:X})".format(value, value)
+            print("  0x{:04X}  {:<26} {:<5} {:>4}  {}".format(field.offset, field.name, field.type, field.size, value))
+        print("  CRC {}".format("OK" if mi_gen.check_crc(data, layout) else "MISMATCH"))
+    return ret
+
+def verify(args, layout, registry=None):
+    """Check every bin; with a registry each image is checked against the product its header selects
+    (static fields against that product's MI data file)"""
+    verifiers = {}
+    mac_ranges = None
+    mac_pool = args.mac_pool or os.path.join(mi_gen.parent_folder, mi_mac_pool.MAC_POOL_CONFIG)
+    if args.mac_pool or os.path.isfile(mac_pool):
+        mac_ranges = mi_mac_pool.load_ranges(mac_pool)
+    if registry is None:
+        template = None
+        if args.ini:
+            template = mi_gen.prepare_template(mi_gen.load_template(args.ini), layout)
+        verify_image = make_verifier(layout, template, mac_ranges)
+    max_size = registry.max_size if registry else layout.size
+
+    checked = failed = 0
+    for name, data in iter_bins(args.bins, max_size):
+        checked += 1
+        if data is None:
+            problems = ["size larger than {} bytes".format(max_size)]
+        elif registry is None:
+            problems = verify_image(data)
+        else:
+            try:
+                product = registry.for_image(data)
+                if product.name not in verifiers:
+                    verifiers[product.name] = make_verifier(registry.layout(product), registry.template(product),
+                                                                  mac_ranges)
+                problems = verifiers[product.name](data)
+            except mi_gen.LayoutError as e:
+                problems = [str(e)]
+        if problems:
+            failed += 1
+            print("[FAIL] - {}: {}".format(name, "; ".join(problems)))
+        elif args.verbose:
+            print("[OK] - {}".format(name))
+    print("[INFO] - Verified {} MI bin file(s), {} failed".format(checked, failed))
+    return 1 if failed else 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MCU MI binary file decoder and verifier")
+    layout_source = parser.add_mutually_exclusive_group(required=True)
+    layout_source.add_argument("-c", "--config", help="MI config file, specifying size and type")
+    layout_source.add_argument("-r", "--registry", help="Layout registry ({}), the layout of each file is "
+                               "selected by its magic_id and version".format(mi_layouts.REGISTRY_NAME))
+    parser.add_argument("-v", '--version', action='version', version='%(prog)s - {}'.format(VERSION_STRING))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    decode_cmd = commands.add_parser("decode", help="Print the fields of MI bin files")
+    decode_cmd.add_argument("bins", nargs="+", help="MI bin files, folders or zip/tar archives")
+    decode_cmd.add_argument("--json", action="store_true", help="One JSON object per file")
+
+    verify_cmd = commands.add_parser("verify", help="Check size, CRC and field rules of MI bin files")
+    verify_cmd.add_argument("bins", nargs="+", help="MI bin files, folders (e.g. a date folder) or zip/tar archives")
+    verify_cmd.add_argument("-i", "--ini", help="MCU MI data file, static fields must match it "
+                            "(with --registry: the MI data file of each file's product)")
+    verify_cmd.add_argument("-m", "--mac-pool", help="MAC pool config: its fields are checked for range and "
+                            "uniqueness instead of the template value (default: {} next to this script, "
+                            "if present)".format(mi_mac_pool.MAC_POOL_CONFIG))
+    verify_cmd.add_argument("--verbose", action="store_true", help="Also list files that pass")
+    args = parser.parse_args(argv)
+
+    if args.config and not os.path.isfile(args.config):
+        print("Error: config file ({0}) not found!".format(os.path.realpath(args.config)))
+        sys.exit(1)
+
+    try:
+        layout = registry = None
+        if args.registry:
+            registry = mi_layouts.LayoutRegistry.load(args.registry, mi_gen.get_layout_cache_dir())
+        else:
+            layout = mi_gen.load_layout(args.config, mi_gen.get_layout_cache_dir())
+        if args.command == "decode":
+            ret = decode(args, layout, registry)
+        else:
+            ret = verify(args, layout, registry)
+    except (OSError, mi_gen.LayoutError, mi_mac_pool.MacPoolError) as e:
+        print("[ERROR] - {}".format(e))
+        sys.exit(1)
+    sys.exit(ret)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
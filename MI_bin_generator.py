@@ -1,28 +1,31 @@
+import io
 import os
+import re
 import sys
+import json
 import zlib
 import argparse
+import hashlib
+import tempfile
 from struct import *
 import configparser
 import csv
+import time
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
+from itertools import islice
 
-dir_path = os.path.dirname(os.path.realpath(__file__))
+import mi_bin_store
+import mi_container
+import mi_mac_pool
+import mi_metrics
+import mi_record_store
 
-# Global Variable
-Value_of_size_field = 0
-
-# Get parent folder of the script
+# Get parent folder of the script, the dated output folders are created next to it when generating
 parent_folder = os.path.dirname(os.path.abspath(__file__))
 
-# Create a folder with the current date (YYYYMMDD)
-date_folder = datetime.now().strftime("%Y%m%d")
-output_folder = os.path.join(parent_folder, date_folder)
-os.makedirs(output_folder, exist_ok=True)  # ensure the folder exists
-
-# Set the global file path inside the current date folder
-global_file_path = os.path.join(output_folder, f"{date_folder}.txt")
-
 VERSION_STRING = "v1.0"
 
 MI_GLOBAL_HEADER = 'mi_global_header'
@@ -39,93 +42,187 @@ MAX_RETRIES_EXPIRED = 0
 OEM_CONTENT_DYNAMIC_1 = 'oem_content_dynamic_1'
 OEM_CONTENT_DYNAMIC_2 = 'oem_content_dynamic_2'
 
-RESERVED_ME = 'reserved_ME'
+RESERVED_ME = 'reserved_me'
 RESERVED_CM = 'reserved_cm'
-RESERVED_OEM = 'reserved_OEM'
+RESERVED_OEM = 'reserved_oem'
+
+# Sections holding the values entered per board, in prompt order
+DYNAMIC_SECTIONS = (ME_CONTENT_DYNAMIC_1, ME_CONTENT_DYNAMIC_2, CM_CONTENT, OEM_CONTENT_DYNAMIC_1, OEM_CONTENT_DYNAMIC_2)
+
+MI_SIZE_FIELD = 'size'
+MI_CRC_FIELD = 'CRC'
+
+# Fixed sizes of the numeric MI field types, 'str' and 'array' take their size from the config
+FIELD_TYPE_SIZES = {'uint': 4, 'byte': 1, 'word': 2, 'array': None, 'str': None}
+
+LayoutField = namedtuple('LayoutField', ['name', 'offset', 'type', 'size', 'packer'])
+
+# Template checked against its layout: flat template values, dynamic field sizes, bin naming field,
+# the static image (all fields but the dynamic ones packed) with the CRC of its bytes before dynamic_start
+# and the INI sections as ((section, (field, ...)), ...). Boards are built from copies, it is never modified.
+PreparedTemplate = namedtuple('PreparedTemplate', ['values', 'dynamic_sizes', 'name_field', 'image',
+                                                   'dynamic_start', 'prefix_crc', 'sections'])
+
+# Compiled layouts written by load_layout(cache_dir=...), folder next to the script and file version
+LAYOUT_CACHE_NAME = 'mi_layout_cache'
+LAYOUT_CACHE_FORMAT = 1
+
+# Manifest rows handed to a worker process at a time
+BATCH_CHUNK_SIZE = 256
+
+# Value rules of the dynamic fields, see check_column()
+NUMERIC_MAX = {'byte': 0xFF, 'word': 0xFFFF, 'uint': 0xFFFFFFFF}
+NUMBER_RE = re.compile(r'(0[xX][0-9a-fA-F]+|[0-9]+)\Z')
+PRINTABLE_RE = re.compile(r'[\x20-\x7e]*\Z')
+DATE_FIELDS = {'production_date': (re.compile(r'[0-9]{8}\Z'), '%d%m%Y', 'DDMMYYYY')}
+FILE_NAME_UNSAFE_RE = re.compile(r'[<>:"/\\|?*]')
+
+class LayoutError(Exception):
+    """MI config file or MI data file does not match the expected layout"""
+
+class MILayout:
+    """MI config compiled once: field name -> offset, type, size and precompiled struct"""
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.index = {fld.name: fld for fld in self.fields}
+        last = self.fields[-1]
+        self.size = last.offset + last.size
+        self.crc = self.index[MI_CRC_FIELD]
+
+    def __getitem__(self, name):
+        return self.index[name]
+
+    def __contains__(self, name):
+        return name in self.index
 
-def input_value_check(lstring, max_size, type):
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+def no_event(event, **data):
+    """Default event callback, events are dropped"""
+
+def json_event_sink(stream):
+    """Event callback writing one JSON object per line to stream, e.g. {"event": "generated", "path": ...}
+
+    Events: prompt, value, validation_error, generated, error, row_error, batch_done.
+    """
+    def on_event(event, **data):
+        stream.write(json.dumps(dict(event=event, **data)) + "\n")
+        stream.flush()
+    return on_event
+
+def check_column(lstring, values, max_size, field_type=None):
+    """Validate all values (str) of one dynamic field at once, returning [(index, error message)]
+
+    field_type is the MI config type; without it brd_ver is a byte and other fields strings.
+    Numbers must be decimal or 0x hex within the type's range, strings printable ASCII within
+    max_size bytes; date fields (DATE_FIELDS) must be a valid date in their format.
+    """
+    if field_type is None:
+        field_type = 'byte' if lstring == "brd_ver" else 'str'
+    errors = []
+    if field_type in NUMERIC_MAX:
+        limit = NUMERIC_MAX[field_type]
+        for i, value in enumerate(values):
+            if not NUMBER_RE.match(value):
+                errors.append((i, "{} must be a number!".format(lstring)))
+            elif str2dec(value) > limit:
+                errors.append((i, "{} must be in the range of [0 to {}]!".format(lstring, limit)))
+        return errors
+
+    date_format = DATE_FIELDS.get(lstring)
+    for i, value in enumerate(values):
+        if not PRINTABLE_RE.match(value):
+            errors.append((i, "{} must be printable ASCII characters only!".format(lstring)))
+        elif len(value) > max_size:
+            errors.append((i, "{} cannot exceed {} bytes!".format(lstring, max_size)))
+        elif date_format:
+            pattern, fmt, text = date_format
+            try:
+                if not pattern.match(value):
+                    raise ValueError(value)
+                datetime.strptime(value, fmt)
+            except ValueError:
+                errors.append((i, "{} must be a valid date in format {}!".format(lstring, text)))
+    return errors
+
+def check_file_name(lstring, value):
+    """Error message if value cannot be used as a bin file name on Windows and Linux, else None"""
+    if FILE_NAME_UNSAFE_RE.search(value) or value.strip(".") == "":
+        return "{} '{}' is not a valid file name".format(lstring, value)
+    return None
+
+def check_value(lstring, value, max_size, field_type=None, file_name=False):
+    """Validate one dynamic field value, returning an error message or None
+
+    file_name: the value also names the bin file (the template's name field)
+    """
+    errors = check_column(lstring, [value], max_size, field_type)
+    if errors:
+        return errors[0][1]
+    return check_file_name(lstring, value) if file_name else None
+
+def input_value_check(lstring, max_size, type, on_event=no_event, field_type=None, file_name=False):
     err_print = MAX_RETRIES
     while err_print:
+        on_event("prompt", field=lstring, size=max_size)
         if lstring == "production_date":
             input_val = str(input('Enter {} in format[DDMMYYYY]({} byte {}): '.format(lstring, max_size, type)))
         else:
             input_val = str(input('Enter {} ({} byte {}): '.format(lstring, max_size, type)))
 
-        if lstring == "brd_ver":
-            int_val = int(input_val)
-            if not (0 <= int_val <= 255):
-                print("[Error] - {} must be in the range of [0 to 255]!".format(lstring))
-                err_print -= 1
-                if err_print == MAX_RETRIES_EXPIRED:
-                    input_val = None
-            else:
-                err_print = MAX_RETRIES_EXPIRED
+        err = check_value(lstring, input_val, max_size, field_type, file_name)
+        if err:
+            print("[Error] - {}".format(err))
+            err_print -= 1
+            on_event("validation_error", field=lstring, message=err, retries_left=err_print)
+            if err_print == MAX_RETRIES_EXPIRED:
+                input_val = None
         else:
-            if len(input_val) > max_size:
-                print("[Error] - {} cannot exceed {} bytes!".format(lstring, max_size))
-                err_print -= 1
-                if err_print == MAX_RETRIES_EXPIRED:
-                    input_val = None
-            else:
-                err_print = MAX_RETRIES_EXPIRED
+            err_print = MAX_RETRIES_EXPIRED
     return input_val
 
-def edit_mi_data(mi):
-    for content in mi[ME_CONTENT_DYNAMIC_1]:
-        content_val = input_value_check(content, int(mi[ME_CONTENT_DYNAMIC_1][content]), "string")
-        if content_val is None:
-            return "Max tries expired!"
-        print("[INFO] - \t{} value entered {}".format(content, content_val))
-        mi[ME_CONTENT_DYNAMIC_1][content] = content_val
-
-    for content in mi[ME_CONTENT_DYNAMIC_2]:
-        content_val = input_value_check(content, int(mi[ME_CONTENT_DYNAMIC_2][content]), "string")
-        if content_val is None:
-            return "Max tries expired!"
-        print("[INFO] - \t{} value entered {}".format(content, content_val))
-        mi[ME_CONTENT_DYNAMIC_2][content] = content_val
+def prompt_board_values(template, layout=None, on_event=no_event):
+    """Prompt for the dynamic fields of a prepared template in INI order, returns ({field: value}, error)"""
+    values = {}
+    for fld, max_size in template.dynamic_sizes.items():
+        value = input_value_check(fld, max_size, "string", on_event, layout[fld].type if layout is not None else None,
+                                  fld == template.name_field)
+        if value is None:
+            return None, "Max tries expired!"
+        print("[INFO] - \t{} value entered '{}'".format(fld, value))
+        on_event("value", field=fld, value=value)
+        values[fld] = value
+    return values, None
 
+def set_reserved_fields(mi):
+    """Fill the reserved fields that follow the dynamic MI sections"""
     mi[ME_CONTENT_DYNAMIC_2][RESERVED_ME] = "FFFFFFFF"
+    mi[CM_CONTENT][RESERVED_CM] = "0"
+    mi[OEM_CONTENT_DYNAMIC_2][RESERVED_OEM] = "0"
 
-    for content in mi[CM_CONTENT]:
-        content_val = input_value_check(content, int(mi[CM_CONTENT][content]), "string")
-        with open(global_file_path, "a") as file:
-            file.write(content_val + "\t")
-        if content_val is None:
-            return "Max tries expired!"
-        print("[INFO] - \t{} value entered {}".format(content, content_val))
-        mi[CM_CONTENT][content] = content_val
-
-    for content in mi[OEM_CONTENT_DYNAMIC_1]:
-        content_val = input_value_check(content, int(mi[OEM_CONTENT_DYNAMIC_1][content]), "string")
-        with open(global_file_path, "a") as file:
-            file.write(content_val + "\t")
-        if content_val is None:
-            return "Max tries expired!"
-        print("[INFO] - \t{} value entered '{}'".format(content, content_val))
-        mi[OEM_CONTENT_DYNAMIC_1][content] = content_val
-
-    for content in mi[OEM_CONTENT_DYNAMIC_2]:
-        content_val = input_value_check(content, int(mi[OEM_CONTENT_DYNAMIC_2][content]), "string")
-        with open(global_file_path, "a") as file:
-            file.write(content_val + "\n")
-        if content_val is None:
-            return "Max tries expired!"
-        print("[INFO] - \t{} value entered '{}'".format(content, content_val))
-        mi[OEM_CONTENT_DYNAMIC_2][content] = content_val
-
-    mi[CM_CONTENT][RESERVED_CM] = 0
-    mi[OEM_CONTENT_DYNAMIC_2][RESERVED_OEM] = 0
-    return None
+def load_template(mi_file_name):
+    """Read an input MI file into a template: {section: {field: value}} in file order"""
+    mi_data = configparser.ConfigParser(allow_no_value=True)
+    if not mi_data.read(mi_file_name):
+        raise FileNotFoundError("MI data file {} not found".format(mi_file_name))
+    return {mi_section: dict(mi_data[mi_section]) for mi_section in mi_data.sections()}
+
+def mi_fields(mi_data):
+    """List the (field, value) pairs of the MI data (template or ConfigParser) in packing order"""
+    sections = mi_data.sections() if isinstance(mi_data, configparser.ConfigParser) else mi_data
+    return [(fld, mi_data[mi_section][fld]) for mi_section in sections for fld in mi_data[mi_section]]
 
-def writeAddrVal(val_list, output_bin):
-    val = val_list.split(",")
-    ret_array = []
-    for _, addr_str in enumerate(val):
-        addr = str2dec(str(addr_str))
-        addr_el = pack('<B', addr)
-        output_bin.write(addr_el)
-        ret_array.append(addr)
+def dynamic_field_sizes(mi_data):
+    """Map each dynamic MI field to its maximum size, as given in the input MI file"""
+    return {fld: int(mi_data[mi_section][fld]) for mi_section in DYNAMIC_SECTIONS for fld in mi_data[mi_section]}
+
+def writeAddrVal(val_list, image, offset, packer):
+    ret_array = [str2dec(str(addr_str).strip()) for addr_str in val_list.split(",")]
+    packer.pack_into(image, offset, *ret_array)
     return ret_array
 
 def str2dec(string):
@@ -151,57 +248,696 @@ def get_pack_type(filed_type, field_size):
         print("[Error] - Unknown field type found {}".format(filed_type))
         sys.exit(1)
 
-def pack_field(mi_section, fld, mi_config_file_name, output_bin):
-    "Pack MI field based on its size and type"
-    global Value_of_size_field
-    with open(mi_config_file_name, newline='') as mi_config_csv:
-        mi_config = csv.reader(mi_config_csv, delimiter=',')
-        field_type = field_size = None
-        for row in mi_config:
-            if row[0] == fld:
-                field_name = row[0]
-                field_type = row[1]
-                field_size = row[2]
-        if field_size is None:
-            print("[ERROR] - Field name {} not found in config file".format(fld))
-            return None
-        print("[INFO] - Packing Field: '{}'".format(field_name))
-
-        if field_type in ('uint', 'byte', 'word'):
-            filed_value = mi_section.get(fld)
-            packed_value = pack(get_pack_type(field_type, field_size), str2dec(filed_value))
-            output_bin.write(packed_value)
-        elif field_type == 'str':
-            filed_value = bytearray(mi_section.get(fld).encode('utf-8'))
-            packed_value = pack(get_pack_type(field_type, field_size), filed_value)
-            output_bin.write(packed_value)
+def load_layout(mi_config_file_name, cache_dir=None):
+    """Parse and validate the MI config file once, returning the compiled MILayout
+
+    With cache_dir the compiled layout is kept there, named by the SHA-256 of the config content,
+    and a config compiled before is loaded from it without parsing and validating it again.
+    """
+    if cache_dir is None:
+        with open(mi_config_file_name, newline='') as mi_config_csv:
+            return compile_layout(mi_config_csv, mi_config_file_name)
+
+    with open(mi_config_file_name, 'rb') as mi_config_csv:
+        content = mi_config_csv.read()
+    cache_file = os.path.join(cache_dir, hashlib.sha256(content).hexdigest() + '.json')
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached['format'] == LAYOUT_CACHE_FORMAT:
+            return layout_from_fields(cached['fields'])
+    except (OSError, ValueError, KeyError, TypeError, error):
+        pass  # not cached yet or unreadable, compile it again
+
+    layout = compile_layout(content.decode('utf-8').splitlines(), mi_config_file_name)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        compiled = {'format': LAYOUT_CACHE_FORMAT, 'source': os.path.realpath(mi_config_file_name),
+                    'fields': layout_fields(layout)}
+        write_atomic(cache_file, json.dumps(compiled).encode())
+    except OSError as e:
+        print("[INFO] - Compiled layout not cached: {}".format(e))
+    return layout
+
+def layout_fields(layout):
+    """Compiled layout as plain (name, offset, type, size, struct format) tuples, see layout_from_fields()"""
+    return [(fld.name, fld.offset, fld.type, fld.size, fld.packer.format) for fld in layout]
+
+def layout_from_fields(fields):
+    """MILayout from the tuples of layout_fields(), without parsing or validating a config again"""
+    return MILayout(LayoutField(name, offset, field_type, size, Struct(fmt))
+                    for name, offset, field_type, size, fmt in fields)
+
+def compile_layout(lines, source):
+    """Parse and validate the lines of an MI config file into an MILayout, raises LayoutError"""
+    fields = []
+    errors = []
+    offset = 0
+    for line_no, row in enumerate(csv.reader(lines, delimiter=','), 1):
+        if not row or not row[0].strip():
+            continue
+        if len(row) < 3:
+            errors.append("line {}: expected 'name,type,size'".format(line_no))
+            continue
+        field_name, field_type, field_size = (col.strip() for col in row[:3])
+        if field_type not in FIELD_TYPE_SIZES:
+            errors.append("line {}: unknown field type '{}' for {}".format(line_no, field_type, field_name))
+            continue
+        try:
+            size = int(field_size)
+        except ValueError:
+            errors.append("line {}: invalid size '{}' for {}".format(line_no, field_size, field_name))
+            continue
+        fixed_size = FIELD_TYPE_SIZES[field_type]
+        if size <= 0 or (fixed_size is not None and size != fixed_size):
+            errors.append("line {}: {} field {} cannot be {} bytes".format(line_no, field_type, field_name, size))
+            continue
+        if any(fld.name == field_name for fld in fields):
+            errors.append("line {}: duplicate field {}".format(line_no, field_name))
+            continue
+        if field_type == 'array':
+            packer = Struct('<{}B'.format(size))
+        else:
+            packer = Struct(get_pack_type(field_type, str(size)))
+        fields.append(LayoutField(field_name, offset, field_type, size, packer))
+        offset += size
+
+    if not fields:
+        errors.append("no fields defined")
+    elif fields[-1].name != MI_CRC_FIELD or fields[-1].type != 'uint':
+        errors.append("last field must be '{}' of type uint".format(MI_CRC_FIELD))
+    if errors:
+        raise LayoutError("{}: {}".format(source, "; ".join(errors)))
+    return MILayout(fields)
+
+def check_layout(fields, layout):
+    """Check the (field, value) pairs of the MI data against the layout before any bytes are written"""
+    errors = []
+    offset = 0
+    seen = set()
+    size_value = None
+    for fld, value in fields:
+        if fld not in layout:
+            errors.append("field {} not found in config file".format(fld))
+            continue
+        if fld in seen:
+            errors.append("duplicate field {}".format(fld))
+            continue
+        seen.add(fld)
+        if layout[fld].offset != offset:
+            errors.append("field {} at offset {}, config expects {}".format(fld, offset, layout[fld].offset))
+        offset += layout[fld].size
+        if fld == MI_SIZE_FIELD:
+            size_value = value
+
+    missing = [fld.name for fld in layout if fld.name not in seen and fld is not layout.crc]
+    if missing:
+        errors.append("missing field(s) {}".format(", ".join(missing)))
+
+    try:
+        if size_value is None or str2dec(size_value) != layout.size:
+            errors.append("'{}' header {} does not match config size {}".format(MI_SIZE_FIELD, size_value, layout.size))
+    except ValueError:
+        errors.append("invalid '{}' header {}".format(MI_SIZE_FIELD, size_value))
+
+    if errors:
+        raise LayoutError("; ".join(errors))
+
+def pack_field(fld, filed_value, layout, image, verbose=True):
+    "Pack MI field based on its size and type into the image at its layout offset"
+    if fld not in layout:
+        raise LayoutError("Field name {} not found in config file".format(fld))
+    field = layout[fld]
+    if verbose:
+        print("[INFO] - Packing Field: '{}'".format(field.name))
+
+    try:
+        if field.type in ('uint', 'byte', 'word'):
+            field.packer.pack_into(image, field.offset, str2dec(filed_value))
+        elif field.type == 'str':
+            field.packer.pack_into(image, field.offset, filed_value.encode('utf-8'))
+        else:
+            writeAddrVal(filed_value, image, field.offset, field.packer)
+    except (error, ValueError) as e:
+        raise ValueError("Field {} value '{}' cannot be packed: {}".format(fld, filed_value, e))
+
+    return field
+
+def write_atomic(file_path, data, durable=False):
+    """Write data to a temporary file next to file_path and rename it into place
+
+    Readers never see a partially written file; with durable the data is synced to disk before the rename.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(file_path), suffix='.tmp',
+                                    dir=os.path.dirname(file_path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def write_bin(output, name, image, durable=False):
+    """Write one board's image as <name>.bin, returns the real path of the bin file
+
+    output: a mi_bin_store.BinStore (dated, sharded, deduplicated; an identical image is not written
+    again, a changed one gets a new version) or a folder, where the file is written as is.
+    """
+    if not isinstance(output, mi_bin_store.BinStore):
+        output_file = os.path.realpath(os.path.join(output, name + ".bin"))
+        write_atomic(output_file, image, durable)
+        return output_file
+    with output.transaction():
+        placement = output.place(name, mi_bin_store.content_hash(image))
+        if placement.new:
+            write_atomic(placement.path, image, durable)
+            output.add(placement, len(image))
+    return placement.path
+
+def audit_ini(template, values):
+    """The INI text of one board: the template's sections with the board's values, kept for auditing"""
+    mi_data = configparser.ConfigParser(allow_no_value=True)
+    mi_data.add_section('warning')
+    mi_data.set('warning', "; This is an autogenerated file. !DO NOT MODIFY!")
+    for mi_section, fields in template.sections:
+        mi_data.add_section(mi_section)
+        for fld in fields:
+            mi_data.set(mi_section, fld, str(values[fld]))
+    text = io.StringIO()
+    mi_data.write(text, space_around_delimiters=False)
+    return text.getvalue()
+
+_bin_store = None
+
+def get_bin_store():
+    """Bin store next to the script (dated and sharded output folders), opened once per process"""
+    global _bin_store
+    if _bin_store is None:
+        _bin_store = mi_bin_store.BinStore(parent_folder)
+    return _bin_store
+
+def get_record_store_path():
+    """Production record store next to the script, shared by all dated output folders"""
+    return os.path.join(parent_folder, mi_record_store.RECORD_STORE_NAME)
+
+def get_layout_cache_dir():
+    return os.path.join(parent_folder, LAYOUT_CACHE_NAME)
+
+def read_manifest(manifest_file_name):
+    """Yield (row number, values, error) for each board of a CSV or JSONL manifest"""
+    with open(manifest_file_name, newline='', encoding='utf-8-sig') as manifest:
+        if os.path.splitext(manifest_file_name)[1].lower() in ('.jsonl', '.json'):
+            for row_no, line in enumerate(manifest, 1):
+                if not line.strip():
+                    continue
+                try:
+                    values = json.loads(line)
+                except ValueError as e:
+                    yield row_no, None, "invalid JSON: {}".format(e)
+                    continue
+                if not isinstance(values, dict):
+                    yield row_no, None, "expected a JSON object"
+                    continue
+                yield row_no, values, None
+        else:
+            reader = csv.DictReader(manifest)
+            for values in reader:
+                if None in values:
+                    yield reader.line_num, None, "more values than header columns"
+                    continue
+                yield reader.line_num, values, None
+
+def board_values(template, dynamic_sizes, row, allocated=None, layout=None):
+    """Merge one manifest row into the template values, returns (values, error, field in error)
+
+    allocated: per-board values assigned by the tool (e.g. MACs from the pool) replacing template values
+    layout: checks values against their config types, see check_column()
+    """
+    unknown = [str(fld) for fld in row if fld not in dynamic_sizes]
+    if unknown:
+        return None, "unknown field(s) {}".format(", ".join(unknown)), unknown[0]
+    values = dict(template)
+    for fld, max_size in dynamic_sizes.items():
+        value = row.get(fld)
+        if value is None or str(value) == "":
+            return None, "missing value for {}".format(fld), fld
+        value = str(value)
+        err = check_value(fld, value, max_size, layout[fld].type if layout is not None else None)
+        if err:
+            return None, err, fld
+        values[fld] = value
+    if allocated:
+        values.update(allocated)
+    return values, None, None
+
+def prepare_template(template, layout):
+    """Check a template against the layout once, so boards can be built from it without re-checking
+
+    Raises LayoutError if the template does not match the layout.
+    """
+    missing = [mi_section for mi_section in DYNAMIC_SECTIONS if mi_section not in template]
+    if missing:
+        raise LayoutError("missing section(s) {}".format(", ".join(missing)))
+    try:
+        dynamic_sizes = dynamic_field_sizes(template)
+    except ValueError as e:
+        raise LayoutError("dynamic field sizes must be numbers: {}".format(e))
+    mi = {mi_section: dict(fields) for mi_section, fields in template.items()}
+    set_reserved_fields(mi)
+    fields = mi_fields(mi)
+    check_layout(fields, layout)
+    name_field = next(iter(mi[OEM_CONTENT_DYNAMIC_1]))
+    static_fields = [(fld, value) for fld, value in fields if fld not in dynamic_sizes]
+    image, dynamic_start, prefix_crc = static_image(static_fields, list(dynamic_sizes), layout)
+    sections = tuple((mi_section, tuple(mi[mi_section])) for mi_section in mi)
+    return PreparedTemplate(dict(fields), dynamic_sizes, name_field, image, dynamic_start, prefix_crc, sections)
+
+_static_images = {}
+
+def static_image(static_fields, dynamic_fields, layout):
+    """Pack the static fields once per template + layout content, returns (image, dynamic_start, prefix_crc)
+
+    Cached by a hash of the static values and the layout, so preparing the same INI + CSV again
+    (e.g. every generate_board() call with a raw template) does not repack them.
+    """
+    key = hashlib.sha256(json.dumps([static_fields, dynamic_fields, [(f.name, f.offset, f.type, f.size)
+                                                                      for f in layout]]).encode()).hexdigest()
+    cached = _static_images.get(key)
+    if cached is None:
+        image = bytearray(layout.size)
+        for fld, value in static_fields:
+            pack_field(fld, value, layout, image, verbose=False)
+        dynamic_start = min((layout[fld].offset for fld in dynamic_fields), default=layout.crc.offset)
+        cached = _static_images[key] = (bytes(image), dynamic_start, zlib.crc32(image[:dynamic_start]))
+    return cached
+
+def patch_mi_image(template, layout, patch):
+    """Copy the template's static image, pack the (field, value) pairs of patch over it and add the CRC
+
+    Every field packer writes its whole field, so the result equals packing all fields from scratch.
+    Raises LayoutError for fields missing from the layout and ValueError for values that cannot be packed.
+    """
+    image = bytearray(template.image)
+    start = template.dynamic_start
+    for fld, value in patch:
+        start = min(start, pack_field(fld, value, layout, image, verbose=False).offset)
+    view = memoryview(image)
+    if start == template.dynamic_start:
+        crc = zlib.crc32(view[start:layout.crc.offset], template.prefix_crc)
+    else:
+        crc = zlib.crc32(view[:layout.crc.offset])
+    layout.crc.packer.pack_into(image, layout.crc.offset, crc)
+    return image
+
+def build_mi(template, layout, values):
+    """Build the complete MI image (with CRC) of one board, without any file I/O
+
+    template: sections from load_template(), or prepare_template() output to skip re-checking it per board
+    layout: compiled config from load_layout()
+    values: {dynamic field: value} of the board
+    Raises LayoutError if the template does not match the layout and ValueError for rejected values.
+    """
+    if not isinstance(template, PreparedTemplate):
+        template = prepare_template(template, layout)
+    board, err, _ = board_values(template.values, template.dynamic_sizes, values, layout=layout)
+    if err:
+        raise ValueError(err)
+    return bytes(patch_mi_image(template, layout, ((fld, board[fld]) for fld in template.dynamic_sizes)))
+
+def parse_mi(data, layout):
+    """Decode an MI image into {field: value}, the inverse of build_mi()
+
+    Numeric fields decode to int, arrays to a list of int and strings to str without the null padding.
+    Raises ValueError if the image size does not match the layout.
+    """
+    if len(data) != layout.size:
+        raise ValueError("MI image is {} bytes, config expects {}".format(len(data), layout.size))
+    return {field.name: decode_field(field, data) for field in layout}
+
+def decode_field(field, data):
+    """Value of one layout field in an MI image, as returned by parse_mi()"""
+    raw = field.packer.unpack_from(data, field.offset)
+    if field.type == 'str':
+        return raw[0].rstrip(b'\0').decode('utf-8', errors='replace')
+    if field.type == 'array':
+        return list(raw)
+    return raw[0]
+
+def check_crc(data, layout):
+    """Return True if the trailing CRC of an MI image matches its content"""
+    stored = layout.crc.packer.unpack_from(data, layout.crc.offset)[0]
+    return stored == zlib.crc32(memoryview(data)[:layout.crc.offset])
+
+def diff_mi(old, new, layout):
+    """Fields whose bytes differ between two MI images: [(field, old value, new value)]
+
+    Both images must have the layout size, see parse_mi().
+    """
+    for data in (old, new):
+        if len(data) != layout.size:
+            raise ValueError("MI image is {} bytes, config expects {}".format(len(data), layout.size))
+    return [(field.name, decode_field(field, old), decode_field(field, new)) for field in layout
+            if old[field.offset:field.offset + field.size] != new[field.offset:field.offset + field.size]]
+
+def dynamic_values(template, values, allocated=None):
+    """The per-board values of a built board, as recorded in the record store"""
+    board = {fld: values[fld] for fld in template.dynamic_sizes}
+    if allocated:
+        board.update(allocated)
+    return board
+
+def generate_board(template, layout, values, output_folder=None, on_event=no_event, store=None, mac_pool=None,
+                   metrics=mi_metrics.no_metrics, audit=False):
+    """Build one board's MI image, record it and write <name>.bin atomically
+
+    output_folder: folder or mi_bin_store.BinStore to write to, see write_bin() (default: get_bin_store()).
+    With audit the board's MI data is also written as <name>.ini (see audit_ini()) next to the bin file.
+    With a record store the board is recorded in the same transaction as the file write, and
+    duplicate serials raise mi_record_store.DuplicateError before anything is written.
+    A bin store refusing a changed image raises mi_bin_store.BinCollisionError (a ValueError).
+    With a MAC pool the board's MAC fields are allocated from it (mi_mac_pool.MacPoolError when used up),
+    only once the values passed the checks, so a rejected board takes no addresses.
+    Stage times (mac, pack incl. validation and CRC, record, write) and the board count go to metrics.
+    Returns (path of the bin file, image). Raises like build_mi(), after a validation_error event.
+    """
+    start = time.perf_counter()
+    if not isinstance(template, PreparedTemplate):
+        template = prepare_template(template, layout)
+    allocated = None
+    if mac_pool is not None:
+        board, err, fld = check_board(template, layout, values)
+        if err:
+            on_event("validation_error", field=fld, message=err)
+            raise ValueError(err)
+        # Checked again when the board is recorded
+        err = store.check(dynamic_values(template, board)) if store is not None else None
+        if err:
+            on_event("validation_error", field=None, message=err)
+            raise mi_record_store.DuplicateError(err)
+        with metrics.stage("mac"):
+            allocated = mac_pool.allocate()
+    with metrics.stage("pack"):
+        board, image, err, fld = build_board(template, layout, values, allocated)
+    if err:
+        on_event("validation_error", field=fld, message=err)
+        raise ValueError(err)
+    output = output_folder or get_bin_store()
+    bin_name = board[template.name_field]
+    crc = layout.crc.packer.unpack_from(image, layout.crc.offset)[0]
+    try:
+        if store is None:
+            with metrics.stage("write"):
+                output_file = write_bin(output, bin_name, image, durable=True)
         else:
-            packed_value = writeAddrVal(mi_section.get(fld), output_bin)
+            recorded = dynamic_values(template, board, allocated)
+            with store.transaction():
+                # The serials are checked before the write, the board is recorded with the path the file got
+                record_start = time.perf_counter()
+                err = store.check(recorded)
+                if err:
+                    raise mi_record_store.DuplicateError(err)
+                record_time = time.perf_counter() - record_start
+                with metrics.stage("write"):
+                    output_file = write_bin(output, bin_name, image, durable=True)
+                record_start = time.perf_counter()
+                store.add(recorded, output_file, crc, (record_start - start) * 1000)
+                metrics.observe("record", record_time + time.perf_counter() - record_start)
+    except mi_record_store.DuplicateError as e:
+        on_event("validation_error", field=None, message=str(e))
+        raise
+    except mi_bin_store.BinCollisionError as e:
+        on_event("validation_error", field=template.name_field, message=str(e))
+        raise
+    if audit:
+        write_atomic(os.path.splitext(output_file)[0] + ".ini", audit_ini(template, board).encode())
+    metrics.count("generated")
+    on_event("generated", path=os.path.realpath(output_file), size=len(image), crc=crc)
+    return output_file, image
+
+def check_board(template, layout, row):
+    """Validate one manifest row without packing it, returns (values, error, field in error)"""
+    values, err, fld = board_values(template.values, template.dynamic_sizes, row, None, layout)
+    if err:
+        return None, err, fld
+    err = check_file_name(template.name_field, values[template.name_field])
+    if err:
+        return None, err, template.name_field
+    return values, None, None
+
+def build_board(template, layout, row, allocated=None):
+    """Validate and pack one manifest row, returns (values, image, error, field in error)"""
+    values, err, fld = check_board(template, layout, row)
+    if err:
+        return None, None, err, fld
+    if allocated:
+        values.update(allocated)
+    patch = [(fld, values[fld]) for fld in template.dynamic_sizes]
+    if allocated:
+        patch += allocated.items()
+    try:
+        image = patch_mi_image(template, layout, patch)
+    except (LayoutError, ValueError) as e:
+        return None, None, str(e), None
+    return values, bytes(image), None, None
+
+def build_rows(template, layout, rows):
+    """Build (row number, values, error, allocated values) manifest rows, yielding (row number, values, image, error)"""
+    for row_no, row, err, allocated in rows:
+        values = image = None
+        if err is None:
+            values, image, err, _ = build_board(template, layout, row, allocated)
+        yield row_no, values, image, err
+
+_worker_state = {}
+
+def _init_batch_worker(template, fields):
+    """Process pool initializer: rebuild the compiled layout once per worker"""
+    _worker_state['template'] = template
+    _worker_state['layout'] = layout_from_fields(fields)
+
+def _build_rows_worker(rows):
+    return list(build_rows(_worker_state['template'], _worker_state['layout'], rows))
 
-        if field_name == "size":
-            Value_of_size_field = str2dec(filed_value)
+def build_batch_parallel(template, layout, rows, jobs):
+    """Spread manifest row chunks over a process pool, yielding built rows in manifest order"""
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(template, layout_fields(layout))) as pool:
+        pending = deque()
+        while True:
+            # Keep a bounded number of chunks in flight so memory does not grow with the manifest
+            while len(pending) < jobs * 4:
+                chunk = list(islice(rows, BATCH_CHUNK_SIZE))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_build_rows_worker, chunk))
+            if not pending:
+                break
+            yield from pending.popleft().result()
 
-        return field_size
+def validate_rows(template, layout, rows, store=None):
+    """Validate a whole batch column by column before anything is packed
 
-def pack_mi_data(mi_data, mi_config_file_name, output_bin):
-    """Parse through MI data file, section by section, packing each field"""
-    field_count = mi_size = 0
-    for mi_section in mi_data.sections():
-        for fld in mi_data[mi_section]:
-            ret = pack_field(mi_data[mi_section], fld, mi_config_file_name, output_bin)
-            if ret is None:
-                return "Pack Failed!"
+    rows: (row number, values, error) from read_manifest(). Every row is checked for unknown and
+    missing fields, the value rules of check_column(), a valid bin file name and serials that are
+    unique within the batch and not recorded for another board in store.
+    Returns (valid rows as (row number, values, None), [(row number, field, message)] of all errors).
+    """
+    errors = []
+    candidates = []
+    bad = set()
+    def reject(i, fld, message):
+        errors.append((candidates[i][0], fld, message))
+        bad.add(i)
+
+    for row_no, row, err in rows:
+        if err is not None:
+            errors.append((row_no, None, err))
+            continue
+        candidates.append((row_no, row))
+        unknown = [str(fld) for fld in row if fld not in template.dynamic_sizes]
+        if unknown:
+            reject(len(candidates) - 1, unknown[0], "unknown field(s) {}".format(", ".join(unknown)))
+
+    for fld, max_size in template.dynamic_sizes.items():
+        present, values = [], []
+        for i, (_, row) in enumerate(candidates):
+            value = row.get(fld)
+            if value is None or str(value) == "":
+                reject(i, fld, "missing value for {}".format(fld))
+            else:
+                present.append(i)
+                values.append(str(value))
+        for j, message in check_column(fld, values, max_size, layout[fld].type):
+            reject(present[j], fld, message)
+
+    name_field = template.name_field
+    for i, (_, row) in enumerate(candidates):
+        name = str(row.get(name_field, ""))
+        err = check_file_name(name_field, name) if name else None
+        if err:
+            reject(i, name_field, err)
+
+    unique_fields = store.unique_fields if store is not None else mi_record_store.UNIQUE_FIELDS
+    for fld in dict.fromkeys((name_field,) + tuple(unique_fields)):
+        if fld not in template.dynamic_sizes:
+            continue
+        first_row = {}
+        for i, (row_no, row) in enumerate(candidates):
+            value = str(row.get(fld, ""))
+            if value == "":
+                continue
+            if value in first_row:
+                reject(i, fld, "duplicate {} '{}' (also in row {})".format(fld, value, first_row[value]))
             else:
-                mi_size += int(ret)
-            field_count += 1
-    print("[INFO] - MI data size = {}".format(mi_size))
-    print("[INFO] - Field count = {}".format(field_count))
-    return mi_size
+                first_row[value] = row_no
+
+    if store is not None:
+        for i, (_, row) in enumerate(candidates):
+            if i not in bad:
+                err = store.check(row)
+                if err:
+                    reject(i, None, err)
+
+    errors.sort(key=lambda error: error[0])
+    return [(row_no, row, None) for i, (row_no, row) in enumerate(candidates) if i not in bad], errors
+
+def allocate_rows(rows, mac_pool=None):
+    """Add the per-board allocated values (MACs) to (row number, values, error) manifest rows"""
+    for row_no, row, err in rows:
+        allocated = None
+        if mac_pool is not None and err is None:
+            try:
+                allocated = mac_pool.allocate()
+            except mi_mac_pool.MacPoolError as e:
+                err = str(e)
+        yield row_no, row, err, allocated
+
+def generate_batch(template, layout, manifest_file_name, output_folder, store=None,
+                   jobs=1, on_event=no_event, mac_pool=None, metrics=mi_metrics.no_metrics,
+                   strict=False, container=None):
+    """Generate one MI bin per manifest row without prompting, returns (generated, failed) counts
+
+    All rows are validated first (validate_rows()) and every error is reported; the valid rows are
+    generated, with strict nothing is generated if any row is invalid. With jobs > 1 rows are packed
+    in a process pool; MACs, files and records are still handled here only.
+    output_folder: folder or mi_bin_store.BinStore the bin files are written to, see write_bin().
+    Records are committed every BATCH_CHUNK_SIZE boards. With container (a file path) the images are
+    written into one multi-board container (mi_container) instead of one bin file each, and all records
+    are committed when the container is complete. The pack stage time given to metrics is
+    the chunk average per board (reading, validation, MAC allocation and packing).
+    """
+    template = prepare_template(template, layout)
+    bins = output_folder if isinstance(output_folder, mi_bin_store.BinStore) else None
+    folder = bins.day_folder() if bins is not None else output_folder
+    with metrics.stage("validate"):
+        rows, errors = validate_rows(template, layout, read_manifest(manifest_file_name), store)
+    for row_no, fld, message in errors:
+        print("[ERROR] - Row {}: {}".format(row_no, message))
+        on_event("row_error", row=row_no, field=fld, message=message)
+    invalid = len({row_no for row_no, _, _ in errors})
+    if invalid and strict:
+        print("[ERROR] - Batch rejected: {} error(s) in {} row(s), no MI bin file generated".format(len(errors), invalid))
+        on_event("batch_done", generated=0, failed=invalid, folder=os.path.realpath(folder))
+        return 0, invalid
+    rows = allocate_rows(iter(rows), mac_pool)
+    if jobs > 1:
+        results = build_batch_parallel(template, layout, rows, jobs)
+    else:
+        results = build_rows(template, layout, rows)
+
+    generated, failed = 0, invalid
+    written = set()
+    sink = mi_container.ContainerWriter(container, layout) if container else None
+    try:
+        # A container is published as a whole, so its records are committed together once it is written
+        with (store.transaction() if store is not None and sink is not None else nullcontext()):
+            while True:
+                chunk_start = time.perf_counter()
+                chunk = list(islice(results, BATCH_CHUNK_SIZE))
+                if not chunk:
+                    break
+                per_board = (time.perf_counter() - chunk_start) / len(chunk)
+                for _ in chunk:
+                    metrics.observe("pack", per_board)
+                with (store.transaction() if store is not None else nullcontext()), \
+                        (bins.transaction() if bins is not None and sink is None else nullcontext()):
+                    for row_no, values, image, err in chunk:
+                        start = time.perf_counter()
+                        allocated = {fld: values[fld] for fld in mac_pool.ranges} if mac_pool is not None and values else None
+                        if err is None:
+                            bin_name = values[template.name_field]
+                            crc = layout.crc.packer.unpack_from(image, layout.crc.offset)[0]
+                            if bin_name in written:
+                                err = "duplicate {} '{}'".format(template.name_field, bin_name)
+                            elif store is not None:
+                                # Checked before the write, recorded with the path the file got
+                                recorded = dynamic_values(template, values, allocated)
+                                err = store.check(recorded)
+                                metrics.observe("record", time.perf_counter() - start)
+                        if err:
+                            print("[ERROR] - Row {}: {}".format(row_no, err))
+                            on_event("row_error", row=row_no, message=err)
+                            failed += 1
+                            continue
+
+                        try:
+                            with metrics.stage("write"):
+                                if sink is None:
+                                    output_file = write_bin(output_folder, bin_name, image)
+                                else:
+                                    output_file = sink.record_path(sink.count)
+                                    sink.add(image)
+                        except mi_bin_store.BinCollisionError as e:
+                            print("[ERROR] - Row {}: {}".format(row_no, e))
+                            on_event("row_error", row=row_no, message=str(e))
+                            failed += 1
+                            continue
+                        if store is not None:
+                            record_start = time.perf_counter()
+                            store.add(recorded, output_file, crc, (record_start - start) * 1000)
+                            metrics.observe("record", time.perf_counter() - record_start)
+                        written.add(bin_name)
+                        generated += 1
+                        metrics.count("generated")
+            if sink is not None:
+                with metrics.stage("write"):
+                    sink.close()
+    except BaseException:
+        if sink is not None:
+            sink.abort()
+        raise
+
+    print("[INFO] - Batch done: {} MI bin file(s) generated in '{}', {} row(s) failed".format(
+        generated, os.path.realpath(container or folder), failed))
+    on_event("batch_done", generated=generated, failed=failed, folder=os.path.realpath(folder))
+    return generated, failed
 
 def main(argv):
     parser = argparse.ArgumentParser(description="MCU MI binary file generator")
     parser.add_argument("-i", "--ini", required=True, help="MCU MI data file")
     parser.add_argument("-c", "--config", required=True, help="MI config file, specifying size and type")
+    parser.add_argument("-b", "--batch", help="Manifest (CSV with header or JSONL) of dynamic values, one board per row")
+    parser.add_argument("--strict", action="store_true",
+                        help="Generate nothing if any row of a batch is invalid (default: generate the valid rows)")
+    parser.add_argument("--container", help="Write the batch into this multi-board container file ({}) "
+                        "instead of one bin file per board".format(mi_container.CONTAINER_EXT))
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes used to pack a batch (default 1)")
+    parser.add_argument("-r", "--records", help="Production record store (default: {} next to this script)".format(
+        mi_record_store.RECORD_STORE_NAME))
+    parser.add_argument("-m", "--mac-pool", help="MAC pool config, allocates the MAC fields of every board")
+    parser.add_argument("-e", "--events", help="Write machine-readable JSON line events to this file ('-' for stdout)")
+    parser.add_argument("--metrics", help="Write stage timings and board counts to this file (Prometheus text format)")
+    parser.add_argument("--collisions", choices=mi_bin_store.COLLISION_POLICIES, default='version',
+                        help="Board whose bin file changed: store a new version (default) or refuse it")
+    parser.add_argument("--audit-ini", action="store_true",
+                        help="Also write each board's MI data as <fazit_id>.ini next to its bin file")
     parser.add_argument("-v", '--version', action='version', version='%(prog)s - {}'.format(VERSION_STRING))
     args = parser.parse_args()
 
@@ -213,80 +949,101 @@ def main(argv):
         print("Error: config file ({0}) not found!".format(os.path.realpath(args.config)))
         sys.exit(1)
 
-    # Stage 1: Allow user to input dynamic MI fileds, write the data to modified MI data file.
-    # Input: mi.ini
-    # Output: mi_modified.ini
-    # Stage 1: Allow user to input dynamic MI fields
-    str_no_ext = os.path.splitext(args.ini)[0]
-    modified_mi_fl_name = str_no_ext + "_modified.ini"
-
-    if os.path.isfile(modified_mi_fl_name):
-        os.remove(modified_mi_fl_name)
-
-    mi_data = configparser.ConfigParser(allow_no_value=True)
-    mi_data.add_section('warning')
-    mi_data.set('warning', "; This is an autogenerated file. !DO NOT MODIFY!")
-    mi_data.read(args.ini)
-
-    ret = edit_mi_data(mi_data)
-    if ret:
-        print("[ERROR] - MI data file modification Failed! Error: {}".format(ret))
-        sys.exit(1)
-
-    with open(modified_mi_fl_name, 'w') as config_out:
-        mi_data.write(config_out, space_around_delimiters=False)
-    print("[INFO] - MI data file:{} modified successfully".format(modified_mi_fl_name))
+    metrics = mi_metrics.Metrics() if args.metrics else mi_metrics.no_metrics
+    startup = mi_metrics.process_age()
+    if startup is not None:
+        metrics.observe("startup", startup)
+    stage_start = time.perf_counter()
 
-    # Stage 2: Generate MI bin file from modified MI data file
-    # Determine output filename dynamically from fazit_id_string
-    temp_mi = configparser.ConfigParser(allow_no_value=True)
-    temp_mi.read(modified_mi_fl_name)
+    on_event = no_event
+    if args.events:
+        on_event = json_event_sink(sys.stdout if args.events == '-' else open(args.events, 'a'))
 
-    if OEM_CONTENT_DYNAMIC_1 not in temp_mi or len(temp_mi[OEM_CONTENT_DYNAMIC_1].keys()) == 0:
-        print("[ERROR] - '{}' section missing or empty in modified ini file!".format(OEM_CONTENT_DYNAMIC_1))
+    try:
+        layout = load_layout(args.config, get_layout_cache_dir())
+    except LayoutError as e:
+        print("[ERROR] - Invalid config file: {}".format(e))
+        on_event("error", message="Invalid config file: {}".format(e))
         sys.exit(1)
 
-    first_key = list(temp_mi[OEM_CONTENT_DYNAMIC_1].keys())[0]  # 'fazit_id_string'
-    fazit_value = temp_mi[OEM_CONTENT_DYNAMIC_1][first_key]
-
-    # --- NEW: Save to 'bin' folder in parent directory ---
-    parent_folder = os.path.dirname(os.path.abspath(__file__))  # parent folder of the script
+    store = mi_record_store.RecordStore(args.records or get_record_store_path())
+    bins = get_bin_store()
+    bins.collisions = args.collisions
 
-    # Create a folder with the current date (YYYYMMDD)
-    date_folder = datetime.now().strftime("%Y%m%d")
-    output_folder = os.path.join(parent_folder, date_folder)
-    os.makedirs(output_folder, exist_ok=True)  # create folder if it doesn't exist
+    mac_pool = None
+    if args.mac_pool:
+        try:
+            mac_pool = mi_mac_pool.MacPool(args.mac_pool)
+            mac_pool.check_layout(layout)
+        except (mi_mac_pool.MacPoolError, ValueError) as e:
+            print("[ERROR] - Invalid MAC pool: {}".format(e))
+            on_event("error", message="Invalid MAC pool: {}".format(e))
+            sys.exit(1)
 
-    # Construct output file path
-    output_file = os.path.join(output_folder, f"{fazit_value}.bin")
-    # -----------------------------------------------
+    if args.batch:
+        if not os.path.isfile(args.batch):
+            print("Error: manifest file ({0}) not found!".format(os.path.realpath(args.batch)))
+            sys.exit(1)
+        try:
+            template = load_template(args.ini)
+            metrics.observe("load", time.perf_counter() - stage_start)
+            generated, failed = generate_batch(template, layout, args.batch, bins,
+                                               store, max(1, args.jobs), on_event, mac_pool, metrics,
+                                               args.strict, args.container)
+        except LayoutError as e:
+            print("[ERROR] - MI data file does not match config file: {}".format(e))
+            on_event("error", message="MI data file does not match config file: {}".format(e))
+            sys.exit(1)
+        finally:
+            if mac_pool is not None:
+                mac_pool.close()
+        if args.metrics:
+            metrics.export(args.metrics)
+        sys.exit(1 if failed else 0)
 
-    if os.path.isfile(output_file):
-        os.remove(output_file)
-    output_bin = open(output_file, "ab")
-
-    mi_data = configparser.ConfigParser(allow_no_value=True)
-    mi_data.read(modified_mi_fl_name)
-
-    # Pack MI data
-    mi_size = pack_mi_data(mi_data, args.config, output_bin)
-    output_bin.close()
-
-    output_size = os.path.getsize(output_file)
-    if output_size != (Value_of_size_field - 4):
-        print("[ERROR] - miscalculation size info ({0})!".format(output_size))
-        print("[ERROR] - miscalculation size info ({0})!".format(Value_of_size_field))
+    # Interactive: prompt for one board's dynamic values and generate it from the parsed template,
+    # no intermediate INI file is written (--audit-ini keeps one per board next to its bin file)
+    try:
+        template = prepare_template(load_template(args.ini), layout)
+    except LayoutError as e:
+        print("[ERROR] - MI data file does not match config file: {}".format(e))
+        on_event("error", message="MI data file does not match config file: {}".format(e))
         sys.exit(1)
+    metrics.observe("load", time.perf_counter() - stage_start)
 
-    # Calculate CRC32 and append
-    with open(output_file, "rb") as f:
-        output_bin_crc32 = str2dec(hex(zlib.crc32(f.read()) & 0xffffffff))
-    print("[INFO] - CRC calculated: {}".format(hex(output_bin_crc32)))
+    stage_start = time.perf_counter()
+    values, err = prompt_board_values(template, layout, on_event)
+    metrics.observe("input", time.perf_counter() - stage_start)
+    if err:
+        print("[ERROR] - MI data input Failed! Error: {}".format(err))
+        on_event("error", message=err)
+        sys.exit(1)
 
-    with open(output_file, "ab") as f:
-        f.write(pack('<I', output_bin_crc32))
+    # Checked before a MAC is allocated, store.add() checks again when the board is recorded
+    with metrics.stage("validate"):
+        err = store.check(values)
+    if err:
+        print("[ERROR] - {}".format(err))
+        on_event("error", message=err)
+        sys.exit(1)
 
+    try:
+        output_file, image = generate_board(template, layout, values, bins, on_event, store, mac_pool,
+                                            metrics, args.audit_ini)
+    except (ValueError, mi_mac_pool.MacPoolError) as e:
+        print("[ERROR] - {}".format(e))
+        on_event("error", message=str(e))
+        sys.exit(1)
+    finally:
+        if mac_pool is not None:
+            mac_pool.close()
+    print("[INFO] - CRC calculated: {}".format(hex(layout.crc.packer.unpack_from(image, layout.crc.offset)[0])))
+    print("[INFO] - Board recorded in '{}'".format(os.path.realpath(store.path)))
     print("[INFO] - MI bin file generated: '{}'".format(os.path.realpath(output_file)))
+    if args.audit_ini:
+        print("[INFO] - MI data written to '{}'".format(os.path.realpath(os.path.splitext(output_file)[0] + ".ini")))
+    if args.metrics:
+        metrics.export(args.metrics)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,31 @@
+"""Shared fixtures of the tests: the repository's MI data file, config and generated manifests"""
+import os
+import json
+
+import pytest
+
+import MI_bin_generator as mi_gen
+from mi_benchmark import board_row
+
+here = os.path.dirname(os.path.abspath(__file__))
+INI = os.path.join(here, "sv62_c_mcu_mi.ini")
+CONFIG = os.path.join(here, "mi_config.csv")
+
+@pytest.fixture(scope="session")
+def layout():
+    return mi_gen.load_layout(CONFIG)
+
+@pytest.fixture(scope="session")
+def mi_data():
+    return mi_gen.load_template(INI)
+
+@pytest.fixture(scope="session")
+def template(mi_data, layout):
+    return mi_gen.prepare_template(mi_data, layout)
+
+@pytest.fixture
+def manifest(tmp_path):
+    """JSONL manifest of 40 valid boards"""
+    path = tmp_path / "boards.jsonl"
+    path.write_text("".join(json.dumps(board_row(i)) + "\n" for i in range(40)))
+    return str(path)
@@ -0,0 +1,115 @@
+"""Stand-in for S32FlashTool.exe to run the flashing code without hardware.
+
+Accepts the S32FlashTool arguments used by mi_flasher and prints similar output. Use it with
+MI_FLASH_TOOL="python fake_s32flashtool.py". Behaviour is set through environment variables:
+
+  FAKE_FLASH_DELAY   seconds one program/download step takes (default 0.5)
+  FAKE_FLASH_FAIL    comma separated ports that report an error
+  FAKE_FLASH_FLAKY   comma separated ports that fail every other run
+  FAKE_FLASH_HANG    comma separated ports that never finish (for timeouts)
+  FAKE_FLASH_DIR     folder with the fake state: one <port>.mem file per port holding
+                     the programmed data, flaky port run counters and <port>.algo markers
+                     for a downloaded flash algorithm (delete them to simulate a power cycle);
+                     with it, -fprogram without -a fails unless the algorithm was downloaded
+"""
+import os
+import sys
+import time
+import ntpath
+import argparse
+
+def env_ports(name):
+    return {p.strip() for p in os.environ.get(name, "").split(",") if p.strip()}
+
+def state_file(port, ext):
+    folder = os.environ.get("FAKE_FLASH_DIR")
+    if not folder:
+        return None
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, "{}{}".format(port.replace(os.sep, "_").replace("/", "_"), ext))
+
+def flaky_fails(port):
+    """Fail the odd runs of a flaky port, counted in FAKE_FLASH_DIR (or always without it)"""
+    path = state_file(port, ".runs")
+    if path is None:
+        return True
+    runs = int(open(path).read()) if os.path.isfile(path) else 0
+    with open(path, "w") as f:
+        f.write(str(runs + 1))
+    return runs % 2 == 0
+
+def program(port, bin_path, addr):
+    with open(bin_path, "rb") as f:
+        data = f.read()
+    path = state_file(port, ".mem")
+    if path:
+        with open(path, "wb") as f:
+            f.write(addr.to_bytes(4, "big") + data)
+    return len(data)
+
+def read(port, addr, size):
+    """Programmed data at addr, erased flash (0xFF) elsewhere"""
+    path = state_file(port, ".mem")
+    data = b""
+    if path and os.path.isfile(path):
+        with open(path, "rb") as f:
+            mem = f.read()
+        if int.from_bytes(mem[:4], "big") == addr:
+            data = mem[4:4 + size]
+    return data + b"\xff" * (size - len(data))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Fake S32FlashTool")
+    parser.add_argument("-t", dest="target", required=True)
+    parser.add_argument("-a", dest="algorithm")
+    parser.add_argument("-fprogram", action="store_true")
+    parser.add_argument("-fread", action="store_true")
+    parser.add_argument("-size", type=lambda v: int(v, 0), default=0)
+    parser.add_argument("-f", dest="file")
+    parser.add_argument("-addr", default="0x0")
+    parser.add_argument("-i", dest="interface", default="uart")
+    parser.add_argument("-p", dest="port", required=True)
+    args = parser.parse_args(argv)
+    delay = float(os.environ.get("FAKE_FLASH_DELAY", "0.5"))
+
+    print("S32FlashTool (fake) - {} on {}".format(args.interface, args.port), flush=True)
+    if args.port in env_ports("FAKE_FLASH_HANG"):
+        print("Connecting to target: ", end="", flush=True)
+        while True:
+            time.sleep(60)
+    if args.port in env_ports("FAKE_FLASH_FAIL") or (args.port in env_ports("FAKE_FLASH_FLAKY") and flaky_fails(args.port)):
+        time.sleep(delay)
+        print("Error: no response from target on {}".format(args.port), flush=True)
+        return 1
+
+    print("Downloading target {} ... ".format(ntpath.basename(args.target)), end="", flush=True)
+    time.sleep(delay / 2)
+    print("done", flush=True)
+    algo_marker = state_file(args.port, ".algo")
+    if args.algorithm:
+        print("Downloading flash algorithm {} ... ".format(ntpath.basename(args.algorithm)), end="", flush=True)
+        time.sleep(delay / 2)
+        print("done", flush=True)
+        if algo_marker:
+            open(algo_marker, "w").close()
+    elif algo_marker and (args.fprogram or args.fread) and not os.path.isfile(algo_marker):
+        print("Error: flash algorithm not loaded", flush=True)
+        return 1
+    if args.fprogram:
+        if not args.file or not os.path.isfile(args.file):
+            print("Error: file {} not found".format(args.file), flush=True)
+            return 1
+        size = program(args.port, args.file, int(args.addr, 0))
+        time.sleep(delay)
+        print("Programming {} bytes at {}: 100% ".format(size, args.addr), flush=True)
+        print("Program successfully completed", flush=True)
+    if args.fread:
+        data = read(args.port, int(args.addr, 0), args.size)
+        with open(args.file, "wb") as f:
+            f.write(data)
+        time.sleep(delay / 2)
+        print("Read {} bytes at {}: done".format(len(data), args.addr), flush=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
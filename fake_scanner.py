@@ -0,0 +1,46 @@
+"""Scripted barcode scanner on a pseudo terminal, for testing scanner input without hardware.
+
+  python fake_scanner.py labels.txt --delay 2
+
+Prints the pty device to use as the scanner port (e.g. /dev/pts/5), then "scans" one label per
+line of the file ('-' for stdin) every delay seconds, each followed by CR LF. A GS separator can
+be written as <GS>. POSIX only (pty); on Windows use a virtual COM port pair instead.
+"""
+import os
+import sys
+import tty
+import time
+import argparse
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Fake serial barcode scanner on a pty")
+    parser.add_argument("labels", help="File with one label per line, '-' for stdin")
+    parser.add_argument("-d", "--delay", type=float, default=1.0, help="Seconds between scans (default 1)")
+    parser.add_argument("--start-delay", type=float, default=1.0,
+                        help="Seconds to wait before the first scan, to open the port (default 1)")
+    parser.add_argument("--linger", type=float, default=2.0,
+                        help="Seconds to keep the pty open after the last scan (default 2)")
+    args = parser.parse_args(argv)
+
+    if args.labels == "-":
+        labels = sys.stdin.read().splitlines()
+    else:
+        with open(args.labels) as f:
+            labels = f.read().splitlines()
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    print(os.ttyname(slave), flush=True)
+    time.sleep(args.start_delay)
+    for label in labels:
+        if not label.strip():
+            continue
+        os.write(master, label.replace("<GS>", "\x1d").encode("utf-8") + b"\r\n")
+        print("[INFO] - Scanned {!r}".format(label), file=sys.stderr, flush=True)
+        time.sleep(args.delay)
+    time.sleep(args.linger)
+    os.close(master)
+    os.close(slave)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,315 @@
+"""Benchmarks of the MI generation, verification, flashing and UI hot paths.
+
+  python mi_benchmark.py -o results.json
+  python mi_benchmark.py -o new.json --compare results.json
+
+Every benchmark uses the repository's sv62_c_mcu_mi.ini / mi_config.csv and generated board
+values, so runs are comparable between releases. Results are written as JSON; --compare
+reports the change against an earlier result file and exits non-zero on a regression.
+Benchmarks needing the Tk UI are reported as skipped when no display is available.
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import zlib
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+from datetime import datetime
+
+import MI_bin_generator as mi_gen
+import MI_bin_decoder
+import mi_container
+import mi_flasher
+import mi_record_store
+import mi_service
+
+BENCH_FORMAT = 1
+DEFAULT_BATCH_SIZES = (1000, 10000, 100000)
+REGRESSION_THRESHOLD = 0.10   # slower by more than this fraction is a regression
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def board_row(i):
+    return {"debug_level": "1", "brd_pn": "PN123456", "brd_ver": "7", "vendor_serial_number": "VSN{:07d}".format(i),
+            "production_date": "01012025", "fazit_id_string": "FZ-{:08d}".format(i),
+            "ecu_serial_number": "ECU{:08d}".format(i), "vw_ecu_hw_version_number": "H01"}
+
+def measure(fn, number, repeat=5):
+    """Seconds per call of fn(), best and median of repeat runs of number calls"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return min(times), statistics.median(times)
+
+def result(unit, number, best, median, **extra):
+    return dict(unit=unit, number=number, best_s=best, median_s=median, per_op_us=median * 1e6,
+                ops_per_s=1 / median if median else None, **extra)
+
+class Benchmarks:
+    def __init__(self, ini, csv, workdir):
+        self.ini = ini
+        self.csv = csv
+        self.workdir = workdir
+        self.layout = mi_gen.load_layout(csv)
+        self.mi_data = mi_gen.load_template(ini)
+        self.template = mi_gen.prepare_template(self.mi_data, self.layout)
+        self.values = board_row(0)
+        self.image = bytes(mi_gen.build_mi(self.template, self.layout, self.values))
+
+    def load_layout(self, cached=False):
+        """MI config -> compiled layout, parsed and validated or from the compiled layout cache"""
+        cache_dir = os.path.join(self.workdir, "layout_cache") if cached else None
+        mi_gen.load_layout(self.csv, cache_dir)
+        best, median = measure(lambda: mi_gen.load_layout(self.csv, cache_dir), 200)
+        return result("layout", 200, best, median, cached=cached)
+
+    def generate_board(self):
+        """Dynamic values -> checked, packed and durably written bin file, as the UI and the interactive
+        generator produce each board (without record store and MAC pool)"""
+        folder = os.path.join(self.workdir, "boards")
+        os.makedirs(folder, exist_ok=True)
+        rows = iter(range(10 ** 9))
+        with contextlib.redirect_stdout(io.StringIO()):
+            best, median = measure(lambda: mi_gen.generate_board(
+                self.template, self.layout, board_row(next(rows)), output_folder=folder), 20, repeat=3)
+        shutil.rmtree(folder)
+        return result("board", 20, best, median)
+
+    def build_mi(self):
+        """Prepared template + dynamic values -> image (library / batch path)"""
+        best, median = measure(lambda: mi_gen.build_mi(self.template, self.layout, self.values), 1000)
+        return result("board", 1000, best, median)
+
+    def crc32(self):
+        best, median = measure(lambda: zlib.crc32(self.image[:self.layout.crc.offset]), 10000)
+        return result("image", 10000, best, median, bytes=len(self.image))
+
+    def write_bin(self, durable=False):
+        folder = os.path.join(self.workdir, "write")
+        os.makedirs(folder, exist_ok=True)
+        paths = iter(range(10 ** 9))
+        number = 20 if durable else 200
+        best, median = measure(lambda: mi_gen.write_atomic(
+            os.path.join(folder, "{}.bin".format(next(paths))), self.image, durable), number, repeat=3)
+        shutil.rmtree(folder)
+        return result("file", number, best, median, durable=durable)
+
+    def batch(self, size):
+        """generate_batch of size boards from a JSONL manifest, with the record store (best of 3 up to 10k)"""
+        manifest = os.path.join(self.workdir, "boards_{}.jsonl".format(size))
+        with open(manifest, "w") as f:
+            for i in range(size):
+                f.write(json.dumps(board_row(i)) + "\n")
+        times = []
+        for _ in range(3 if size <= 10000 else 1):
+            folder = os.path.join(self.workdir, "batch_{}".format(size))
+            os.makedirs(folder)
+            with mi_record_store.RecordStore(os.path.join(folder, "records.db")) as store, \
+                    contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                generated, failed = mi_gen.generate_batch(self.mi_data, self.layout, manifest, folder, store)
+                times.append(time.perf_counter() - start)
+            shutil.rmtree(folder)
+            if failed:
+                raise RuntimeError("{} boards failed".format(failed))
+        os.remove(manifest)
+        return result("board", size, min(times) / size, statistics.median(times) / size, total_s=min(times))
+
+    def container_lookup(self, size=10000):
+        """Find a board by fazit ID in a container of size boards and read its record (mmap + index)"""
+        path = os.path.join(self.workdir, "boards.mic")
+        with mi_container.ContainerWriter(path, self.layout) as writer:
+            for i in range(size):
+                writer.add(mi_gen.build_mi(self.template, self.layout, board_row(i)))
+        serials = iter(range(10 ** 9))
+        with mi_container.Container(path) as container:
+            best, median = measure(lambda: container.record(container.find(
+                "fazit_id_string", "FZ-{:08d}".format(next(serials) * 7919 % size))), 1000)
+        os.remove(path)
+        return result("lookup", 1000, best, median, records=size)
+
+    def service(self, size=2000, clients=32):
+        """Boards requested by concurrent clients from the generation service (no HTTP), with the record store"""
+        import threading
+        times = []
+        for _ in range(3):
+            folder = os.path.join(self.workdir, "service")
+            os.makedirs(folder)
+            with mi_record_store.RecordStore(os.path.join(folder, "records.db")) as store:
+                with mi_service.GenerationService(self.template, self.layout, folder, store) as service:
+                    def client(first):
+                        for i in range(first, size, clients):
+                            service.generate(board_row(i))
+                    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+                    start = time.perf_counter()
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    times.append(time.perf_counter() - start)
+                    batches = service.batches
+            shutil.rmtree(folder)
+        return result("board", size, min(times) / size, statistics.median(times) / size, clients=clients,
+                      mean_batch_size=size / batches)
+
+    def verify(self):
+        verify_image = MI_bin_decoder.make_verifier(self.layout, self.template)
+        best, median = measure(lambda: verify_image(self.image), 1000)
+        return result("image", 1000, best, median)
+
+    def flasher_output(self):
+        """Splitting bursty flash tool output into console lines (read_output)"""
+        burst = "".join("Programming block {} of 4096 at 0x{:08X}: {}% \n".format(i, i * 256, i * 100 // 4096)
+                        for i in range(4096))
+        number = 5
+        best, median = measure(lambda: sum(1 for _ in mi_flasher.read_output(io.StringIO(burst))), number, repeat=3)
+        return result("line", 4096, best / 4096, median / 4096, chars=len(burst))
+
+    def format_hex_rows(self):
+        import mi_ui_app
+        big = os.urandom(16 * 1024 * 1024)
+        best, median = measure(lambda: mi_ui_app.format_hex_rows(big, 500000, 40), 1000)
+        return result("screen (40 rows)", 1000, best, median)
+
+    def show_hex(self):
+        """HexViewer open + render + scroll + close on a 16 MiB file"""
+        import mi_ui_app
+        root = tk_root()
+        path = os.path.join(self.workdir, "big.bin")
+        with open(path, "wb") as f:
+            f.write(self.image + os.urandom(16 * 1024 * 1024))
+
+        def open_view():
+            viewer = mi_ui_app.HexViewer(root, path, self.layout)
+            root.update_idletasks()
+            for row in range(0, 4000, 40):
+                viewer.scroll_to(row)
+            root.update_idletasks()
+            viewer.close()
+
+        best, median = measure(open_view, 3, repeat=3)
+        os.remove(path)
+        return result("viewer (100 scrolls)", 3, best, median)
+
+    def console_log(self):
+        """Console inserts as MI_UI.log does, in bursts of flasher output lines"""
+        from tkinter import scrolledtext
+        import tkinter as tk
+        root = tk_root()
+        console = scrolledtext.ScrolledText(root, width=90, height=35)
+        console.pack()
+        lines = ["[COM3] Programming block {} at 0x{:08X}: 42%".format(i, i * 256) for i in range(500)]
+
+        def burst():
+            for line in lines:
+                console.insert(tk.END, line + "\n")
+                console.see(tk.END)
+            root.update()
+
+        best, median = measure(burst, 1, repeat=5)
+        console.destroy()
+        return result("line", len(lines), best / len(lines), median / len(lines))
+
+_tk_root = None
+
+def tk_root():
+    """Shared hidden Tk root; raises RuntimeError without a display"""
+    global _tk_root
+    if _tk_root is None:
+        import tkinter as tk
+        try:
+            _tk_root = tk.Tk()
+        except tk.TclError as e:
+            raise RuntimeError("no display: {}".format(e))
+        _tk_root.withdraw()
+    return _tk_root
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="mi_bench_")
+    try:
+        bench = Benchmarks(args.ini, args.config, workdir)
+        cases = [("load_layout", bench.load_layout), ("load_layout_cached", lambda: bench.load_layout(cached=True)),
+                 ("generate_board", bench.generate_board), ("build_mi", bench.build_mi), ("crc32", bench.crc32),
+                 ("write_bin", bench.write_bin), ("write_bin_durable", lambda: bench.write_bin(durable=True))]
+        cases += [("batch_{}".format(size), lambda size=size: bench.batch(size)) for size in args.sizes]
+        cases += [("container_lookup", bench.container_lookup), ("service", bench.service), ("verify", bench.verify),
+                  ("flasher_output", bench.flasher_output),
+                  ("format_hex_rows", bench.format_hex_rows), ("show_hex", bench.show_hex),
+                  ("console_log", bench.console_log)]
+        results = {}
+        for name, fn in cases:
+            if args.only and name not in args.only:
+                continue
+            try:
+                results[name] = fn()
+                print("[INFO] - {:<18} {:>12.2f} us/{}".format(name, results[name]["per_op_us"], results[name]["unit"]))
+            except (ImportError, RuntimeError) as e:
+                results[name] = {"skipped": str(e)}
+                print("[INFO] - {:<18} skipped: {}".format(name, e))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {"format": BENCH_FORMAT, "created_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "results": results}
+
+def compare(old, new, threshold):
+    """Print the change of the best time per benchmark, returns the names of regressed benchmarks"""
+    regressed = []
+    for name, res in new["results"].items():
+        before = old["results"].get(name, {})
+        if "best_s" not in res or "best_s" not in before:
+            continue
+        change = res["best_s"] / before["best_s"] - 1
+        flag = ""
+        if change > threshold:
+            regressed.append(name)
+            flag = "  REGRESSION"
+        print("[INFO] - {:<18} {:>12.2f} -> {:>12.2f} us/{} ({:+.1%}){}".format(
+            name, before["best_s"] * 1e6, res["best_s"] * 1e6, res["unit"], change, flag))
+    return regressed
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MI generator / flasher benchmarks")
+    parser.add_argument("-i", "--ini", default=os.path.join(here, "sv62_c_mcu_mi.ini"), help="MCU MI data file")
+    parser.add_argument("-c", "--config", default=os.path.join(here, "mi_config.csv"), help="MI config file")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--sizes", type=lambda v: [int(s) for s in v.split(",")], default=list(DEFAULT_BATCH_SIZES),
+                        help="Batch sizes, comma separated (default: {})".format(",".join(map(str, DEFAULT_BATCH_SIZES))))
+    parser.add_argument("--only", nargs="+", help="Run only these benchmarks")
+    parser.add_argument("--compare", help="Earlier result file to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Fraction a benchmark may get slower before it counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("[INFO] - Results written to '{}'".format(os.path.realpath(args.output)))
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(json.load(f), results, args.threshold)
+        if regressed:
+            print("[ERROR] - Regressed: {}".format(", ".join(regressed)))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,347 @@
+"""Bin store: sharded, deduplicated output folders of the generated MI bin files, rolled into daily archives.
+
+Bin files are kept per day and shard, the shard being the first characters of a hash of the
+board's file name (FAZIT IDs share their leading characters, so the ID itself spreads badly):
+
+  YYYYMMDD/<shard>/<fazit_id>.bin
+
+An index (mi_bins.db) lists every stored bin with its SHA-256. Storing an image that is already
+the board's latest bin writes nothing. A board with a changed image (rework) gets a new version,
+<fazit_id>.v2.bin, ..., or is refused (BinCollisionError); an existing file is never replaced.
+
+Finished days are rolled into archive/YYYYMMDD.zip (deflate compressed, same member paths). The
+zip directory indexes the members, so single bins are read from it without extracting the day:
+
+  python mi_bin_store.py rollup                 # archive every finished day, moving its records along
+  python mi_bin_store.py find FAZIT-0001        # versions of a board and where they are
+  python mi_bin_store.py cat FAZIT-0001 -o board.bin
+"""
+import os
+import sys
+import json
+import sqlite3
+import zipfile
+import argparse
+import hashlib
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import mi_record_store
+
+BIN_STORE_NAME = "mi_bins.db"
+ARCHIVE_FOLDER = "archive"
+ARCHIVE_EXT = ".zip"
+DAY_FORMAT = "%Y%m%d"
+SHARD_WIDTH = 2             # hex characters of the name hash, 256 shard folders per day
+COLLISION_POLICIES = ('version', 'refuse')
+
+# Where a bin goes: new is False if the same image is already the board's latest bin (nothing to write)
+Placement = namedtuple('Placement', ['name', 'version', 'day', 'member', 'path', 'digest', 'new'])
+
+class BinStoreError(Exception):
+    pass
+
+class BinCollisionError(BinStoreError, ValueError):
+    """A different image is already stored for the board and collisions are refused"""
+
+def content_hash(image):
+    return hashlib.sha256(image).hexdigest()
+
+def shard_of(name, width=SHARD_WIDTH):
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()[:width]
+
+def is_day(name):
+    try:
+        datetime.strptime(name, DAY_FORMAT)
+    except ValueError:
+        return False
+    return len(name) == 8
+
+class BinStore:
+    """Dated, sharded bin folders under root with a content hash index; safe to share between threads
+
+    The generator writes the files (MI_bin_generator.write_bin()): place() picks the path of a board's
+    image, add() indexes it once written. Both inside transaction() so stations sharing root do not
+    pick the same version.
+    """
+    def __init__(self, root, collisions='version', shard_width=SHARD_WIDTH):
+        if collisions not in COLLISION_POLICIES:
+            raise ValueError("collisions must be one of {}".format(", ".join(COLLISION_POLICIES)))
+        self.root = root
+        self.collisions = collisions
+        self.shard_width = shard_width
+        self.lock = threading.RLock()
+        self.archives = {}
+        self.db = sqlite3.connect(os.path.join(root, BIN_STORE_NAME), timeout=30, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS bins ("
+            "id INTEGER PRIMARY KEY, name TEXT NOT NULL, version INTEGER NOT NULL, day TEXT NOT NULL, "
+            "member TEXT NOT NULL, sha256 TEXT NOT NULL, size INTEGER NOT NULL, created_at TEXT NOT NULL, "
+            "archived INTEGER NOT NULL DEFAULT 0, UNIQUE (name, version))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS bins_sha256 ON bins(sha256)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS bins_day ON bins(day, member)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            for _mtime, archive in self.archives.values():
+                archive.close()
+            self.archives.clear()
+            self.db.close()
+
+    @contextmanager
+    def transaction(self):
+        """Group place(), the file write and add(); nested blocks join the outer transaction"""
+        with self.lock:
+            if self.db.in_transaction:
+                yield self
+                return
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def day_folder(self, day=None):
+        return os.path.join(self.root, day or datetime.now().strftime(DAY_FORMAT))
+
+    def archive_path(self, day):
+        return os.path.join(self.root, ARCHIVE_FOLDER, day + ARCHIVE_EXT)
+
+    def place(self, name, digest):
+        """Placement of a board's image with content hash digest, in today's folder
+
+        Raises BinCollisionError if the board's latest bin differs and collisions are refused.
+        """
+        with self.lock:
+            latest = self.find(name)
+            if latest is not None and latest['sha256'] == digest:
+                if not latest['archived'] and os.path.exists(latest['path']):
+                    return Placement(name, latest['version'], latest['day'], latest['member'], latest['path'],
+                                     digest, False)
+                # Archived (or deleted): written again into today's folder, so it can be flashed
+                version = latest['version']
+            elif latest is not None and self.collisions == 'refuse':
+                raise BinCollisionError("{} version {} ({}) holds a different image".format(
+                    name, latest['version'], latest['path']))
+            else:
+                version = latest['version'] + 1 if latest is not None else 1
+            day = datetime.now().strftime(DAY_FORMAT)
+            shard = shard_of(name, self.shard_width)
+            os.makedirs(os.path.join(self.day_folder(day), shard), exist_ok=True)
+            # Files the index does not know (copied in, or of a lost index) are skipped, never replaced
+            while True:
+                member = "{}/{}{}".format(shard, name, ".bin" if version == 1 else ".v{}.bin".format(version))
+                path = os.path.join(self.day_folder(day), shard, os.path.basename(member))
+                if not os.path.exists(path):
+                    break
+                version += 1
+            return Placement(name, version, day, member, os.path.realpath(path), digest, True)
+
+    def add(self, placement, size):
+        """Index a placed bin once its file is written"""
+        with self.lock:
+            self.db.execute("INSERT INTO bins (name, version, day, member, sha256, size, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (name, version) DO UPDATE SET "
+                            "day = excluded.day, member = excluded.member, created_at = excluded.created_at, "
+                            "archived = 0",
+                            (placement.name, placement.version, placement.day, placement.member, placement.digest,
+                             size, datetime.now().isoformat(timespec='milliseconds')))
+
+    def find(self, name, version=None):
+        """Entry of a board's latest (or given) bin version as a dict with its path, or None"""
+        with self.lock:
+            cur = self.db.execute("SELECT * FROM bins WHERE name = ? AND version = COALESCE(?, version) "
+                                  "ORDER BY version DESC LIMIT 1", (name, version))
+            row = cur.fetchone()
+            return None if row is None else self._entry(cur, row)
+
+    def versions(self, name):
+        with self.lock:
+            cur = self.db.execute("SELECT * FROM bins WHERE name = ? ORDER BY version", (name,))
+            return [self._entry(cur, row) for row in cur.fetchall()]
+
+    def find_image(self, digest):
+        """Entries of every stored bin with this content hash"""
+        with self.lock:
+            cur = self.db.execute("SELECT * FROM bins WHERE sha256 = ? ORDER BY id", (digest,))
+            return [self._entry(cur, row) for row in cur.fetchall()]
+
+    def read(self, name, version=None):
+        """Image of a board's latest (or given) bin version, from its folder or its day's archive"""
+        entry = self.find(name, version)
+        if entry is None:
+            raise BinStoreError("no bin stored for {}{}".format(name, "" if version is None else " version {}".format(version)))
+        if entry['archived']:
+            with self.lock:
+                return self._open_archive(entry['day']).read(entry['member'])
+        with open(entry['path'], 'rb') as f:
+            return f.read()
+
+    def _open_archive(self, day):
+        """Open archive of a day, kept open so its member directory is read once (reopened when it changed)"""
+        path = self.archive_path(day)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.archives.get(day)
+        if cached is None or cached[0] != mtime:
+            if cached is not None:
+                cached[1].close()
+            self.archives[day] = cached = (mtime, zipfile.ZipFile(path))
+        return cached[1]
+
+    def finished_days(self, today=None):
+        """Day folders before today (default: the current day), oldest first"""
+        today = today or datetime.now().strftime(DAY_FORMAT)
+        return sorted(name for name in os.listdir(self.root)
+                      if is_day(name) and name < today and os.path.isdir(os.path.join(self.root, name)))
+
+    def archived_path(self, day, member):
+        """Path of an archived bin: <archive>/<member>, as kept in the entries and the board records"""
+        return "{}/{}".format(os.path.realpath(self.archive_path(day)), member)
+
+    def archive(self, day, records=None):
+        """Move the files of a day folder into archive/<day>.zip, returns the archive path
+
+        The archive is written next to the final one, checked and renamed into place before the
+        archived files are deleted. Members of an earlier archive of the day are kept.
+        records: a mi_record_store.RecordStore, its boards are pointed at the archived bins.
+        """
+        folder = self.day_folder(day)
+        archive_path = self.archive_path(day)
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        members = []
+        for dir_path, _dirs, files in os.walk(folder):
+            for file_name in files:
+                path = os.path.join(dir_path, file_name)
+                members.append((os.path.relpath(path, folder).replace(os.sep, "/"), path))
+        members.sort()
+
+        fd, tmp_path = tempfile.mkstemp(prefix="." + day, suffix=".tmp", dir=os.path.dirname(archive_path))
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+                new = {member for member, _ in members}
+                if os.path.exists(archive_path):
+                    with zipfile.ZipFile(archive_path) as old:
+                        for info in old.infolist():
+                            if info.filename not in new:
+                                archive.writestr(info, old.read(info))
+                for member, path in members:
+                    archive.write(path, member)
+            with zipfile.ZipFile(tmp_path) as archive:
+                bad = archive.testzip()
+                if bad is not None:
+                    raise BinStoreError("archive of {} is corrupt at {}".format(day, bad))
+            with self.lock:
+                cached = self.archives.pop(day, None)
+                if cached is not None:
+                    cached[1].close()   # Windows cannot replace an open file
+                os.replace(tmp_path, archive_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self.transaction():
+            self.db.executemany("UPDATE bins SET archived = 1 WHERE day = ? AND member = ?",
+                                [(day, member) for member, _ in members])
+        if records is not None:
+            records.move([(os.path.realpath(path), self.archived_path(day, member)) for member, path in members])
+        for _member, path in members:
+            os.remove(path)
+        for dir_path, _dirs, _files in os.walk(folder, topdown=False):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                pass    # not empty: written to while it was archived
+        return archive_path
+
+    def rollup(self, today=None, records=None):
+        """Archive every finished day, returns [(day, archive path, number of files)]"""
+        done = []
+        for day in self.finished_days(today):
+            count = sum(len(files) for _dir, _dirs, files in os.walk(self.day_folder(day)))
+            done.append((day, self.archive(day, records), count))
+        return done
+
+    def _entry(self, cur, row):
+        entry = dict(zip((col[0] for col in cur.description), row))
+        if entry['archived']:
+            entry['path'] = self.archived_path(entry['day'], entry['member'])
+        else:
+            entry['path'] = os.path.realpath(os.path.join(self.day_folder(entry['day']), entry['member']))
+        return entry
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MI bin store (sharded output folders and daily archives)")
+    parser.add_argument("-d", "--root", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Folder of the bin store (default: next to this script)")
+    parser.add_argument("-r", "--records", help="Record store whose bin paths follow the archived files "
+                        "(default: {} in the bin store folder, if present)".format(mi_record_store.RECORD_STORE_NAME))
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rollup", help="Archive every finished day")
+    archive_cmd = commands.add_parser("archive", help="Archive one day (YYYYMMDD), also the current one")
+    archive_cmd.add_argument("day")
+    find_cmd = commands.add_parser("find", help="Show every stored version of a board")
+    find_cmd.add_argument("name", help="Bin name (fazit_id_string)")
+    cat_cmd = commands.add_parser("cat", help="Write a board's bin file, also from an archive")
+    cat_cmd.add_argument("name", help="Bin name (fazit_id_string)")
+    cat_cmd.add_argument("--version", type=int, help="Version (default: the latest)")
+    cat_cmd.add_argument("-o", "--output", help="Output file (default: <name>.bin)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(os.path.join(args.root, BIN_STORE_NAME)):
+        print("Error: bin store ({0}) not found!".format(os.path.realpath(os.path.join(args.root, BIN_STORE_NAME))))
+        sys.exit(1)
+
+    records = None
+    records_path = args.records or os.path.join(args.root, mi_record_store.RECORD_STORE_NAME)
+    if args.command in ("rollup", "archive") and (args.records or os.path.isfile(records_path)):
+        if not os.path.isfile(records_path):
+            print("Error: record store ({0}) not found!".format(os.path.realpath(records_path)))
+            sys.exit(1)
+        records = mi_record_store.RecordStore(records_path)
+
+    with BinStore(args.root) as bins, (records or nullcontext()):
+        if args.command == "rollup":
+            for day, archive_path, count in bins.rollup(records=records):
+                print("[INFO] - {}: {} file(s) archived to '{}'".format(day, count, archive_path))
+        elif args.command == "archive":
+            if not is_day(args.day) or not os.path.isdir(bins.day_folder(args.day)):
+                print("[ERROR] - No day folder {}".format(args.day))
+                sys.exit(1)
+            print("[INFO] - {} archived to '{}'".format(args.day, bins.archive(args.day, records)))
+        elif args.command == "find":
+            entries = bins.versions(args.name)
+            if not entries:
+                print("[INFO] - No bin stored for '{}'".format(args.name))
+                sys.exit(1)
+            print(json.dumps(entries, indent=2))
+        else:
+            try:
+                image = bins.read(args.name, args.version)
+            except (BinStoreError, OSError) as e:
+                print("[ERROR] - {}".format(e))
+                sys.exit(1)
+            output = args.output or args.name + ".bin"
+            with open(output, "wb") as f:
+                f.write(image)
+            print("[INFO] - {} bytes written to '{}'".format(len(image), os.path.realpath(output)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
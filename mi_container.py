@@ -0,0 +1,241 @@
+"""Multi-board MI container: many MI images in one file, indexed by board serial.
+
+Layout of a container file (all integers little endian):
+
+  header   64 bytes  magic 'MICONT01', version, header size, record size, record count,
+                     index offset, index field count, SHA-256 of the MI config layout
+  records  count * record size bytes, record n at header size + n * record size
+  index    per indexed field: directory entry (name, key size, entry count, offset), then the
+           sorted array of (raw field bytes, record number) entries
+
+Readers mmap the file and binary search the index, so a single record is found and read
+without loading the rest of the container.
+"""
+import os
+import sys
+import mmap
+import json
+import struct
+import bisect
+import hashlib
+import argparse
+import tempfile
+
+import mi_record_store
+
+CONTAINER_MAGIC = b"MICONT01"
+CONTAINER_VERSION = 1
+CONTAINER_EXT = ".mic"
+HEADER = struct.Struct("<8sHHIIQH32s")
+HEADER_SIZE = 64
+INDEX_DIR = struct.Struct("<32sHIQ")
+RECORD_NO = struct.Struct("<I")
+
+class ContainerError(Exception):
+    """Not a container, damaged, or written for another MI config"""
+
+def layout_hash(layout):
+    """SHA-256 of the field names, offsets, types and sizes of an MI layout"""
+    return hashlib.sha256(json.dumps([(f.name, f.offset, f.type, f.size) for f in layout]).encode()).digest()
+
+def is_container(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC
+    except OSError:
+        return False
+
+class ContainerWriter:
+    """Streams MI images into a new container; the file appears (atomically) on close()
+
+    Raises ValueError from add() for images of the wrong size or a key already in the container.
+    """
+    def __init__(self, path, layout, key_fields=mi_record_store.UNIQUE_FIELDS):
+        self.path = path
+        self.layout = layout
+        self.key_fields = [layout[fld] for fld in key_fields if fld in layout]
+        self.keys = {field.name: {} for field in self.key_fields}
+        self.count = 0
+        fd, self.tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path), suffix=".tmp",
+                                             dir=os.path.dirname(os.path.abspath(path)))
+        self.file = os.fdopen(fd, "wb")
+        self.file.write(bytes(HEADER_SIZE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, image):
+        """Append one MI image, returns its record number"""
+        if len(image) != self.layout.size:
+            raise ValueError("MI image is {} bytes, config expects {}".format(len(image), self.layout.size))
+        for field in self.key_fields:
+            key = bytes(image[field.offset:field.offset + field.size])
+            if key in self.keys[field.name]:
+                raise ValueError("{} '{}' already in container (record {})".format(
+                    field.name, key.rstrip(b"\0").decode("utf-8", "replace"), self.keys[field.name][key]))
+        for field in self.key_fields:
+            self.keys[field.name][bytes(image[field.offset:field.offset + field.size])] = self.count
+        self.file.write(image)
+        self.count += 1
+        return self.count - 1
+
+    def record_path(self, record_no):
+        """Reference to a record, as kept in the record store: <container path>#<record number>"""
+        return "{}#{}".format(os.path.realpath(self.path), record_no)
+
+    def close(self, durable=True):
+        index_offset = HEADER_SIZE + self.count * self.layout.size
+        offset = index_offset + len(self.key_fields) * INDEX_DIR.size
+        directory, arrays = [], []
+        for field in self.key_fields:
+            entries = sorted(self.keys[field.name].items())
+            directory.append(INDEX_DIR.pack(field.name.encode(), field.size, len(entries), offset))
+            arrays.append(b"".join(key + RECORD_NO.pack(no) for key, no in entries))
+            offset += len(arrays[-1])
+        self.file.write(b"".join(directory + arrays))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, HEADER_SIZE, self.layout.size, self.count,
+                                    index_offset, len(self.key_fields), layout_hash(self.layout)))
+        if durable:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+class Container:
+    """Read-only, mmapped view of a container file"""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ContainerError("{} is empty".format(path))
+        if len(self.data) < HEADER_SIZE:
+            self.close()
+            raise ContainerError("{} is not an MI container".format(path))
+        (magic, version, self.header_size, self.record_size, self.count, index_offset, index_fields,
+         self.layout_hash) = HEADER.unpack_from(self.data, 0)
+        if magic != CONTAINER_MAGIC or version != CONTAINER_VERSION:
+            self.close()
+            raise ContainerError("{} is not an MI container (version {})".format(path, CONTAINER_VERSION))
+        if index_offset != self.header_size + self.count * self.record_size or index_offset > len(self.data):
+            self.close()
+            raise ContainerError("{} is truncated or damaged".format(path))
+        self.index = {}
+        for i in range(index_fields):
+            name, key_size, entries, offset = INDEX_DIR.unpack_from(self.data, index_offset + i * INDEX_DIR.size)
+            self.index[name.rstrip(b"\0").decode()] = (key_size, entries, offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if getattr(self, "data", None) is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    def check_layout(self, layout):
+        """Raise ContainerError unless the container was written with this MI config"""
+        if self.record_size != layout.size or self.layout_hash != layout_hash(layout):
+            raise ContainerError("{} was written with another MI config".format(self.path))
+
+    def record(self, record_no):
+        """The MI image of one record (bytes)"""
+        if not 0 <= record_no < self.count:
+            raise IndexError("record {} not in container ({} records)".format(record_no, self.count))
+        start = self.header_size + record_no * self.record_size
+        return self.data[start:start + self.record_size]
+
+    def find(self, fld, value):
+        """Record number of the board with fld == value, or None"""
+        if fld not in self.index:
+            raise ValueError("{} is not indexed, use one of {}".format(fld, ", ".join(self.index)))
+        key_size, entries, offset = self.index[fld]
+        key = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+        if len(key) > key_size:
+            return None
+        key = key.ljust(key_size, b"\0")
+        stride = key_size + RECORD_NO.size
+        keys = _KeyView(self.data, offset, stride, key_size, entries)
+        i = bisect.bisect_left(keys, key)
+        if i < entries and keys[i] == key:
+            return RECORD_NO.unpack_from(self.data, offset + i * stride + key_size)[0]
+        return None
+
+    def lookup(self, value):
+        """Record number of the board with any indexed field == value, or None"""
+        for fld in self.index:
+            record_no = self.find(fld, value)
+            if record_no is not None:
+                return record_no
+        return None
+
+    def __iter__(self):
+        for record_no in range(self.count):
+            yield self.record(record_no)
+
+class _KeyView:
+    """Sequence of the keys of one index array in the mmap, for bisect"""
+    def __init__(self, data, offset, stride, key_size, entries):
+        self.data, self.offset, self.stride, self.key_size, self.entries = data, offset, stride, key_size, entries
+
+    def __len__(self):
+        return self.entries
+
+    def __getitem__(self, i):
+        start = self.offset + i * self.stride
+        return self.data[start:start + self.key_size]
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MI container tool")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info_cmd = commands.add_parser("info", help="Show header and index of a container")
+    info_cmd.add_argument("container")
+    extract_cmd = commands.add_parser("extract", help="Write the record of one board as a bin file")
+    extract_cmd.add_argument("container")
+    extract_cmd.add_argument("serial", help="fazit_id_string or ecu_serial_number of the board")
+    extract_cmd.add_argument("-o", "--output", help="Bin file (default: <serial>.bin)")
+    args = parser.parse_args(argv)
+
+    try:
+        with Container(args.container) as container:
+            if args.command == "info":
+                print("[INFO] - {}: {} record(s) of {} bytes, indexed by {}".format(
+                    args.container, len(container), container.record_size, ", ".join(container.index)))
+                return
+            record_no = container.lookup(args.serial)
+            if record_no is None:
+                print("[ERROR] - No board '{}' in {}".format(args.serial, args.container))
+                sys.exit(1)
+            output = args.output or args.serial + ".bin"
+            with open(output, "wb") as f:
+                f.write(container.record(record_no))
+            print("[INFO] - Record {} written to '{}'".format(record_no, os.path.realpath(output)))
+    except (OSError, ContainerError) as e:
+        print("[ERROR] - {}".format(e))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
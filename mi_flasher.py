@@ -0,0 +1,524 @@
+"""Flashing of MI bin files, one or many COM ports at a time.
+
+A flasher backend does the actual work on a port: S32Backend drives S32FlashTool.exe,
+SimulatorBackend is a scriptable in-process stand-in without hardware. Every command downloads
+the target and flash algorithm, except the later commands of the same job (program after the
+read-back), which reuse the session of the first one (REUSE_SESSION).
+
+FlashScheduler keeps a queue per port and runs at most max_workers ports at once, with a
+retry/timeout policy per port and a status callback for live per-port display.
+
+Set MI_FLASH_TOOL to run another tool command instead of S32FlashTool.exe, e.g.
+MI_FLASH_TOOL="python fake_s32flashtool.py" to exercise the S32 backend without hardware.
+"""
+import os
+import sys
+import re
+import time
+import shlex
+import ntpath
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import MI_bin_generator as mi_gen
+
+# S32 Flash Tool install folder; S32_FLASH_TOOL_DIR overrides it
+S32_TOOL_DIR = os.environ.get("S32_FLASH_TOOL_DIR", r"C:\NXP\S32FlashTool_2.1.2RTM")
+S32_TARGET_NAME = "S32G3xxx.bin"
+S32_ALGORITHM_NAME = "MX66U2G45G.bin"
+MI_FLASH_ADDR = "0x0FFE0000"
+# Read-back command arguments; assumed S32FlashTool syntax (read size bytes at -addr into -f),
+# check against the tool manual of the installed version
+S32_READ_ARGS = ["-fread", "-f", "{path}", "-addr", "{addr}", "-size", "{size}"]
+
+# Skip the target/algorithm download (-a) for the later commands of a job once a command succeeded;
+# the session ends with the job. MI_FLASH_REUSE_SESSION=0 downloads for every command
+REUSE_SESSION = os.environ.get("MI_FLASH_REUSE_SESSION", "1") != "0"
+
+# Output lines that mark a failed tool run even if its exit code is 0
+FAIL_PATTERN = re.compile(r"\berror\b|\bfail", re.IGNORECASE)
+
+PortPolicy = namedtuple('PortPolicy', ['retries', 'timeout'])
+DEFAULT_POLICY = PortPolicy(retries=1, timeout=120)
+
+QUEUED, RUNNING, DONE, FAILED, IDLE = "queued", "running", "done", "failed", "idle"
+
+def read_output(pipe):
+    """Yield tool output lines; prompts and progress ending in ':' or ') ' are yielded before their newline"""
+    buffer = ""
+    while True:
+        ch = pipe.read(1)
+        if not ch:
+            break
+        buffer += ch
+        if ch == "\n" or buffer.endswith(":") or buffer.endswith(": ") or buffer.endswith(") "):
+            yield buffer
+            buffer = ""
+    if buffer:
+        yield buffer
+
+def run_command(cmd, timeout=None, on_output=None):
+    """Run a flash tool command, passing each output line to on_output; returns (ok, message)
+
+    The tool is killed after timeout seconds. A run fails on a non-zero exit code, a timeout,
+    or an output line matching FAIL_PATTERN.
+    """
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                                creationflags=subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0)
+    except OSError as e:
+        return False, "cannot start {}: {}".format(cmd[0], e)
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    failure = None
+    line = ""
+    try:
+        for piece in read_output(proc.stdout):
+            if on_output:
+                on_output(piece.rstrip())
+            # Prompts arrive in pieces, failures are matched on the whole line
+            line += piece
+            if piece.endswith("\n"):
+                if failure is None and FAIL_PATTERN.search(line):
+                    failure = line.strip()
+                line = ""
+        if failure is None and FAIL_PATTERN.search(line):
+            failure = line.strip()
+        proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        proc.stdout.close()
+
+    if timed_out.is_set():
+        return False, "timeout after {} s".format(timeout)
+    if proc.returncode != 0:
+        return False, failure or "exit code {}".format(proc.returncode)
+    if failure:
+        return False, failure
+    return True, "ok"
+
+class FlasherBackend:
+    """Interface of a flasher backend; all methods return (ok, message) and may be called from worker threads.
+
+    With reuse_session (default REUSE_SESSION) a port's session is warm after a successful command: the
+    next command of the same job skips the target/algorithm download. end_session(port) is called once
+    a board is finished, so the next board on the port (power cycled) gets the setup again; a failed
+    command also ends the session.
+    """
+    name = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.warm = set()
+        self.reuse_session = REUSE_SESSION
+
+    def connect(self, port, timeout=None, on_output=None):
+        """Download target and flash algorithm (Test Connection)"""
+        raise NotImplementedError
+
+    def program(self, port, bin_path, addr=MI_FLASH_ADDR, timeout=None, on_output=None):
+        """Program bin_path at addr, downloading target/algorithm first unless the session is warm"""
+        raise NotImplementedError
+
+    def read(self, port, size, addr=MI_FLASH_ADDR, timeout=None, on_output=None):
+        """Read size bytes at addr from flash: (ok, message, data)"""
+        raise NotImplementedError
+
+    def is_warm(self, port):
+        with self.lock:
+            return port in self.warm
+
+    def end_session(self, port):
+        with self.lock:
+            self.warm.discard(port)
+
+    def _session_result(self, port, result):
+        with self.lock:
+            if result[0] and self.reuse_session:
+                self.warm.add(port)
+            else:
+                self.warm.discard(port)
+        return result
+
+class S32Backend(FlasherBackend):
+    """S32FlashTool.exe, one tool process per command"""
+    name = "s32"
+
+    def __init__(self, tool_dir=S32_TOOL_DIR, target=S32_TARGET_NAME, algorithm=S32_ALGORITHM_NAME):
+        super().__init__()
+        self.tool = ntpath.join(tool_dir, "bin", "S32FlashTool.exe")
+        self.target = ntpath.join(tool_dir, "targets", target)
+        self.algorithm = ntpath.join(tool_dir, "flash", algorithm)
+
+    def command(self, port, *args, warm=False):
+        """Tool command line for port; MI_FLASH_TOOL overrides S32FlashTool.exe"""
+        override = os.environ.get("MI_FLASH_TOOL")
+        cmd = shlex.split(override, posix=(os.name != "nt")) if override else [self.tool]
+        cmd += ["-t", self.target]
+        if not warm:
+            cmd += ["-a", self.algorithm]
+        return cmd + list(args) + ["-i", "uart", "-p", port]
+
+    def connect(self, port, timeout=None, on_output=None):
+        return self._session_result(port, run_command(self.command(port), timeout, on_output))
+
+    def program(self, port, bin_path, addr=MI_FLASH_ADDR, timeout=None, on_output=None):
+        cmd = self.command(port, "-fprogram", "-f", bin_path, "-addr", addr, warm=self.is_warm(port))
+        return self._session_result(port, run_command(cmd, timeout, on_output))
+
+    def read(self, port, size, addr=MI_FLASH_ADDR, timeout=None, on_output=None):
+        fd, path = tempfile.mkstemp(suffix=".bin", prefix="readback_")
+        os.close(fd)
+        try:
+            args = [arg.format(path=path, addr=addr, size=size) for arg in S32_READ_ARGS]
+            ok, message = self._session_result(port, run_command(self.command(port, *args, warm=self.is_warm(port)),
+                                                                 timeout, on_output))
+            if not ok:
+                return False, message, None
+            with open(path, "rb") as f:
+                data = f.read()
+        finally:
+            os.remove(path)
+        if len(data) != size:
+            return False, "read back {} bytes, expected {}".format(len(data), size), None
+        return True, message, data
+
+class SimulatorBackend(FlasherBackend):
+    """In-process flasher for tests and dry runs.
+
+    script maps a port to a list of outcomes used by its successive commands: "ok", "fail" or
+    "hang" (runs into the timeout); ports without script, or with the list used up, succeed.
+    Programmed data is kept per port in memory, downloads counts the target/algorithm downloads.
+    """
+    name = "simulator"
+
+    def __init__(self, script=None, delay=0.0):
+        super().__init__()
+        self.script = {port: deque(outcomes) for port, outcomes in (script or {}).items()}
+        self.delay = delay
+        self.memory = {}
+        self.downloads = {}
+        self.commands = []
+
+    def connect(self, port, timeout=None, on_output=None):
+        return self._session_result(port, self._run(port, "connect", timeout, on_output))
+
+    def program(self, port, bin_path, addr=MI_FLASH_ADDR, timeout=None, on_output=None):
+        def write():
+            with open(bin_path, "rb") as f:
+                data = f.read()
+            with self.lock:
+                self.memory.setdefault(port, {})[int(addr, 0)] = data
+            return "Programming {} bytes at {}: 100%".format(len(data), addr)
+        return self._session_result(port, self._run(port, "program", timeout, on_output, write))
+
+    def read(self, port, size, addr=MI_FLASH_ADDR, timeout=None, on_output=None):
+        """Erased flash (0xFF) except where data was programmed at the same address"""
+        ok, message = self._session_result(port, self._run(port, "read", timeout, on_output))
+        if not ok:
+            return False, message, None
+        with self.lock:
+            data = self.memory.get(port, {}).get(int(addr, 0), b"")[:size]
+        return True, message, data + b"\xff" * (size - len(data))
+
+    def _run(self, port, command, timeout, on_output, action=None):
+        emit = on_output or (lambda line: None)
+        with self.lock:
+            self.commands.append((port, command))
+            outcomes = self.script.get(port)
+            outcome = outcomes.popleft() if outcomes else "ok"
+            warm = port in self.warm
+        if outcome == "hang":
+            time.sleep(timeout or 0)
+            return False, "timeout after {} s".format(timeout)
+        time.sleep(self.delay)
+        if outcome != "ok":
+            emit("Error: no response from target on {}".format(port))
+            return False, "Error: no response from target on {}".format(port)
+        if not warm:
+            with self.lock:
+                self.downloads[port] = self.downloads.get(port, 0) + 1
+            emit("Downloading target and flash algorithm ... done")
+        if action:
+            try:
+                emit(action())
+            except OSError as e:
+                return False, "Error: {}".format(e)
+        return True, "ok"
+
+BACKENDS = {backend.name: backend for backend in (S32Backend, SimulatorBackend)}
+
+def make_backend(name=None):
+    """Backend by name, default from MI_FLASH_BACKEND (else s32)"""
+    name = name or os.environ.get("MI_FLASH_BACKEND", S32Backend.name)
+    if name not in BACKENDS:
+        raise ValueError("unknown flasher backend '{}', use one of {}".format(name, ", ".join(BACKENDS)))
+    return BACKENDS[name]()
+
+class FlashJob:
+    """One bin file to flash on one port
+
+    With a layout the flash is read back first: programming is skipped when it already holds the
+    image, else diffs lists the fields that change, see MI_bin_generator.diff_mi().
+    """
+    def __init__(self, job_id, port, bin_path, layout=None):
+        self.id = job_id
+        self.port = port
+        self.bin_path = bin_path
+        self.layout = layout
+        self.skipped = False
+        self.diffs = None
+        self.state = QUEUED
+        self.attempts = 0
+        self.message = ""
+        self.queued_at = datetime.now()
+        self.started_at = self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def ok(self):
+        return self.state == DONE
+
+PortStatus = namedtuple('PortStatus', ['port', 'state', 'job', 'queued', 'done', 'failed', 'message'])
+
+class FlashScheduler:
+    """Flashes queued jobs on many ports at once, one job at a time per port.
+
+    Jobs are flashed with backend.program() (default: make_backend()), or run_job(job, timeout,
+    on_output) -> (ok, message) if given. Each job is one board, its backend session ends with
+    the job. on_status(PortStatus) is called from worker
+    threads whenever a port changes state, on_done(job) once per finished job and on_output(port, line)
+    receives the tool output.
+    """
+    def __init__(self, max_workers=4, policy=DEFAULT_POLICY, run_job=None, on_status=None, on_output=None,
+                 on_done=None, backend=None):
+        self.backend = backend or make_backend()
+        self.policy = policy
+        self.port_policies = {}
+        self.run_job = run_job or self._run_program
+        self.on_status = on_status
+        self.on_output = on_output
+        self.on_done = on_done
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="flash")
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.active = {}
+        self.counts = {}
+        self.messages = {}
+        self.next_id = 1
+
+    def set_policy(self, port, retries=None, timeout=None):
+        """Override the retry/timeout policy of one port"""
+        base = self.port_policies.get(port, self.policy)
+        self.port_policies[port] = PortPolicy(base.retries if retries is None else retries,
+                                              base.timeout if timeout is None else timeout)
+
+    def submit(self, port, bin_path, layout=None):
+        """Queue bin_path for port and return its FlashJob (job.done is set when it finishes)
+
+        Pass the MI layout to read back and compare the flash before programming.
+        """
+        with self.lock:
+            job = FlashJob(self.next_id, port, bin_path, layout)
+            self.next_id += 1
+            self.queues.setdefault(port, deque()).append(job)
+            self.counts.setdefault(port, [0, 0])
+            start = port not in self.active
+            if start:
+                self.active[port] = None
+        self._notify(port)
+        if start:
+            self.pool.submit(self._drain, port)
+        return job
+
+    def status(self, port=None):
+        """PortStatus of one port, or a list for all ports seen so far"""
+        with self.lock:
+            ports = [port] if port else sorted(self.counts)
+            result = [self._status(p) for p in ports]
+        return result[0] if port else result
+
+    def wait(self, timeout=None):
+        """Block until all queued jobs are finished, at most timeout seconds in total; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                jobs = [job for queue in self.queues.values() for job in queue] + \
+                       [job for job in self.active.values() if job]
+            if not jobs:
+                return True
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not jobs[0].done.wait(remaining):
+                return False
+
+    def shutdown(self, wait=True):
+        if not wait:
+            with self.lock:
+                for queue in self.queues.values():
+                    queue.clear()
+        self.pool.shutdown(wait=wait)
+
+    # ----------------------------- Internals -----------------------------
+    def _drain(self, port):
+        """Worker: flash the jobs queued for one port in order"""
+        while True:
+            with self.lock:
+                queue = self.queues[port]
+                if not queue:
+                    del self.active[port]
+                    break
+                job = self.active[port] = queue.popleft()
+            self._flash(job)
+        self._notify(port)
+
+    def _flash(self, job):
+        policy = self.port_policies.get(job.port, self.policy)
+        job.state = RUNNING
+        job.started_at = datetime.now()
+        while True:
+            job.attempts += 1
+            self._notify(job.port)
+            try:
+                ok, job.message = self.run_job(job, policy.timeout, self._output(job.port))
+            except Exception as e:
+                ok, job.message = False, "flasher error: {}".format(e)
+            if ok or job.attempts > policy.retries:
+                break
+        self.backend.end_session(job.port)
+        job.state = DONE if ok else FAILED
+        job.finished_at = datetime.now()
+        with self.lock:
+            self.counts[job.port][0 if ok else 1] += 1
+            self.messages[job.port] = job.message
+            self.active[job.port] = None
+        job.done.set()
+        self._notify(job.port)
+        if self.on_done:
+            self.on_done(job)
+
+    def _run_program(self, job, timeout, on_output):
+        if job.layout is not None:
+            with open(job.bin_path, "rb") as f:
+                image = f.read()
+            ok, message, current = self.backend.read(job.port, len(image), timeout=timeout, on_output=on_output)
+            if not ok:
+                # The compare is an extra: program without it rather than failing the board
+                warning = "read-back failed: {}".format(message)
+                if on_output:
+                    on_output("Warning: {}, programming without compare".format(warning))
+                ok, message = self.backend.program(job.port, job.bin_path, timeout=timeout, on_output=on_output)
+                return ok, "programmed, {}".format(warning) if ok else message
+            if current.count(0xFF) == len(current):
+                ok, message = self.backend.program(job.port, job.bin_path, timeout=timeout, on_output=on_output)
+                return ok, "programmed into erased flash" if ok else message
+            job.diffs = mi_gen.diff_mi(current, image, job.layout)
+            if not job.diffs:
+                job.skipped = True
+                return True, "flash already holds this image, programming skipped"
+        ok, message = self.backend.program(job.port, job.bin_path, timeout=timeout, on_output=on_output)
+        if ok and job.diffs:
+            message = "programmed, changed: {}".format(", ".join(name for name, _old, _new in job.diffs))
+        return ok, message
+
+    def _output(self, port):
+        if not self.on_output:
+            return None
+        return lambda line: self.on_output(port, line)
+
+    def _status(self, port):
+        job = self.active.get(port)
+        queued = len(self.queues.get(port, ()))
+        if job:
+            state = RUNNING
+        elif queued:
+            state = QUEUED
+        else:
+            state = IDLE
+        done, failed = self.counts.get(port, (0, 0))
+        return PortStatus(port, state, job, queued, done, failed, self.messages.get(port, ""))
+
+    def _notify(self, port):
+        if self.on_status:
+            with self.lock:
+                status = self._status(port)
+            self.on_status(status)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Flash MI bin files on several COM ports in parallel")
+    parser.add_argument("jobs", nargs="+", metavar="PORT=BIN", help="Bin file to flash on a port, a port may be given several times")
+    parser.add_argument("-j", "--workers", type=int, default=4, help="Ports flashed at the same time")
+    parser.add_argument("--retries", type=int, default=DEFAULT_POLICY.retries, help="Retries of a failed flash")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_POLICY.timeout, help="Seconds before a flash is aborted")
+    parser.add_argument("-c", "--config", help="MI config file (mi_config.csv): read the flash back first, "
+                        "skip boards already holding their bin file and list the changed fields of the others")
+    parser.add_argument("-b", "--backend", choices=list(BACKENDS), help="Flasher backend (default: MI_FLASH_BACKEND or s32)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the flash tool output")
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for arg in args.jobs:
+        port, sep, bin_path = arg.partition("=")
+        if not sep or not port or not os.path.isfile(bin_path):
+            print("Error: '{}' is not PORT=BIN with an existing bin file".format(arg))
+            sys.exit(1)
+        jobs.append((port, bin_path))
+    layout = None
+    if args.config:
+        try:
+            layout = mi_gen.load_layout(args.config, mi_gen.get_layout_cache_dir())
+        except (OSError, mi_gen.LayoutError) as e:
+            print("[ERROR] - {}".format(e))
+            sys.exit(1)
+
+    print_lock = threading.Lock()
+
+    def on_output(port, line):
+        with print_lock:
+            print("[{}] {}".format(port, line))
+
+    def on_status(status):
+        if status.job is not None and status.job.attempts > 1 and status.state == RUNNING:
+            with print_lock:
+                print("[INFO] - {}: retry {} of {}".format(status.port, status.job.attempts - 1, args.retries))
+
+    scheduler = FlashScheduler(max_workers=args.workers, policy=PortPolicy(args.retries, args.timeout),
+                               on_status=on_status, on_output=on_output if args.verbose else None,
+                               backend=make_backend(args.backend))
+    submitted = [scheduler.submit(port, bin_path, layout) for port, bin_path in jobs]
+    scheduler.wait()
+    scheduler.shutdown()
+
+    failed = 0
+    for job in submitted:
+        seconds = (job.finished_at - job.started_at).total_seconds()
+        if job.skipped:
+            print("[INFO] - {}: {} already flashed, skipped ({:.1f} s)".format(job.port, job.bin_path, seconds))
+        elif job.ok:
+            print("[INFO] - {}: {} flashed in {:.1f} s".format(job.port, job.bin_path, seconds))
+            if layout is not None:
+                print("    {}".format(job.message))
+            for name, old, new in job.diffs or ():
+                print("    {}: {!r} -> {!r}".format(name, old, new))
+        else:
+            failed += 1
+            print("[ERROR] - {}: {} failed after {} attempt(s): {}".format(job.port, job.bin_path, job.attempts, job.message))
+    print("[INFO] - Flashed {} of {} bin file(s)".format(len(submitted) - failed, len(submitted)))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,142 @@
+"""Layout registry: the MI data file and config of every board variant / MI version.
+
+Products are listed in a registry file (mi_layouts.ini), one section per product:
+
+  [sv62_c_mcu]
+  ini = sv62_c_mcu_mi.ini
+  config = mi_config.csv
+
+The magic_id and version in the mi_global_header of each product's MI data file select it,
+so the layout of an MI image is found from its own header. Compiled layouts are cached on
+disk by config content hash (MI_bin_generator.load_layout), so a restarted station or a
+product switch loads a ready layout.
+"""
+import os
+import sys
+import argparse
+import configparser
+from collections import namedtuple
+from struct import Struct
+
+import MI_bin_generator as mi_gen
+
+REGISTRY_NAME = "mi_layouts.ini"
+
+# magic_id, version and size open every MI image
+MI_HEADER = Struct('<III')
+MI_HEADER_FIELDS = ('magic_id', 'version', mi_gen.MI_SIZE_FIELD)
+
+Product = namedtuple('Product', ['name', 'ini', 'config', 'magic', 'version'])
+
+def get_registry_path():
+    return os.path.join(mi_gen.parent_folder, REGISTRY_NAME)
+
+def read_header(data):
+    """(magic_id, version, size) of an MI image, raises LayoutError if it is too short"""
+    if len(data) < MI_HEADER.size:
+        raise mi_gen.LayoutError("{} bytes is too short for an MI header".format(len(data)))
+    return MI_HEADER.unpack_from(data, 0)
+
+class LayoutRegistry:
+    """Products by name and by (magic_id, version); layouts and templates are loaded once"""
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.products = {}
+        self.keys = {}
+        self.layouts = {}
+        self.templates = {}
+
+    @classmethod
+    def load(cls, path, cache_dir=None):
+        """Registry of the products in a registry file; ini/config paths are relative to it"""
+        registry_file = configparser.ConfigParser()
+        if not registry_file.read(path):
+            raise FileNotFoundError("layout registry {} not found".format(path))
+        registry = cls(cache_dir)
+        folder = os.path.dirname(os.path.abspath(path))
+        for name in registry_file.sections():
+            section = registry_file[name]
+            if 'ini' not in section or 'config' not in section:
+                raise mi_gen.LayoutError("{}: product {} needs 'ini' and 'config'".format(path, name))
+            registry.register(name, os.path.join(folder, section['ini']), os.path.join(folder, section['config']))
+        return registry
+
+    def register(self, name, ini, config):
+        """Add a product; raises LayoutError if its header is not usable or already taken"""
+        template = mi_gen.load_template(ini)
+        header = template.get(mi_gen.MI_GLOBAL_HEADER, {})
+        try:
+            magic, version = mi_gen.str2dec(header['magic_id']), mi_gen.str2dec(header['version'])
+        except (KeyError, ValueError):
+            raise mi_gen.LayoutError("{}: [{}] needs numeric magic_id and version".format(ini, mi_gen.MI_GLOBAL_HEADER))
+        layout = mi_gen.load_layout(config, self.cache_dir)
+        for fld, offset in zip(MI_HEADER_FIELDS, range(0, MI_HEADER.size, 4)):
+            if fld not in layout or layout[fld].offset != offset or layout[fld].type != 'uint':
+                raise mi_gen.LayoutError("{}: {} must be the uint at offset {}".format(config, fld, offset))
+        other = self.keys.get((magic, version))
+        if other is not None and other.name != name:
+            raise mi_gen.LayoutError("{} and {} both use magic_id 0x{:X} version {}".format(
+                other.name, name, magic, version))
+        product = Product(name, ini, config, magic, version)
+        self.products[name] = product
+        self.keys[(magic, version)] = product
+        self.layouts[name] = layout
+        self.templates.pop(name, None)
+        return product
+
+    def find(self, magic, version):
+        product = self.keys.get((magic, version))
+        if product is None:
+            raise mi_gen.LayoutError("no layout registered for magic_id 0x{:X} version {}".format(magic, version))
+        return product
+
+    def for_image(self, data):
+        """Product of an MI image, from its header"""
+        magic, version, _size = read_header(data)
+        return self.find(magic, version)
+
+    def layout(self, product):
+        return self.layouts[product.name]
+
+    def template(self, product):
+        """Prepared template of a product (MI data file checked against its layout)"""
+        if product.name not in self.templates:
+            self.templates[product.name] = mi_gen.prepare_template(mi_gen.load_template(product.ini),
+                                                                   self.layout(product))
+        return self.templates[product.name]
+
+    @property
+    def max_size(self):
+        return max((layout.size for layout in self.layouts.values()), default=0)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MI layout registry")
+    parser.add_argument("-r", "--registry", default=get_registry_path(), help="Registry file")
+    parser.add_argument("bins", nargs="*", help="MI bin files to identify")
+    args = parser.parse_args(argv)
+
+    try:
+        registry = LayoutRegistry.load(args.registry, mi_gen.get_layout_cache_dir())
+    except (OSError, mi_gen.LayoutError) as e:
+        print("[ERROR] - {}".format(e))
+        sys.exit(1)
+    if not args.bins:
+        for product in registry.products.values():
+            print("[INFO] - {}: magic_id 0x{:X} version {}, {} bytes ({}, {})".format(
+                product.name, product.magic, product.version, registry.layout(product).size,
+                os.path.basename(product.ini), os.path.basename(product.config)))
+        return
+
+    ret = 0
+    for path in args.bins:
+        try:
+            with open(path, "rb") as f:
+                product = registry.for_image(f.read(MI_HEADER.size))
+            print("[INFO] - {}: {}".format(path, product.name))
+        except (OSError, mi_gen.LayoutError) as e:
+            print("[ERROR] - {}: {}".format(path, e))
+            ret = 1
+    sys.exit(ret)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
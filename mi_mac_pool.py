@@ -0,0 +1,160 @@
+"""Unique MAC address allocation for the MI array fields (eth_mac_add_*).
+
+Address ranges per field are configured in an INI file (see mac_pools_example.ini). The
+allocation state is kept in an SQLite file so addresses are never handed out twice, across
+restarts, stations and batch runs. Each MacPool claims a block of addresses from the shared
+range at a time and hands them out from memory, so the shared state file is only written (and
+locked) once per block. The unused rest of a block is given back when the pool is closed, if no
+other station claimed addresses since; otherwise (or after a crash) it is dropped, never reused.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import configparser
+
+POOL_SECTION = 'pool'
+MAC_POOL_CONFIG = "mac_pools.ini"     # picked up next to the scripts by the UI and the verifier
+DEFAULT_BLOCK_SIZE = 64
+MAC_SIZE = 6
+
+class MacPoolError(Exception):
+    """MAC pool misconfigured or exhausted"""
+
+def parse_mac(text):
+    """'02:7D:FA:00:B3:00', '02-7D-..' or '0x02,0x7D,..' -> int"""
+    parts = [p.strip() for p in text.replace('-', ':').replace(',', ':').split(':')]
+    if len(parts) != MAC_SIZE:
+        raise MacPoolError("invalid MAC address '{}'".format(text))
+    try:
+        octets = [int(p, 16) for p in parts]
+    except ValueError:
+        raise MacPoolError("invalid MAC address '{}'".format(text))
+    if any(not 0 <= o <= 0xFF for o in octets):
+        raise MacPoolError("invalid MAC address '{}'".format(text))
+    return int.from_bytes(bytes(octets), 'big')
+
+def format_mac(value):
+    """int -> '0x02,0x7D,0xFA,0x00,0xB3,0x00', the array format packed by writeAddrVal"""
+    return ",".join("0x{:02X}".format(b) for b in value.to_bytes(MAC_SIZE, 'big'))
+
+def read_ranges(config):
+    """{field: (first, last address)} of a MAC pool config (a ConfigParser)"""
+    ranges = {}
+    for fld in config.sections():
+        if fld == POOL_SECTION:
+            continue
+        start, end = parse_mac(config[fld]['start']), parse_mac(config[fld]['end'])
+        if end < start:
+            raise MacPoolError("{}: end {} is below start".format(fld, config[fld]['end']))
+        ranges[fld] = (start, end)
+    return ranges
+
+def load_ranges(config_file_name):
+    """Address ranges of a MAC pool config file, without opening its allocation state"""
+    config = configparser.ConfigParser()
+    if not config.read(config_file_name):
+        raise MacPoolError("MAC pool config {} not found".format(config_file_name))
+    return read_ranges(config)
+
+class MacPool:
+    """Allocates one unique MAC per configured field for each board.
+
+    Addresses of a claimed block that are never used (e.g. boards that failed after allocation,
+    or the rest of a block when the process ends without close()) are not handed out again.
+    """
+    def __init__(self, config_file_name, station=None):
+        config = configparser.ConfigParser()
+        if not config.read(config_file_name):
+            raise MacPoolError("MAC pool config {} not found".format(config_file_name))
+        pool = config[POOL_SECTION] if config.has_section(POOL_SECTION) else {}
+        self.block_size = int(pool.get('block_size', DEFAULT_BLOCK_SIZE))
+        self.station = station or pool.get('station') or socket.gethostname()
+        state = pool.get('state', os.path.splitext(os.path.basename(config_file_name))[0] + ".db")
+        self.state_path = os.path.join(os.path.dirname(os.path.abspath(config_file_name)), state)
+
+        self.ranges = read_ranges(config)
+        if not self.ranges:
+            raise MacPoolError("no MAC ranges configured in {}".format(config_file_name))
+
+        self.lock = threading.Lock()
+        self.leases = {}    # field -> [next, end] of the block claimed by this pool
+        self.db = sqlite3.connect(self.state_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ranges (field TEXT PRIMARY KEY, start INTEGER NOT NULL, "
+                        "end_addr INTEGER NOT NULL, next INTEGER NOT NULL)")
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for fld, (start, end) in self.ranges.items():
+                    row = self.db.execute("SELECT start FROM ranges WHERE field = ?", (fld,)).fetchone()
+                    if row is None:
+                        self.db.execute("INSERT INTO ranges VALUES (?, ?, ?, ?)", (fld, start, end, start))
+                    elif row[0] != start:
+                        raise MacPoolError("{}: range start changed, use a new state file for a new range".format(fld))
+                    else:
+                        # The end of a range may be moved to grow or shrink it
+                        self.db.execute("UPDATE ranges SET end_addr = ? WHERE field = ?", (end, fld))
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Give back the unused rest of the claimed blocks, if nobody claimed after them, and close"""
+        with self.lock:
+            unused = [(nxt, fld, end + 1) for fld, (nxt, end) in self.leases.items() if nxt <= end]
+            if unused:
+                self.db.execute("BEGIN IMMEDIATE")
+                self.db.executemany("UPDATE ranges SET next = ? WHERE field = ? AND next = ?", unused)
+                self.db.execute("COMMIT")
+            self.leases.clear()
+            self.db.close()
+
+    def check_layout(self, layout):
+        """Raise MacPoolError unless every pool field is a 6 byte array field of the layout"""
+        for fld in self.ranges:
+            if fld not in layout or layout[fld].type != 'array' or layout[fld].size != MAC_SIZE:
+                raise MacPoolError("{} is not a {} byte array field of the MI config".format(fld, MAC_SIZE))
+
+    def allocate(self):
+        """Allocate the MACs of one board: {field: '0x02,0x7D,...'}; raises MacPoolError when a range is used up"""
+        with self.lock:
+            used_up = [fld for fld in self.ranges if fld not in self.leases or self.leases[fld][0] > self.leases[fld][1]]
+            if used_up:
+                self.leases.update(self._claim(used_up))
+            macs = {}
+            for fld, lease in self.leases.items():
+                macs[fld] = format_mac(lease[0])
+                lease[0] += 1
+        return macs
+
+    def remaining(self):
+        """Unclaimed addresses left per field (not counting addresses leased to stations)"""
+        with self.lock:
+            return {fld: end - nxt + 1 for fld, nxt, end in
+                    self.db.execute("SELECT field, next, end_addr FROM ranges")}
+
+    def _claim(self, fields):
+        """Claim the next block of each field from the shared ranges, in one transaction"""
+        blocks = {}
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for fld in fields:
+                nxt, end = self.db.execute("SELECT next, end_addr FROM ranges WHERE field = ?", (fld,)).fetchone()
+                if nxt > end:
+                    raise MacPoolError("{}: MAC range exhausted".format(fld))
+                block_end = min(nxt + self.block_size - 1, end)
+                self.db.execute("UPDATE ranges SET next = ? WHERE field = ?", (block_end + 1, fld))
+                blocks[fld] = [nxt, block_end]
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        return blocks
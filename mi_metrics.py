@@ -0,0 +1,177 @@
+"""Per-stage timing and station throughput metrics.
+
+Metrics keeps the recent durations of each stage (operator input, load, pack, record, write,
+flash, ...) for p50/p95, all-time sums and counts, and rolling per-hour rates of counted events
+(boards generated, flashed). The figures can be exported in the Prometheus text format, to a
+file (e.g. for the node_exporter textfile collector) or through a local HTTP endpoint.
+"""
+import os
+import sys
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROLLING_WINDOW = 3600   # seconds covered by the per-hour rates
+STAGE_SAMPLES = 1000    # recent durations kept per stage for the percentiles
+METRICS_FILE_NAME = "mi_metrics.prom"
+PREFIX = "mi"
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile (0 < q <= 1) of an ascending list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, min(len(sorted_values) - 1, int(q * len(sorted_values) + 0.5) - 1))]
+
+class Metrics:
+    """Thread safe stage timings and event rates of one station"""
+    def __init__(self, window=ROLLING_WINDOW, samples=STAGE_SAMPLES, clock=time.time):
+        self.window = window
+        self.samples = samples
+        self.clock = clock
+        self.started = clock()
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.totals = {}
+        self.events = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time the with block as one run of stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.durations.setdefault(name, deque(maxlen=self.samples)).append(seconds)
+            total = self.totals.setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def count(self, name, n=1):
+        """Count n events (e.g. 'generated' boards), for totals and per-hour rates"""
+        now = self.clock()
+        with self.lock:
+            times = self.events.setdefault(name, deque())
+            times.extend([now] * n)
+            self.counts[name] = self.counts.get(name, 0) + n
+            self._expire(times, now)
+
+    def per_hour(self, name):
+        """Rolling rate of an event over the last window seconds (or since start if shorter)"""
+        now = self.clock()
+        with self.lock:
+            times = self.events.get(name, ())
+            if times:
+                self._expire(times, now)
+            span = min(self.window, max(now - self.started, 1.0))
+            return len(times) * 3600.0 / span
+
+    def summary(self):
+        """{'stages': {stage: {count, sum, p50, p95}}, 'counts': {...}, 'per_hour': {...}}"""
+        with self.lock:
+            stages = {name: sorted(values) for name, values in self.durations.items()}
+            totals = {name: tuple(total) for name, total in self.totals.items()}
+            counts = dict(self.counts)
+        return {
+            "stages": {name: {"count": totals[name][1], "sum": totals[name][0],
+                              "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+                       for name, values in stages.items()},
+            "counts": counts,
+            "per_hour": {name: self.per_hour(name) for name in counts},
+        }
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = ["# HELP {}_stage_seconds Duration of a station stage (recent samples for quantiles)".format(PREFIX),
+                 "# TYPE {}_stage_seconds summary".format(PREFIX)]
+        for name, stage in sorted(summary["stages"].items()):
+            for quantile, key in (("0.5", "p50"), ("0.95", "p95")):
+                lines.append('{}_stage_seconds{{stage="{}",quantile="{}"}} {:.6f}'.format(
+                    PREFIX, name, quantile, stage[key]))
+            lines.append('{}_stage_seconds_sum{{stage="{}"}} {:.6f}'.format(PREFIX, name, stage["sum"]))
+            lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(PREFIX, name, stage["count"]))
+        for name, count in sorted(summary["counts"].items()):
+            lines += ["# TYPE {}_{}_total counter".format(PREFIX, name),
+                      "{}_{}_total {}".format(PREFIX, name, count),
+                      "# TYPE {}_{}_per_hour gauge".format(PREFIX, name),
+                      "{}_{}_per_hour {:.1f}".format(PREFIX, name, summary["per_hour"][name])]
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """Write prometheus_text() to path, replacing it atomically"""
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve prometheus_text() at http://host:port/metrics from a daemon thread, returns the server"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def _expire(self, times, now):
+        while times and times[0] < now - self.window:
+            times.popleft()
+
+class NullMetrics:
+    """Default metrics sink, nothing is recorded"""
+    def stage(self, name):
+        return nullcontext()
+
+    def observe(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+no_metrics = NullMetrics()
+
+def process_age():
+    """Seconds since this process was created (interpreter startup included), None if unknown"""
+    try:
+        if os.name == "nt":
+            import ctypes
+            from ctypes import wintypes
+            creation, exit_time, kernel, user = (wintypes.FILETIME() for _ in range(4))
+            kernel32 = ctypes.windll.kernel32
+            kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+            if not kernel32.GetProcessTimes(kernel32.GetCurrentProcess(), ctypes.byref(creation),
+                                            ctypes.byref(exit_time), ctypes.byref(kernel), ctypes.byref(user)):
+                return None
+            # FILETIME: 100 ns intervals since 1601-01-01
+            created = ((creation.dwHighDateTime << 32) | creation.dwLowDateTime) / 1e7 - 11644473600
+            return time.time() - created
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/stat") as f:
+                start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+            with open("/proc/uptime") as f:
+                uptime = float(f.read().split()[0])
+            return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, AttributeError, IndexError):
+        return None
+    return None
@@ -0,0 +1,190 @@
+"""Production record store: one transactional SQLite record per generated MI board.
+
+Replaces the tab separated per-day text log. Unique indexes on the board serials make
+duplicate detection at generation time an index lookup instead of a log search.
+"""
+import os
+import sys
+import csv
+import json
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+RECORD_STORE_NAME = "mi_records.db"
+
+# Fields that identify a board, each must be unique across all recorded boards
+UNIQUE_FIELDS = ('fazit_id_string', 'ecu_serial_number')
+
+class DuplicateError(ValueError):
+    """A unique board serial is already recorded for another board"""
+
+class RecordStore:
+    """SQLite store with one record per board: dynamic values, bin path, CRC and timing.
+
+    Regenerating a board with all of its unique serials unchanged (rework) updates its record;
+    a board reusing only some of another board's serials is rejected with DuplicateError.
+    Safe to share between threads.
+    """
+    def __init__(self, path, unique_fields=UNIQUE_FIELDS):
+        self.path = path
+        self.unique_fields = tuple(unique_fields)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS boards ("
+            "id INTEGER PRIMARY KEY, created_at TEXT NOT NULL, generation INTEGER NOT NULL DEFAULT 1, "
+            "{}, values_json TEXT NOT NULL, path TEXT, crc INTEGER NOT NULL, duration_ms REAL)".format(
+                ", ".join("{} TEXT NOT NULL".format(fld) for fld in self.unique_fields)))
+        for fld in self.unique_fields:
+            self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS boards_{0} ON boards({0})".format(fld))
+        self.db.execute("CREATE INDEX IF NOT EXISTS boards_path ON boards(path)")
+        self._find_sql = "SELECT id, {} FROM boards WHERE {}".format(
+            ", ".join(self.unique_fields), " OR ".join("{} = ?".format(fld) for fld in self.unique_fields))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    @contextmanager
+    def transaction(self):
+        """Group several add() calls (and the file writes they guard) into one transaction
+
+        Nested transaction() blocks join the outer transaction.
+        """
+        with self.lock:
+            if self.db.in_transaction:
+                yield self
+                return
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def check(self, values):
+        """Return an error message if the board's serials clash with another recorded board, else None"""
+        with self.lock:
+            return self._check(self._keys(values))[0]
+
+    def add(self, values, path, crc, duration_ms=None):
+        """Record one board; raises DuplicateError if a unique serial belongs to another board
+
+        Runs in its own transaction unless called inside transaction().
+        """
+        with self.lock:
+            if not self.db.in_transaction:
+                with self.transaction():
+                    return self.add(values, path, crc, duration_ms)
+
+            keys = self._keys(values)
+            err, same_id = self._check(keys)
+            if err:
+                raise DuplicateError(err)
+            now = datetime.now().isoformat(timespec='milliseconds')
+            values_json = json.dumps(values)
+            if same_id is not None:
+                self.db.execute("UPDATE boards SET created_at = ?, generation = generation + 1, values_json = ?, "
+                                "path = ?, crc = ?, duration_ms = ? WHERE id = ?",
+                                (now, values_json, path, crc, duration_ms, same_id))
+                return same_id
+            cur = self.db.execute("INSERT INTO boards (created_at, {}, values_json, path, crc, duration_ms) "
+                                  "VALUES (?, {}?, ?, ?, ?)".format(", ".join(self.unique_fields),
+                                                                   "?, " * len(self.unique_fields)),
+                                  [now] + keys + [values_json, path, crc, duration_ms])
+            return cur.lastrowid
+
+    def move(self, paths):
+        """Point the records of moved bin files at their new location; paths: [(old path, new path)]"""
+        with self.transaction():
+            self.db.executemany("UPDATE boards SET path = ? WHERE path = ?", [(new, old) for old, new in paths])
+
+    def find(self, fld, value):
+        """Return the record of the board with fld == value as a dict, or None"""
+        if fld not in self.unique_fields:
+            raise ValueError("{} is not indexed, use one of {}".format(fld, ", ".join(self.unique_fields)))
+        with self.lock:
+            cur = self.db.execute("SELECT * FROM boards WHERE {} = ?".format(fld), (value,))
+            row = cur.fetchone()
+            return None if row is None else self._record(cur, row)
+
+    def records(self, since=None):
+        """Yield all records (optionally created at or after the ISO timestamp since) in creation order"""
+        with self.lock:
+            cur = self.db.execute("SELECT * FROM boards WHERE created_at >= ? ORDER BY id", (since or "",))
+            rows = cur.fetchall()
+        for row in rows:
+            yield self._record(cur, row)
+
+    def _keys(self, values):
+        return [str(values.get(fld, "")) for fld in self.unique_fields]
+
+    def _check(self, keys):
+        """Returns (error, id of the record with exactly these serials)"""
+        same_id = None
+        for row in self.db.execute(self._find_sql, keys):
+            if list(row[1:]) == keys:
+                same_id = row[0]
+                continue
+            for fld, key, recorded in zip(self.unique_fields, keys, row[1:]):
+                if key == recorded:
+                    return "{} '{}' already recorded for another board (record {})".format(fld, key, row[0]), None
+        return None, same_id
+
+    @staticmethod
+    def _record(cur, row):
+        record = dict(zip((col[0] for col in cur.description), row))
+        record['values'] = json.loads(record.pop('values_json'))
+        return record
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MI production record store")
+    parser.add_argument("-d", "--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           RECORD_STORE_NAME), help="Record store file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    find_cmd = commands.add_parser("find", help="Show the record of one board")
+    find_cmd.add_argument("field", choices=UNIQUE_FIELDS)
+    find_cmd.add_argument("value")
+    export_cmd = commands.add_parser("export", help="Export records as CSV")
+    export_cmd.add_argument("output", help="CSV file ('-' for stdout)")
+    export_cmd.add_argument("--since", help="Only records created at or after this date/time (YYYY-MM-DD[THH:MM])")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db):
+        print("Error: record store ({0}) not found!".format(os.path.realpath(args.db)))
+        sys.exit(1)
+
+    with RecordStore(args.db) as store:
+        if args.command == "find":
+            record = store.find(args.field, args.value)
+            if record is None:
+                print("[INFO] - No board with {} '{}'".format(args.field, args.value))
+                sys.exit(1)
+            print(json.dumps(record, indent=2))
+            return
+
+        out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+        writer = None
+        for record in store.records(args.since):
+            row = dict(record, **record.pop('values'))
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=list(row), extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow(row)
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,176 @@
+"""Barcode / DataMatrix scanner input: combined board labels parsed into the dynamic MI fields.
+
+A label carries several dynamic values at once, separated by GS (0x1D, as in DataMatrix),
+'|', ';' or tab:
+
+  fazit_id_string=FZ-0001|ecu_serial_number=ECU0001     named values, any order
+  FZ-0001|ECU0001                                        positional, in the label field order
+  FZ-0001                                                one value, for the focused (or first empty) field
+
+The label field order (LABEL_FIELDS) is the serial numbers printed on the board labels;
+MI_LABEL_FIELDS (comma separated) sets another order, e.g. for labels holding every field.
+
+Serial scanners (and USB scanners in virtual COM port mode) are read by ScannerReader on a
+background thread, one label per CR/LF terminated line. HID (keyboard wedge) scanners type the
+label into the focused entry of the UI instead.
+
+  python mi_scanner.py COM5 -i sv62_c_mcu_mi.ini -c mi_config.csv    # print what each scan fills in
+"""
+import os
+import re
+import sys
+import argparse
+import threading
+
+import serial
+
+import MI_bin_generator as mi_gen
+
+LABEL_SEPARATORS = re.compile(r"[\x1d|;\t]")
+AIM_PREFIX = re.compile(r"\A\][A-Za-z][0-9]")   # symbology identifier some scanners send first, e.g. ]d2
+LABEL_TERMINATORS = re.compile(rb"[\r\n]+")
+SCAN_BAUDRATE = 9600
+# Field order of positional label values
+LABEL_FIELDS = tuple(fld.strip() for fld in
+                     os.environ.get("MI_LABEL_FIELDS", "fazit_id_string,ecu_serial_number").split(",") if fld.strip())
+
+def is_label(text):
+    """True if text holds more than one value, i.e. is a combined label and not a single typed value"""
+    return bool(LABEL_SEPARATORS.search(text))
+
+def parse_label(text, template, layout=None, fields=None, target=None):
+    """Split a scanned label into {field: value}, returns (values, errors [(field, message)])
+
+    fields: order of positional values (default: LABEL_FIELDS).
+    target: field of a label with a single positional value, e.g. the focused entry (default: the
+    first of fields).
+    Each value is checked like a typed one (size, config type, date, printable); values with
+    an error are left out, the other fields of the label are still returned. A positional label
+    with more values than fields returns no values.
+    """
+    parts = [part.strip() for part in LABEL_SEPARATORS.split(AIM_PREFIX.sub("", text.strip()))]
+    values, errors = {}, []
+    if all("=" in part for part in parts if part):
+        for part in filter(None, parts):
+            fld, value = (s.strip() for s in part.split("=", 1))
+            if fld not in template.dynamic_sizes:
+                errors.append((fld, "unknown field {}".format(fld)))
+            else:
+                values[fld] = value
+    elif len(parts) == 1 and target is not None:
+        values = {target: parts[0]} if parts[0] else {}
+    else:
+        order = list(fields or LABEL_FIELDS)
+        if len(parts) > len(order):
+            return {}, [(None, "label has {} values, expected at most {} ({})".format(
+                len(parts), len(order), ", ".join(order)))]
+        values = {fld: value for fld, value in zip(order, parts) if value}
+
+    for fld, value in list(values.items()):
+        if fld not in template.dynamic_sizes:
+            errors.append((fld, "{} is not a dynamic field".format(fld)))
+            del values[fld]
+            continue
+        err = mi_gen.check_value(fld, value, template.dynamic_sizes[fld], layout[fld].type if layout is not None else None,
+                                 fld == template.name_field)
+        if err:
+            errors.append((fld, err))
+            del values[fld]
+    return values, errors
+
+class ScannerReader:
+    """Reads labels from a serial scanner on a daemon thread
+
+    on_scan(label) is called from that thread for every label, on_error(message) once if the
+    port fails. Raises serial.SerialException if the port cannot be opened.
+    """
+    def __init__(self, port, on_scan, on_error=None, baudrate=SCAN_BAUDRATE):
+        self.port = port
+        self.on_scan = on_scan
+        self.on_error = on_error
+        self.serial = serial.Serial(port, baudrate, timeout=0.2)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="scanner", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join(1)
+        self.serial.close()
+
+    def _run(self):
+        pending = b""
+        while not self.stopped.is_set():
+            try:
+                # Returns as soon as a byte arrives (or after the timeout), then takes the rest of the burst
+                data = self.serial.read(max(1, self.serial.in_waiting))
+            except (serial.SerialException, OSError) as e:
+                if not self.stopped.is_set() and self.on_error:
+                    self.on_error("scanner {}: {}".format(self.port, e))
+                return
+            if not data:
+                continue
+            *labels, pending = LABEL_TERMINATORS.split(pending + data)
+            for label in labels:
+                if label:
+                    self.on_scan(label.decode("utf-8", "replace"))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Show how scanned labels fill the dynamic MI fields")
+    parser.add_argument("port", help="Serial port of the scanner (e.g. COM5, /dev/ttyACM0 or a fake_scanner.py pty)")
+    parser.add_argument("-i", "--ini", required=True, help="MCU MI data file")
+    parser.add_argument("-c", "--config", required=True, help="MI config file, specifying size and type")
+    parser.add_argument("-b", "--baudrate", type=int, default=SCAN_BAUDRATE)
+    parser.add_argument("-f", "--fields", help="Field order of positional labels, comma separated "
+                        "(default: {})".format(",".join(LABEL_FIELDS)))
+    parser.add_argument("-n", "--count", type=int, help="Exit after this many labels")
+    args = parser.parse_args(argv)
+
+    try:
+        layout = mi_gen.load_layout(args.config, mi_gen.get_layout_cache_dir())
+        template = mi_gen.prepare_template(mi_gen.load_template(args.ini), layout)
+    except (OSError, mi_gen.LayoutError) as e:
+        print("[ERROR] - {}".format(e))
+        sys.exit(1)
+    fields = args.fields.split(",") if args.fields else None
+    unknown = [fld for fld in fields or () if fld not in template.dynamic_sizes]
+    if unknown:
+        print("[ERROR] - Not dynamic field(s): {}".format(", ".join(unknown)))
+        sys.exit(1)
+
+    scans = threading.Semaphore(0)
+    failed = []
+
+    def on_scan(label):
+        values, errors = parse_label(label, template, layout, fields)
+        print("[INFO] - Scanned {!r}".format(label))
+        for fld, value in values.items():
+            print("[INFO] - \t{} = '{}'".format(fld, value))
+        for fld, message in errors:
+            print("[ERROR] - \t{}".format(message))
+        scans.release()
+
+    def on_error(message):
+        failed.append(message)
+        scans.release()
+
+    try:
+        reader = ScannerReader(args.port, on_scan, on_error, args.baudrate)
+    except serial.SerialException as e:
+        print("[ERROR] - {}".format(e))
+        sys.exit(1)
+    print("[INFO] - Reading labels from {}, Ctrl+C to stop".format(args.port))
+    count = 0
+    try:
+        while not failed and (args.count is None or count < args.count):
+            scans.acquire()
+            count += 1
+    except KeyboardInterrupt:
+        pass
+    reader.stop()
+    if failed:
+        print("[ERROR] - {}".format(failed[0]))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
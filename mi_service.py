@@ -0,0 +1,359 @@
+"""Local MI generation service: MI images over HTTP for the MES, without starting a process per board.
+
+  python mi_service.py -i sv62_c_mcu_mi.ini -c mi_config.csv --port 8470
+
+The layout and the prepared template stay loaded. Boards are requested with
+
+  POST /boards   {"fazit_id_string": "FZ-0001", "ecu_serial_number": "ECU0001", ...}
+
+and answered with the MI image (application/octet-stream) and the headers X-MI-CRC, X-MI-Name,
+X-MI-Path and X-MI-Record. With "Accept: application/json" the answer is a JSON object with the
+image in base64. Rejected values answer 400, serials recorded for another board or a refused
+changed bin (--collisions refuse) 409 and a used up MAC pool 503, each with a JSON
+{"error": ..., "field": ...}.
+
+  GET /status    boards generated and failed, batches, mean batch size
+  GET /metrics   stage timings in the Prometheus text format (mi_metrics)
+
+Requests arriving while a batch is being generated are coalesced into the next batch: one worker
+thread builds them, records them in one record store transaction and writes their bin files into
+the bin store (mi_bin_store), like generate_batch() does for the rows of a manifest.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import base64
+import argparse
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import MI_bin_generator as mi_gen
+import mi_bin_store
+import mi_mac_pool
+import mi_metrics
+import mi_record_store
+
+SERVICE_PORT = 8470
+BATCH_MAX_SIZE = 256        # boards generated in one record store transaction at most
+BATCH_WINDOW = 0.0          # seconds the worker waits for more requests before it starts a batch
+REQUEST_TIMEOUT = 30.0      # seconds a request waits for its board
+MAX_REQUEST_SIZE = 64 * 1024
+
+Board = namedtuple('Board', ['name', 'image', 'crc', 'path', 'record'])
+
+class BoardError(ValueError):
+    """A board request was rejected; field is the field in error (None if not field specific)"""
+    def __init__(self, message, field=None):
+        super().__init__(message)
+        self.field = field
+
+class GenerationService:
+    """Generates boards for concurrent callers on one worker thread, in batches
+
+    template: prepare_template() output, layout: load_layout() output.
+    output_folder: folder or mi_bin_store.BinStore of the bin files (default: MI_bin_generator.get_bin_store()).
+    submit() returns a Future of a Board; generate() waits for it. Board requests fail with BoardError,
+    mi_record_store.DuplicateError, mi_bin_store.BinCollisionError or mi_mac_pool.MacPoolError.
+    """
+    def __init__(self, template, layout, output_folder=None, store=None, mac_pool=None, on_event=mi_gen.no_event,
+                 metrics=mi_metrics.no_metrics, batch_window=BATCH_WINDOW, batch_max_size=BATCH_MAX_SIZE):
+        self.template = template
+        self.layout = layout
+        self.output_folder = output_folder
+        self.store = store
+        self.mac_pool = mac_pool
+        self.on_event = on_event
+        self.metrics = metrics
+        self.batch_window = batch_window
+        self.batch_max_size = batch_max_size
+        self.generated = self.failed = self.batches = self.largest_batch = 0
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="mi-service", daemon=True)
+        self.worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Generate the boards already requested, then stop the worker"""
+        self.requests.put(None)
+        self.worker.join()
+
+    def submit(self, values):
+        """Request one board from {dynamic field: value}, returns a Future of its Board"""
+        future = Future()
+        self.requests.put((values, future))
+        return future
+
+    def generate(self, values, timeout=REQUEST_TIMEOUT):
+        return self.submit(values).result(timeout)
+
+    def status(self):
+        return {"generated": self.generated, "failed": self.failed, "batches": self.batches,
+                "mean_batch_size": round((self.generated + self.failed) / self.batches, 2) if self.batches else None,
+                "largest_batch": self.largest_batch, "layout_size": self.layout.size,
+                "dynamic_fields": list(self.template.dynamic_sizes)}
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            request = self.requests.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.perf_counter() + self.batch_window
+            # Take every request that is already waiting (or arrives within the batch window)
+            while len(batch) < self.batch_max_size:
+                try:
+                    request = self.requests.get(timeout=max(0.0, deadline - time.perf_counter())) \
+                        if self.batch_window else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            try:
+                self._generate_batch(batch)
+            except Exception as e:
+                # e.g. a locked or broken state file: fail this batch, keep serving the next ones
+                print("[ERROR] - Batch of {} request(s) failed: {}".format(len(batch), e))
+                for _values, future in batch:
+                    if not future.done():
+                        self._fail(future, e)
+
+    def _fail(self, future, error):
+        self.failed += 1
+        field = getattr(error, "field", None)
+        self.on_event("validation_error", field=field, message=str(error))
+        future.set_exception(error)
+
+    def _generate_batch(self, batch):
+        """Build, record and write one batch, resolving the future of every request"""
+        template, layout, store = self.template, self.layout, self.store
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        output = self.output_folder or mi_gen.get_bin_store()
+        built = []
+        names = set()
+        for values, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            if not isinstance(values, dict):
+                self._fail(future, BoardError("expected a JSON object of dynamic field values"))
+                continue
+            # Every check comes before the MAC allocation, so a rejected request takes no addresses
+            board, err, fld = mi_gen.check_board(template, layout, values)
+            if err is None and board[template.name_field] in names:
+                err, fld = "duplicate {} '{}' in the same batch".format(
+                    template.name_field, board[template.name_field]), template.name_field
+            if err:
+                self._fail(future, BoardError(err, fld))
+                continue
+            err = store.check(mi_gen.dynamic_values(template, board)) if store is not None else None
+            if err:
+                self._fail(future, mi_record_store.DuplicateError(err))
+                continue
+            allocated = None
+            if self.mac_pool is not None:
+                try:
+                    with self.metrics.stage("mac"):
+                        allocated = self.mac_pool.allocate()
+                except mi_mac_pool.MacPoolError as e:
+                    self._fail(future, e)
+                    continue
+            with self.metrics.stage("pack"):
+                board, image, err, fld = mi_gen.build_board(template, layout, values, allocated)
+            if err:
+                self._fail(future, BoardError(err, fld))
+                continue
+            names.add(board[template.name_field])
+            built.append((future, board, image, allocated, start))
+
+        done = []
+        try:
+            with (store.transaction() if store is not None else nullcontext()), \
+                    (output.transaction() if isinstance(output, mi_bin_store.BinStore) else nullcontext()):
+                for future, board, image, allocated, start in built:
+                    name = board[template.name_field]
+                    crc = layout.crc.packer.unpack_from(image, layout.crc.offset)[0]
+                    if store is not None:
+                        # Checked before the write, recorded with the path the file got
+                        recorded = mi_gen.dynamic_values(template, board, allocated)
+                        err = store.check(recorded)
+                        self.metrics.observe("record", time.perf_counter() - start)
+                        if err:
+                            self._fail(future, mi_record_store.DuplicateError(err))
+                            continue
+                    try:
+                        with self.metrics.stage("write"):
+                            output_file = mi_gen.write_bin(output, name, image)
+                    except mi_bin_store.BinCollisionError as e:
+                        self._fail(future, e)
+                        continue
+                    record = None
+                    if store is not None:
+                        record_start = time.perf_counter()
+                        record = store.add(recorded, output_file, crc, (record_start - start) * 1000)
+                        self.metrics.observe("record", time.perf_counter() - record_start)
+                    done.append((future, Board(name, image, crc, output_file, record)))
+        except Exception as e:
+            # Nothing of the batch was recorded, fail the boards that were still pending
+            print("[ERROR] - Batch of {} board(s) failed: {}".format(len(built), e))
+            for future, _board, _image, _allocated, _start in built:
+                if not future.done():
+                    self._fail(future, e)
+            return
+
+        for future, result in done:
+            self.generated += 1
+            self.metrics.count("generated")
+            self.on_event("generated", path=result.path, size=len(result.image), crc=result.crc)
+            future.set_result(result)
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128    # connections of concurrent MES clients waiting to be accepted
+
+def make_handler(service):
+    """Request handler class serving service"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/status":
+                self.send_json(200, service.status())
+            elif path == "/metrics" and isinstance(service.metrics, mi_metrics.Metrics):
+                self.send_body(200, service.metrics.prometheus_text().encode(), "text/plain; version=0.0.4")
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/boards":
+                self.send_json(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if not 0 < length <= MAX_REQUEST_SIZE:
+                self.send_json(400, {"error": "expected a JSON body of at most {} bytes".format(MAX_REQUEST_SIZE)})
+                return
+            try:
+                values = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                self.send_json(400, {"error": "invalid JSON: {}".format(e)})
+                return
+            try:
+                board = service.generate(values)
+            except BoardError as e:
+                self.send_json(400, {"error": str(e), "field": e.field})
+                return
+            except (mi_record_store.DuplicateError, mi_bin_store.BinCollisionError) as e:
+                self.send_json(409, {"error": str(e), "field": None})
+                return
+            except mi_mac_pool.MacPoolError as e:
+                self.send_json(503, {"error": str(e), "field": None})
+                return
+            except Exception as e:
+                self.send_json(500, {"error": str(e), "field": None})
+                return
+
+            if "application/json" in self.headers.get("Accept", ""):
+                self.send_json(200, {"name": board.name, "crc": "0x{:08X}".format(board.crc), "path": board.path,
+                                     "record": board.record, "image": base64.b64encode(board.image).decode()})
+                return
+            self.send_body(200, board.image, "application/octet-stream", {
+                "X-MI-CRC": "0x{:08X}".format(board.crc), "X-MI-Name": board.name, "X-MI-Path": board.path,
+                "X-MI-Record": "" if board.record is None else str(board.record)})
+
+        def send_json(self, code, data):
+            self.send_body(code, json.dumps(data).encode(), "application/json")
+
+        def send_body(self, code, body, content_type, headers=None):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Local MI generation service (HTTP)")
+    parser.add_argument("-i", "--ini", required=True, help="MCU MI data file")
+    parser.add_argument("-c", "--config", required=True, help="MI config file, specifying size and type")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1, local only)")
+    parser.add_argument("-p", "--port", type=int, default=SERVICE_PORT,
+                        help="Port to listen on (default {})".format(SERVICE_PORT))
+    parser.add_argument("-o", "--output", help="Folder of the bin store (default: next to this script)")
+    parser.add_argument("--collisions", choices=mi_bin_store.COLLISION_POLICIES, default='version',
+                        help="Board whose bin file changed: store a new version (default) or refuse it")
+    parser.add_argument("-r", "--records", help="Production record store (default: {} next to this script)".format(
+        mi_record_store.RECORD_STORE_NAME))
+    parser.add_argument("-m", "--mac-pool", help="MAC pool config, allocates the MAC fields of every board")
+    parser.add_argument("-e", "--events", help="Write machine-readable JSON line events to this file ('-' for stdout)")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW * 1000,
+                        help="Milliseconds to wait for more requests before generating a batch (default 0: "
+                        "batch only the requests already waiting)")
+    parser.add_argument("--batch-max", type=int, default=BATCH_MAX_SIZE,
+                        help="Most boards per batch (default {})".format(BATCH_MAX_SIZE))
+    args = parser.parse_args(argv)
+
+    on_event = mi_gen.no_event
+    if args.events:
+        on_event = mi_gen.json_event_sink(sys.stdout if args.events == '-' else open(args.events, 'a'))
+
+    try:
+        layout = mi_gen.load_layout(args.config, mi_gen.get_layout_cache_dir())
+        template = mi_gen.prepare_template(mi_gen.load_template(args.ini), layout)
+    except (OSError, mi_gen.LayoutError) as e:
+        print("[ERROR] - {}".format(e))
+        sys.exit(1)
+
+    mac_pool = None
+    if args.mac_pool:
+        try:
+            mac_pool = mi_mac_pool.MacPool(args.mac_pool)
+            mac_pool.check_layout(layout)
+        except (mi_mac_pool.MacPoolError, ValueError) as e:
+            print("[ERROR] - Invalid MAC pool: {}".format(e))
+            sys.exit(1)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        bins = mi_bin_store.BinStore(args.output, args.collisions)
+    else:
+        bins = mi_gen.get_bin_store()
+        bins.collisions = args.collisions
+
+    store = mi_record_store.RecordStore(args.records or mi_gen.get_record_store_path())
+    metrics = mi_metrics.Metrics()
+    service = GenerationService(template, layout, bins, store, mac_pool, on_event, metrics,
+                                args.batch_window / 1000, max(1, args.batch_max))
+    server = ServiceServer((args.host, args.port), make_handler(service))
+    print("[INFO] - Serving MI images of '{}' on http://{}:{}/boards, Ctrl+C to stop".format(
+        os.path.basename(args.ini), args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    service.close()
+    store.close()
+    bins.close()
+    if mac_pool is not None:
+        mac_pool.close()
+    print("[INFO] - {} board(s) generated, {} rejected".format(service.generated, service.failed))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -7,29 +7,50 @@
 #                and flash to target devices via COM port.
 #                Features:
 #                  - INI/CSV file selection
-#                  - Interactive MI_bin_generator input
-#                  - Hex viewer for generated BIN
+#                  - MI input form generated from the dynamic MI fields
+#                  - Hex viewer for generated BIN (MI fields + CRC)
 #                  - COM port selection & test connection
-#                  - Flashing via S32FlashTool
-#  Notes       : It shall be taken into account while creating one file that
-#                the python script will trigger another python script.
-#                So creation of exe directly will have unexpected results.
+#                  - Flashing via S32FlashTool, queued per COM port so
+#                    several boards of a fixture rack flash in parallel
+#                  - Hex view / flashing of single boards of an MI container
+#                  - Pipelined mode: generated boards are flashed automatically
+#                    on the next free port while the next board is entered
+#                  - Product selection from the layout registry (mi_layouts.ini)
+#                  - Barcode / DataMatrix labels from a serial or HID scanner
+#                    fill the MI input form
+#  Notes       : MI bin files are generated in-process through the
+#                MI_bin_generator library, no second python process is
+#                started per board.
 #
 #  Recommended to trigger script using a bat file with no arguments.
 # =============================================================================
 
 import os
 import sys
+import mmap
+import zlib
+import time
+import shutil
+import tempfile
 import tkinter as tk
+import tkinter.font as tkfont
 from tkinter import filedialog, scrolledtext
 from tkinter import ttk
-import subprocess
 import threading
+from collections import deque
 import serial.tools.list_ports
 import ttkbootstrap as tb
-import signal
-import tempfile
-import shutil
+import MI_bin_generator as mi_gen
+import mi_container
+import mi_layouts
+import mi_scanner
+import mi_record_store
+import mi_mac_pool
+import mi_flasher
+import mi_metrics
+
+FLASH_WORKERS = 8   # COM ports flashed at the same time
+METRICS_REFRESH_MS = 5000   # metrics line and mi_metrics.prom update interval
 
 # ----------------------------- Resource Path -----------------------------
 def resource_path(relative_path):
@@ -40,6 +61,177 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+# =========================================================================
+#                               HEX VIEWER
+# =========================================================================
+HEX_ROW_BYTES = 16
+HEX_ASCII_TABLE = bytes(b if 32 <= b <= 126 else ord('.') for b in range(256))
+HEX_COL = 10                                # first hex digit column in a row
+ASCII_COL = HEX_COL + HEX_ROW_BYTES * 3 + 1  # first ascii column in a row
+
+def format_hex_rows(data, first_row, row_count):
+    """Format row_count hex dump rows of data (bytes/mmap) starting at first_row."""
+    out = []
+    start = first_row * HEX_ROW_BYTES
+    end = min(len(data), start + row_count * HEX_ROW_BYTES)
+    for offset in range(start, end, HEX_ROW_BYTES):
+        chunk = data[offset:offset + HEX_ROW_BYTES]
+        hexstr = chunk.hex(" ").upper()
+        out.append(f"{offset:08X}  {hexstr:<48}  {chunk.translate(HEX_ASCII_TABLE).decode('ascii')}")
+    return out
+
+def format_seconds(seconds):
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:.1f} s"
+
+def format_field_value(field, value):
+    if field.type == "array":
+        return ":".join(f"{b:02X}" for b in value)
+    if field.type == "str":
+        return repr(value)
+    return f"{value} (0x{value:X})"
+
+class HexViewer:
+    """Hex viewer that mmaps the file and renders only the visible rows.
+
+    When an MI layout is given and the file holds at least one MI image, the fields of
+    the image at offset 0 are listed with their decoded values and the trailing CRC is checked.
+    With record, path is an MI container and only that record is read (through its mmap).
+    """
+    def __init__(self, root, path, layout=None, record=None):
+        if record is None:
+            self.file = open(path, "rb")
+            size = os.fstat(self.file.fileno()).st_size
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        else:
+            self.file = None
+            with mi_container.Container(path) as container:
+                self.data = container.record(record)
+        self.total_rows = (len(self.data) + HEX_ROW_BYTES - 1) // HEX_ROW_BYTES
+        self.first_row = 0
+        self.visible_rows = 40
+        self.selected = None
+        self.layout = layout if layout and len(self.data) >= layout.size else None
+
+        self.win = tk.Toplevel(root)
+        self.win.title(f"Hex Viewer - {os.path.basename(path)}" + (f"#{record}" if record is not None else ""))
+        self.win.protocol("WM_DELETE_WINDOW", self.close)
+        self.win.columnconfigure(0, weight=1)
+        self.win.rowconfigure(0, weight=1)
+
+        self.text = tk.Text(self.win, width=78, height=self.visible_rows, wrap="none", font="TkFixedFont")
+        self.text.grid(row=0, column=0, sticky="nsew")
+        self.text.tag_configure("field_a", background="#eef4fb")
+        self.text.tag_configure("field_b", background="#fbf3e6")
+        self.text.tag_configure("selected", background="#ffd966")
+        self.line_height = tkfont.Font(font=self.text["font"]).metrics("linespace")
+
+        self.scroll = ttk.Scrollbar(self.win, orient="vertical", command=self.on_scroll)
+        self.scroll.grid(row=0, column=1, sticky="ns")
+
+        self.text.bind("<Configure>", self.on_resize)
+        self.text.bind("<MouseWheel>", lambda e: self.scroll_to(self.first_row - e.delta // 120 * 3))
+        self.text.bind("<Button-4>", lambda e: self.scroll_to(self.first_row - 3))
+        self.text.bind("<Button-5>", lambda e: self.scroll_to(self.first_row + 3))
+
+        status = f"{len(self.data)} bytes"
+        if self.layout:
+            self.build_field_list()
+            image = self.data[:self.layout.size]
+            stored = self.layout.crc.packer.unpack_from(image, self.layout.crc.offset)[0]
+            if mi_gen.check_crc(image, self.layout):
+                status += f"  |  CRC OK (0x{stored:08X})"
+            else:
+                calc = zlib.crc32(image[:self.layout.crc.offset])
+                status += f"  |  CRC MISMATCH (stored 0x{stored:08X}, calculated 0x{calc:08X})"
+        tb.Label(self.win, text=status).grid(row=1, column=0, columnspan=3, sticky="w", padx=4, pady=2)
+
+        self.render()
+
+    def build_field_list(self):
+        tree = ttk.Treeview(self.win, columns=("offset", "type", "size", "value"), height=20)
+        tree.heading("#0", text="Field")
+        for col, width in (("offset", 70), ("type", 50), ("size", 45), ("value", 220)):
+            tree.heading(col, text=col.capitalize())
+            tree.column(col, width=width, stretch=(col == "value"))
+        tree.grid(row=0, column=2, sticky="nsew")
+        self.win.columnconfigure(2, weight=1)
+
+        values = mi_gen.parse_mi(self.data[:self.layout.size], self.layout)
+        for field in self.layout:
+            tree.insert("", tk.END, iid=field.name, text=field.name, values=(
+                f"0x{field.offset:04X}", field.type, field.size, format_field_value(field, values[field.name])))
+        tree.bind("<<TreeviewSelect>>", lambda _e: self.select_field(tree.selection()))
+        self.field_index = {field.name: i for i, field in enumerate(self.layout)}
+
+    def select_field(self, selection):
+        if not selection:
+            return
+        self.selected = self.layout[selection[0]]
+        row = self.selected.offset // HEX_ROW_BYTES
+        if not (self.first_row <= row < self.first_row + self.visible_rows):
+            self.first_row = max(0, row - 2)
+        self.render()
+
+    # ----------------------------- Scrolling -----------------------------
+    def on_scroll(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * self.total_rows))
+        elif args[0] == "scroll":
+            step = self.visible_rows if args[2] == "pages" else 1
+            self.scroll_to(self.first_row + int(args[1]) * step)
+
+    def scroll_to(self, row):
+        row = max(0, min(row, self.total_rows - self.visible_rows))
+        if row != self.first_row:
+            self.first_row = row
+            self.render()
+        return "break"
+
+    def on_resize(self, event):
+        rows = max(1, event.height // self.line_height)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.first_row = max(0, min(self.first_row, self.total_rows - rows))
+            self.render()
+
+    # ----------------------------- Rendering -----------------------------
+    def render(self):
+        rows = format_hex_rows(self.data, self.first_row, self.visible_rows)
+        self.text.config(state="normal")
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", "\n".join(rows))
+        if self.layout:
+            self.tag_fields(len(rows))
+        self.text.config(state="disabled")
+
+        if self.total_rows:
+            self.scroll.set(self.first_row / self.total_rows,
+                            min(1.0, (self.first_row + self.visible_rows) / self.total_rows))
+
+    def tag_fields(self, row_count):
+        """Shade the visible bytes per MI field, alternating colours at each field boundary."""
+        start = self.first_row * HEX_ROW_BYTES
+        end = min(self.layout.size, start + row_count * HEX_ROW_BYTES)
+        for field in self.layout:
+            lo, hi = max(field.offset, start), min(field.offset + field.size, end)
+            if lo >= hi:
+                continue
+            tag = "selected" if field is self.selected else ("field_a", "field_b")[self.field_index[field.name] % 2]
+            for offset in range(lo, hi):
+                line = offset // HEX_ROW_BYTES - self.first_row + 1
+                col = offset % HEX_ROW_BYTES
+                self.text.tag_add(tag, f"{line}.{HEX_COL + col * 3}", f"{line}.{HEX_COL + col * 3 + 2}")
+                self.text.tag_add(tag, f"{line}.{ASCII_COL + col}", f"{line}.{ASCII_COL + col + 1}")
+
+    def close(self):
+        try:
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+            if self.file is not None:
+                self.file.close()
+        finally:
+            self.win.destroy()
+
 # =========================================================================
 #                                MAIN UI
 # =========================================================================
@@ -49,9 +241,29 @@ class MI_UI:
         self.root.title("MI Generator & Flasher UI")
         self.ini_path = tk.StringVar()
         self.csv_path = tk.StringVar()
+        self.product = tk.StringVar()
+        self.registry = None
         self.selected_com = tk.StringVar()
-        self.proc = None
+        self.scanner_port = tk.StringVar()
+        self.scanner = None
+        self.readback = tk.BooleanVar(value=False)
+        self.auto_flash = tk.BooleanVar(value=False)
+        self.pipeline = deque()   # (bin file, generated at) of boards waiting for a free pipeline port
+        self.boards_ready = set()  # pipeline ports with a new board loaded (Board Ready), free once idle
         self.output_bin = None
+        self.output_record = None   # record number when output_bin is an MI container
+        self.container_path = tk.StringVar()
+        self.record_serial = tk.StringVar()
+        self.extract_dir = None
+        self.layout = None
+        self.template = None
+        self.form_entries = {}
+        self.store = None
+        self.mac_pool = None
+        self.metrics = mi_metrics.Metrics()
+        self.input_started = None
+        self.flasher = mi_flasher.FlashScheduler(max_workers=FLASH_WORKERS, on_status=self.on_flash_status,
+                                                 on_output=self.on_flash_output, on_done=self.on_flash_done)
         tb.Style(theme="flatly")
 
         # ----------------------------- Main Layout -----------------------------
@@ -87,40 +299,88 @@ class MI_UI:
 
         tb.Button(com_frame, text="Refresh", bootstyle="info", command=self.refresh_com_ports).grid(row=0, column=2, padx=5)
         tb.Button(com_frame, text="Test Connection", bootstyle="warning", command=self.test_connection).grid(row=0, column=3)
+        tb.Button(com_frame, text="Board Ready", bootstyle="success", command=self.board_ready).grid(
+            row=0, column=4, padx=5, sticky="w")
+
+        # Serial barcode scanner (the port may also be typed in, e.g. a fake_scanner.py pty)
+        tb.Label(com_frame, text="Scanner:").grid(row=0, column=5, sticky="e")
+        self.scanner_box = ttk.Combobox(com_frame, textvariable=self.scanner_port, width=15)
+        self.scanner_box.grid(row=0, column=6, padx=5)
+        self.scan_btn = tb.Button(com_frame, text="Connect", bootstyle="secondary", command=self.toggle_scanner)
+        self.scan_btn.grid(row=0, column=7)
+
+        # Live flash status of every port, double click selects the port for Flash MI,
+        # the selected rows are the ports of the auto-flash pipeline
+        columns = ("state", "queued", "done", "failed", "message")
+        self.port_tree = ttk.Treeview(com_frame, columns=columns, height=4)
+        self.port_tree.heading("#0", text="Port")
+        self.port_tree.column("#0", width=90, stretch=False)
+        for col, width in zip(columns, (80, 60, 60, 60, 420)):
+            self.port_tree.heading(col, text=col.capitalize())
+            self.port_tree.column(col, width=width, stretch=(col == "message"), anchor="w" if col == "message" else "center")
+        self.port_tree.grid(row=1, column=0, columnspan=8, sticky="ew", pady=(6, 0))
+        self.port_tree.bind("<Double-1>", self.select_port)
+        com_frame.columnconfigure(4, weight=1)
+
+        self.metrics_label = tb.Label(com_frame, text="Throughput: -")
+        self.metrics_label.grid(row=2, column=0, columnspan=8, sticky="w", pady=(4, 0))
 
         self.refresh_com_ports()
 
+        # ----------------------------- Product -----------------------------
+        # Products of the layout registry, selecting one fills in its INI + CSV
+        product_frame = tb.Frame(left)
+        product_frame.grid(row=0, column=0, columnspan=2, sticky="w", pady=(0, 10))
+        tb.Label(product_frame, text="Product:").grid(row=0, column=0, sticky="w")
+        self.product_box = ttk.Combobox(product_frame, textvariable=self.product, width=30, state="readonly")
+        self.product_box.grid(row=0, column=1, padx=5)
+        self.product_box.bind("<<ComboboxSelected>>", self.select_product)
+        self.load_registry()
+
         # ----------------------------- INI File -----------------------------
-        tb.Label(left, text="Select mcu_mi.ini:").grid(row=0, column=0, sticky="w")
-        tb.Entry(left, textvariable=self.ini_path, width=45).grid(row=1, column=0, sticky="w")
-        tb.Button(left, text="Browse", bootstyle="secondary", command=self.browse_ini).grid(row=1, column=1, padx=5)
+        tb.Label(left, text="Select mcu_mi.ini:").grid(row=1, column=0, sticky="w")
+        tb.Entry(left, textvariable=self.ini_path, width=45).grid(row=2, column=0, sticky="w")
+        tb.Button(left, text="Browse", bootstyle="secondary", command=self.browse_ini).grid(row=2, column=1, padx=5)
 
         # ----------------------------- CSV File -----------------------------
-        tb.Label(left, text="Select mi_config.csv:").grid(row=2, column=0, sticky="w", pady=(10, 0))
-        tb.Entry(left, textvariable=self.csv_path, width=45).grid(row=3, column=0, sticky="w")
-        tb.Button(left, text="Browse", bootstyle="secondary", command=self.browse_csv).grid(row=3, column=1, padx=5)
+        tb.Label(left, text="Select mi_config.csv:").grid(row=3, column=0, sticky="w", pady=(10, 0))
+        tb.Entry(left, textvariable=self.csv_path, width=45).grid(row=4, column=0, sticky="w")
+        tb.Button(left, text="Browse", bootstyle="secondary", command=self.browse_csv).grid(row=4, column=1, padx=5)
 
         # ----------------------------- Control Buttons -----------------------------
         self.start_btn = tb.Button(left, text="Start MI", bootstyle="success", command=self.run_script)
-        self.start_btn.grid(row=4, column=0, pady=12, sticky="w")
+        self.start_btn.grid(row=5, column=0, pady=12, sticky="w")
 
         self.hex_btn = tb.Button(left, text="View Hex File", bootstyle="info", state="disabled", command=self.show_hex)
-        self.hex_btn.grid(row=5, column=0, sticky="w")
+        self.hex_btn.grid(row=6, column=0, sticky="w")
 
         self.flash_btn = tb.Button(left, text="Flash MI", bootstyle="danger", state="disabled", command=self.flash_mi)
-        self.flash_btn.grid(row=6, column=0, pady=(6, 0), sticky="w")
+        self.flash_btn.grid(row=7, column=0, pady=(6, 0), sticky="w")
+        tb.Checkbutton(left, text="Read-back compare (skip if unchanged)", variable=self.readback,
+                       bootstyle="round-toggle").grid(row=7, column=1, pady=(6, 0), sticky="w")
+        tb.Checkbutton(left, text="Auto-flash generated boards (pipeline)", variable=self.auto_flash,
+                       bootstyle="round-toggle", command=self.dispatch_pipeline).grid(row=6, column=1, sticky="w")
 
         self.output_label = tb.Label(left, text="Output File: -")
-        self.output_label.grid(row=7, column=0, pady=10, sticky="w")
-
-        # ----------------------------- Interactive Input Box -----------------------------
-        tb.Label(left, text="Send Input to MI_bin_generator:").grid(row=8, column=0, sticky="w", pady=(5, 0))
-        input_frame = tb.Frame(left)
-        input_frame.grid(row=9, column=0, sticky="w")
-
-        self.input_entry = tb.Entry(input_frame, width=35)
-        self.input_entry.grid(row=0, column=0, padx=(0, 6))
-        tb.Button(input_frame, text="Send", bootstyle="secondary", command=self.send_input).grid(row=0, column=1)
+        self.output_label.grid(row=8, column=0, pady=10, sticky="w")
+        self.pipeline_label = tb.Label(left, text="Pipeline: 0 board(s) waiting for a free port")
+        self.pipeline_label.grid(row=8, column=1, pady=10, sticky="w")
+
+        # ----------------------------- MI Container -----------------------------
+        # A pre-provisioned board is picked from a container by fazit ID or ECU serial number
+        tb.Label(left, text="MI container (optional):").grid(row=9, column=0, sticky="w")
+        tb.Entry(left, textvariable=self.container_path, width=45).grid(row=10, column=0, sticky="w")
+        tb.Button(left, text="Browse", bootstyle="secondary", command=self.browse_container).grid(row=10, column=1, padx=5)
+        serial_entry = tb.Entry(left, textvariable=self.record_serial, width=45)
+        serial_entry.grid(row=11, column=0, pady=(4, 0), sticky="w")
+        serial_entry.bind("<Return>", self.select_record)
+        tb.Button(left, text="Select Board", bootstyle="info", command=self.select_record).grid(
+            row=11, column=1, padx=5, pady=(4, 0))
+
+        # ----------------------------- MI Input Form -----------------------------
+        tb.Label(left, text="MI dynamic values:").grid(row=12, column=0, sticky="w", pady=(10, 0))
+        self.form_frame = tb.Frame(left)
+        self.form_frame.grid(row=13, column=0, columnspan=2, sticky="w")
 
         # ----------------------------- Logo -----------------------------
         #logo_path = resource_path("images.png")
@@ -132,7 +392,7 @@ class MI_UI:
         if os.path.isfile(logo_path):
             try:
                 self.logo_img = tk.PhotoImage(file=logo_path)
-                tb.Label(left, image=self.logo_img).grid(row=10, column=0, pady=18, sticky="sw")
+                tb.Label(left, image=self.logo_img).grid(row=14, column=0, pady=18, sticky="sw")
             except Exception as e:
                 self.log(f"Logo load error: {e}")
         else:
@@ -141,7 +401,7 @@ class MI_UI:
         if os.path.isfile(logo_path):
             try:
                 self.logo_img = tk.PhotoImage(file=logo_path)
-                tb.Label(left, image=self.logo_img).grid(row=10, column=0, pady=18, sticky="sw")
+                tb.Label(left, image=self.logo_img).grid(row=14, column=0, pady=18, sticky="sw")
             except Exception as e:
                 self.log(f"Logo load error: {e}")
         else:
@@ -151,6 +411,17 @@ class MI_UI:
 
         root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+        # Metrics: shown in the UI, exported to mi_metrics.prom, served on MI_METRICS_PORT if set
+        self.metrics_file = os.path.join(mi_gen.parent_folder, mi_metrics.METRICS_FILE_NAME)
+        metrics_port = os.environ.get("MI_METRICS_PORT")
+        if metrics_port:
+            try:
+                self.metrics.serve(int(metrics_port))
+                self.log(f"Metrics served at http://127.0.0.1:{metrics_port}/metrics")
+            except (OSError, ValueError) as e:
+                self.log(f"Metrics endpoint error: {e}")
+        self.refresh_metrics()
+
     # =========================================================================
     #                               LOGGING
     # =========================================================================
@@ -174,15 +445,50 @@ class MI_UI:
         if f:
             self.csv_path.set(f)
 
+    def browse_container(self):
+        f = filedialog.askopenfilename(filetypes=[("MI containers", f"*{mi_container.CONTAINER_EXT}")])
+        if f:
+            self.container_path.set(f)
+
+    # =========================================================================
+    #                               PRODUCTS
+    # =========================================================================
+    def load_registry(self):
+        path = mi_layouts.get_registry_path()
+        if not os.path.isfile(path):
+            return
+        try:
+            self.registry = mi_layouts.LayoutRegistry.load(path, mi_gen.get_layout_cache_dir())
+        except (OSError, mi_gen.LayoutError) as e:
+            self.log(f"Layout registry error: {e}")
+            return
+        self.product_box["values"] = list(self.registry.products)
+
+    def select_product(self, _event=None):
+        product = self.registry.products[self.product.get()]
+        self.ini_path.set(product.ini)
+        self.csv_path.set(product.config)
+        self.layout = self.registry.layout(product)
+        self.log(f"Product {product.name}: magic_id 0x{product.magic:X} version {product.version}, "
+                 f"{self.layout.size} bytes. Click Start MI.")
+
     # =========================================================================
     #                               COM PORTS
     # =========================================================================
     def refresh_com_ports(self):
         ports = [p.device for p in serial.tools.list_ports.comports()]
         self.combobox["values"] = ports
+        self.scanner_box["values"] = ports
         self.selected_com.set(ports[0] if ports else "")
+        for port in ports:
+            self.on_flash_status(self.flasher.status(port))
         self.log("COM ports refreshed.")
 
+    def select_port(self, _event=None):
+        port = self.port_tree.focus()
+        if port:
+            self.selected_com.set(port)
+
     # =========================================================================
     #                           TEST CONNECTION
     # =========================================================================
@@ -192,43 +498,90 @@ class MI_UI:
             self.log("Select a COM port.")
             return
 
-        s32 = resource_path(r"C:\NXP\S32FlashTool_2.1.2RTM\bin\S32FlashTool.exe")
-        target = resource_path(r"C:\NXP\S32FlashTool_2.1.2RTM\targets\S32G3xxx.bin")
-        algorithm = resource_path(r"C:\NXP\S32FlashTool_2.1.2RTM\flash\MX66U2G45G.bin")
-        cmd = [s32, "-t", target, "-a", algorithm, "-i", "uart", "-p", com]
-
         self.log(f"Testing connection on {com}...")
 
-        def reader(pipe):
-            for line in iter(pipe.readline, ''):   # read full lines until EOF
-                if not line:
-                    break
-                # Strip only the final newline, keep other formatting
-                clean = line.rstrip()
-                self.root.after(0, lambda t=clean: self.log(t))
-            pipe.close()
-
         def worker():
-            try:
-                p = subprocess.Popen(
-                    cmd, stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1,
-                    creationflags=subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
-                )
-                threading.Thread(target=reader, args=(p.stdout,), daemon=True).start()
-                p.wait()
-                self.root.after(0, lambda: self.log("Algorithm download complete."))
-            except Exception as e:
-                self.root.after(0, lambda e=e: self.log(f"Error: {e}"))
+            ok, message = self.flasher.backend.connect(com, mi_flasher.DEFAULT_POLICY.timeout,
+                                                       lambda line: self.root.after(0, lambda t=line: self.log(t)))
+            # Only checks the link: the board flashed next may be another one, so it gets its own download
+            self.flasher.backend.end_session(com)
+            text = "Algorithm download complete." if ok else f"Error: {message}"
+            self.root.after(0, lambda: self.log(text))
 
         threading.Thread(target=worker, daemon=True).start()
 
+    # =========================================================================
+    #                               SCANNER
+    # =========================================================================
+    def toggle_scanner(self):
+        if self.scanner is not None:
+            self.scanner.stop()
+            self.scanner = None
+            self.scan_btn.config(text="Connect")
+            self.log("Scanner disconnected.")
+            return
+
+        port = self.scanner_port.get()
+        if not port:
+            self.log("Select the scanner port.")
+            return
+        try:
+            self.scanner = mi_scanner.ScannerReader(port, self.on_scan, self.on_scanner_error)
+        except mi_scanner.serial.SerialException as e:
+            self.log(f"[Error] - Scanner: {e}")
+            return
+        self.scan_btn.config(text="Disconnect")
+        self.log(f"Scanner connected on {port}.")
+
+    def on_scanner_error(self, message):
+        def report():
+            self.log(f"[Error] - {message}")
+            if self.scanner is not None:
+                self.scanner.stop()
+                self.scanner = None
+                self.scan_btn.config(text="Connect")
+
+        self.root.after(0, report)
+
+    def on_scan(self, label):
+        """A scanned label fills the form; a label with every dynamic field generates the board at once."""
+        if threading.current_thread() is not threading.main_thread():
+            self.root.after(0, lambda: self.on_scan(label))
+            return
+        if not self.template:
+            self.log("Scan ignored, click Start MI first.")
+            return
+
+        # A single value goes to the focused entry, else to the first empty one
+        focused = self.root.focus_get()
+        target = next((fld for fld, entry in self.form_entries.items() if entry is focused), None) or \
+            next((fld for fld, entry in self.form_entries.items() if not entry.get()), None)
+        values, errors = mi_scanner.parse_label(label, self.template, self.layout, target=target)
+        for fld, message in errors:
+            self.log(f"[Error] - Scan: {message}")
+        for fld, value in values.items():
+            entry = self.form_entries[fld]
+            entry.delete(0, tk.END)
+            entry.insert(0, value)
+        if values:
+            self.log(f"Scanned: {', '.join(values)}")
+        if not errors and len(values) == len(self.form_entries):
+            self.generate_mi()
+            return
+        unfilled = [fld for fld in self.form_entries if fld not in values]
+        if unfilled:
+            self.form_entries[unfilled[0]].focus_set()
+
     # =========================================================================
     #                          RUN MI GENERATOR (FULL UI)
     # =========================================================================
     def run_script(self):
+        with self.metrics.stage("load"):
+            self.load_mi_files()
+        if self.template:
+            self.input_started = time.perf_counter()
+
+    def load_mi_files(self):
         self.console.delete("1.0", tk.END)
 
         ini = self.ini_path.get()
@@ -237,140 +590,150 @@ class MI_UI:
             self.log("Select valid INI + CSV files.")
             return
 
-        # -------------------- FIXED for PyInstaller onefile --------------------
-        if getattr(sys, "frozen", False):
-            # Extract MI_bin_generator.py to a temp folder
-            temp_dir = tempfile.mkdtemp()
-            script = os.path.join(temp_dir, "MI_bin_generator.py")
-            shutil.copy(resource_path("MI_bin_generator.py"), script)
-            python_exec = sys.executable
+        try:
+            self.layout = mi_gen.load_layout(csv, mi_gen.get_layout_cache_dir())
+            self.template = mi_gen.prepare_template(mi_gen.load_template(ini), self.layout)
+            if self.store is None:
+                self.store = mi_record_store.RecordStore(mi_gen.get_record_store_path())
+            mac_config = os.path.join(mi_gen.parent_folder, mi_mac_pool.MAC_POOL_CONFIG)
+            if self.mac_pool is None and os.path.isfile(mac_config):
+                self.mac_pool = mi_mac_pool.MacPool(mac_config)
+                self.log(f"MAC addresses allocated from {mac_config}")
+            if self.mac_pool is not None:
+                self.mac_pool.check_layout(self.layout)
+        except (OSError, mi_gen.LayoutError, mi_record_store.sqlite3.Error, mi_mac_pool.MacPoolError) as e:
+            self.template = None
+            self.log(f"Invalid INI/CSV: {e}")
+            return
+
+        self.build_form()
+        self.log(f"Loaded {os.path.basename(ini)} + {os.path.basename(csv)}")
+        self.log("=== Enter MI inputs and click Generate MI ===")
+
+    def build_form(self):
+        """One entry per dynamic MI field; Enter moves to the next field, on the last one it generates.
+
+        A combined label typed by an HID scanner into any entry fills the form (see on_scan).
+        """
+        for child in self.form_frame.winfo_children():
+            child.destroy()
+        self.form_entries = {}
+
+        for row, (fld, size) in enumerate(self.template.dynamic_sizes.items()):
+            hint = " [DDMMYYYY]" if fld == "production_date" else ""
+            tb.Label(self.form_frame, text=f"{fld} ({size} byte){hint}").grid(row=row, column=0, sticky="w")
+            entry = tb.Entry(self.form_frame, width=28)
+            entry.grid(row=row, column=1, padx=(6, 0), pady=1, sticky="w")
+            self.form_entries[fld] = entry
+
+        entries = list(self.form_entries.values())
+        for entry, nxt in zip(entries, entries[1:] + [None]):
+            entry.bind("<Return>", lambda _e, e=entry, n=nxt: self.on_form_enter(e, n))
+        if entries:
+            entries[0].focus_set()
+
+        tb.Button(self.form_frame, text="Generate MI", bootstyle="success",
+                  command=self.generate_mi).grid(row=len(entries), column=0, pady=(6, 0), sticky="w")
+
+    def on_form_enter(self, entry, next_entry):
+        text = entry.get()
+        if mi_scanner.is_label(text):
+            entry.delete(0, tk.END)
+            self.on_scan(text)
+        elif next_entry is None:
+            self.generate_mi()
         else:
-            script = os.path.abspath("MI_bin_generator.py")
-            python_exec = sys.executable
-
-        cmd = [python_exec, "-u", script, f"--i={ini}", f"-c={csv}"]
-        self.log(f"Running: {' '.join(cmd)}")
-        self.log("=== Start sending MI inputs below ===")
-
-        # ---------------------------------------------------------
-        # Prompt-aware READER
-        # ---------------------------------------------------------
-        def reader(pipe):
-            buffer = ""
-            while True:
-                ch = pipe.read(1)
-                if not ch:
-                    break
-                buffer += ch
-
-                if ch == "\n" or buffer.endswith(":") or buffer.endswith(": ") or buffer.endswith(") "):
-                    out = buffer
-                    buffer = ""
-                    self.root.after(0, lambda t=out: self.log(t.rstrip()))
-            pipe.close()
-
-        # ---------------------------------------------------------
-        def worker():
-            try:
-                self.proc = subprocess.Popen(
-                    cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1
-                )
-                threading.Thread(target=reader, args=(self.proc.stdout,), daemon=True).start()
-            except Exception as e:
-                self.root.after(0, lambda e=e: self.log(f"Exception: {e}"))
-
-        # ---------------------------------------------------------
-        # FIXED BIN WATCHER (works with or without quotes)
-        # ---------------------------------------------------------
-        def bin_watcher():
-            capturing = False
-            buffer_path = ""
-            last_line_index = 1  # start from first line
-
-            while True:
-                if not self.proc:
-                    break
-
-                try:
-                    # Read new lines since last_line_index
-                    total_lines = int(self.console.index(tk.END).split('.')[0])
-                    if total_lines < last_line_index:
-                        last_line_index = total_lines  # console was cleared
-                    new_lines = [self.console.get(f"{i}.0", f"{i}.end").strip() for i in range(last_line_index, total_lines)]
-                    last_line_index = total_lines
-                except Exception:
-                    threading.Event().wait(0.2)
-                    continue
-
-                for line in new_lines:
-                    line = line.strip()
-
-                    # Detect start of MI bin path
-                    if "MI bin file generated:" in line:
-                        capturing = True
-                        parts = line.split(":", 1)
-                        buffer_path = parts[1].strip().strip("'").strip('"') if len(parts) > 1 else ""
-                        continue
-
-                    # Capture continuation lines if needed
-                    if capturing:
-                        if line:  # skip empty
-                            buffer_path += line.strip("'").strip('"')
-                        # Check if file exists
-                        if buffer_path and os.path.isfile(buffer_path):
-                            self.output_bin = buffer_path
-                            size = os.path.getsize(self.output_bin)
-                            kb = size / 1024
-                            self.root.after(0, lambda: self.output_label.config(
-                                text=f"Output File: {self.output_bin} ({kb:.2f} KB)"
-                            ))
-                            self.root.after(0, lambda: self.hex_btn.config(state="normal"))
-                            self.root.after(0, lambda: self.flash_btn.config(state="normal"))
-                            return
-
-                threading.Event().wait(0.2)  # small delay to avoid CPU hog
-
-        # -------------------- Start Process --------------------
+            next_entry.focus_set()
+
+    def generate_mi(self):
+        if not self.template:
+            self.log("Click Start MI first.")
+            return
+
+        values = {fld: entry.get() for fld, entry in self.form_entries.items()}
+        if self.input_started is not None:
+            # Operator time from form ready (or the previous board) to Generate
+            self.metrics.observe("input", time.perf_counter() - self.input_started)
+        self.input_started = time.perf_counter()
         try:
-            self.proc = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
-            )
-        except Exception as e:
-            self.log(f"Exception: {e}")
+            mi_gen.generate_board(self.template, self.layout, values, on_event=self.on_mi_event, store=self.store,
+                                  mac_pool=self.mac_pool, metrics=self.metrics)
+        except ValueError:
+            return  # already reported through the validation_error event (incl. duplicate serials)
+        except mi_mac_pool.MacPoolError as e:
+            self.log(f"[Error] - {e}")
+        except (OSError, mi_record_store.sqlite3.Error) as e:
+            self.log(f"Write error: {e}")
+
+    def on_mi_event(self, event, **data):
+        """Generator events; may arrive from a worker thread, so UI updates go through root.after."""
+        if threading.current_thread() is not threading.main_thread():
+            self.root.after(0, lambda: self.on_mi_event(event, **data))
             return
 
-        # Start threads
-        threading.Thread(target=reader, args=(self.proc.stdout,), daemon=True).start()
-        threading.Thread(target=bin_watcher, daemon=True).start()
+        if event == "validation_error":
+            self.log(f"[Error] - {data['message']}")
+            entry = self.form_entries.get(data.get("field"))
+            if entry is not None:
+                entry.focus_set()
+                entry.select_range(0, tk.END)
+        elif event == "generated":
+            self.log(f"MI bin file generated: {data['path']} (CRC 0x{data['crc']:08X})")
+            self.set_output_bin(data["path"], data["size"])
+            if self.auto_flash.get():
+                self.pipeline.append((data["path"], time.perf_counter()))
+                self.dispatch_pipeline()
+            entries = list(self.form_entries.values())
+            if entries:
+                entries[0].focus_set()
+        elif event == "error":
+            self.log(f"[Error] - {data['message']}")
+
+    def set_output_bin(self, path, size, record=None):
+        self.output_bin = path
+        self.output_record = record
+        name = path if record is None else f"{path}#{record}"
+        self.output_label.config(text=f"Output File: {name} ({size / 1024:.2f} KB)")
+        self.hex_btn.config(state="normal")
+        self.flash_btn.config(state="normal")
 
     # =========================================================================
-    #                           SEND INTERACTIVE INPUT
+    #                               MI CONTAINER
     # =========================================================================
-    def send_input(self):
-        if not (self.proc and self.proc.poll() is None):
-            self.log("Process not running.")
+    def select_record(self, _event=None):
+        """Make the container record of the entered fazit ID / ECU serial number the output for hex view and flashing."""
+        path = self.container_path.get()
+        serial = self.record_serial.get().strip()
+        if not os.path.isfile(path) or not serial:
+            self.log("Select an MI container and enter a fazit ID or ECU serial number.")
             return
 
+        layout = self.current_layout()
         try:
-            msg = self.input_entry.get()
-            if not msg:
-                return
-            self.proc.stdin.write(msg + "\n")
-            self.proc.stdin.flush()
-            self.input_entry.delete(0, tk.END)
-            self.log(f"> {msg}")
-        except Exception as e:
-            self.log(f"Send error: {e}")
+            with mi_container.Container(path) as container:
+                if layout is not None:
+                    container.check_layout(layout)
+                record = container.lookup(serial)
+                size = container.record_size
+        except (OSError, mi_container.ContainerError) as e:
+            self.log(f"[Error] - {e}")
+            return
+        if record is None:
+            self.log(f"[Error] - No board {serial} in {path}")
+            return
+        self.set_output_bin(path, size, record)
+        self.log(f"Board {serial} selected: record {record} of {path}")
+
+    def extract_record(self):
+        """Write the selected container record to a bin file of its own; the flash tool only takes files."""
+        if self.extract_dir is None:
+            self.extract_dir = tempfile.mkdtemp(prefix="mi_records_")
+        with mi_container.Container(self.output_bin) as container:
+            image = container.record(self.output_record)
+        name = os.path.splitext(os.path.basename(self.output_bin))[0]
+        bin_path = os.path.join(self.extract_dir, f"{name}_{self.output_record}.bin")
+        mi_gen.write_atomic(bin_path, image)
+        return bin_path
 
     # =========================================================================
     #                               HEX VIEWER
@@ -380,22 +743,34 @@ class MI_UI:
             self.log("BIN file missing.")
             return
 
-        win = tk.Toplevel(self.root)
-        win.title("Hex Viewer")
-        text = scrolledtext.ScrolledText(win, width=120, height=40)
-        text.pack(fill="both", expand=True)
-
-        with open(self.output_bin, "rb") as f:
-            data = f.read()
-
-        out = []
-        for offset in range(0, len(data), 16):
-            chunk = data[offset:offset+16]
-            hexstr = " ".join(f"{b:02X}" for b in chunk)
-            ascii_text = ''.join(chr(b) if 32 <= b <= 126 else '.' for b in chunk)
-            out.append(f"{offset:08X}  {hexstr:<48}  {ascii_text}")
+        try:
+            HexViewer(self.root, self.output_bin, self.output_layout(), self.output_record)
+        except (OSError, mi_container.ContainerError) as e:
+            self.log(f"Hex viewer error: {e}")
 
-        text.insert("1.0", "\n".join(out))
+    def output_layout(self):
+        """Layout the output's MI header selects in the layout registry, else current_layout()."""
+        if self.registry is not None:
+            try:
+                if self.output_record is None:
+                    with open(self.output_bin, "rb") as f:
+                        header = f.read(mi_layouts.MI_HEADER.size)
+                else:
+                    with mi_container.Container(self.output_bin) as container:
+                        header = container.record(self.output_record)
+                return self.registry.layout(self.registry.for_image(header))
+            except (OSError, mi_gen.LayoutError, mi_container.ContainerError):
+                pass
+        return self.current_layout()
+
+    def current_layout(self):
+        """Layout loaded by Start MI, else the selected CSV if it is valid."""
+        if self.layout is None and os.path.isfile(self.csv_path.get()):
+            try:
+                self.layout = mi_gen.load_layout(self.csv_path.get(), mi_gen.get_layout_cache_dir())
+            except (OSError, mi_gen.LayoutError) as e:
+                self.log(f"Invalid CSV, showing raw hex only: {e}")
+        return self.layout
 
     # =========================================================================
     #                               FLASHING
@@ -410,61 +785,128 @@ class MI_UI:
             self.log("Select COM port.")
             return
 
-        s32 = resource_path(r"C:\NXP\S32FlashTool_2.1.2RTM\bin\S32FlashTool.exe")
-        target = resource_path(r"C:\NXP\S32FlashTool_2.1.2RTM\targetsS32G3xxx.bin")
-        addr = "0x0FFE0000"
-
-        cmd = [s32, "-t", target, "-fprogram", "-f", self.output_bin, "-addr", addr, "-i", "uart", "-p", com]
-        self.log(f"Flashing: {' '.join(cmd)}")
-
-        def reader(pipe):
-            buffer = ""
-            while True:
-                ch = pipe.read(1)
-                if not ch:
-                    break
-                buffer += ch
-                if ch == "\n" or buffer.endswith(":") or buffer.endswith(": ") or buffer.endswith(") "):
-                    out = buffer
-                    buffer = ""
-                    self.root.after(0, lambda t=out: self.log(t.rstrip()))
-            pipe.close()
-
-        def worker():
+        bin_path = self.output_bin
+        if self.output_record is not None:
             try:
-                p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
-                threading.Thread(target=reader, args=(p.stdout,), daemon=True).start()
-            except Exception as e:
-                self.root.after(0, lambda e=e: self.log(f"Flash error: {e}"))
+                bin_path = self.extract_record()
+            except (OSError, mi_container.ContainerError) as e:
+                self.log(f"[Error] - {e}")
+                return
 
-        threading.Thread(target=worker, daemon=True).start()
+        job = self.flasher.submit(com, bin_path, self.readback_layout())
+        self.log(f"Flash job {job.id} queued on {com}: {bin_path}")
+
+    def readback_layout(self):
+        """Layout for the read-back compare of a flash job, None when it is off."""
+        if not self.readback.get():
+            return None
+        layout = self.current_layout()
+        if layout is None:
+            self.log("Read-back compare needs a valid CSV, flashing without it.")
+        return layout
+
+    # ----------------------------- Pipeline -----------------------------
+    def pipeline_ports(self):
+        """Ports selected in the port table, else the selected COM port."""
+        ports = list(self.port_tree.selection())
+        if not ports and self.selected_com.get():
+            ports = [self.selected_com.get()]
+        return ports
+
+    def board_ready(self):
+        """Operator confirms a new board is loaded on the selected pipeline port(s)."""
+        ports = self.pipeline_ports()
+        if not ports:
+            self.log("Select the COM port(s) the new board(s) are loaded on.")
+            return
+        self.boards_ready.update(ports)
+        self.log(f"Board ready on {', '.join(ports)}")
+        self.dispatch_pipeline()
+
+    def dispatch_pipeline(self):
+        """Start the waiting boards on the idle pipeline ports with a new board loaded, one board per port."""
+        ports = self.pipeline_ports()
+        if self.pipeline and not ports:
+            self.log("Select the pipeline COM port(s) to flash the generated boards.")
+        for port in ports:
+            if not self.pipeline or not self.auto_flash.get():
+                break
+            # A finished port still holds the flashed board until the operator swaps it
+            if port not in self.boards_ready or self.flasher.status(port).state != mi_flasher.IDLE:
+                continue
+            self.boards_ready.discard(port)
+            bin_path, generated_at = self.pipeline.popleft()
+            self.metrics.observe("pipeline_wait", time.perf_counter() - generated_at)
+            job = self.flasher.submit(port, bin_path, self.readback_layout())
+            self.log(f"Flash job {job.id} started on {port}: {bin_path}")
+        self.pipeline_label.config(text=f"Pipeline: {len(self.pipeline)} board(s) waiting for a free port")
+        if self.pipeline and self.auto_flash.get() and not self.boards_ready:
+            self.log("Load a new board on a pipeline port and click Board Ready.")
+
+    def on_flash_output(self, port, line):
+        self.root.after(0, lambda: self.log(f"[{port}] {line}"))
+
+    def on_flash_done(self, job):
+        self.metrics.observe("flash_wait", (job.started_at - job.queued_at).total_seconds())
+        self.metrics.observe("flash", (job.finished_at - job.started_at).total_seconds())
+        self.metrics.count("flashed" if job.ok else "flash_failed")
+        if job.ok:
+            text = f"[{job.port}] Flash job {job.id} {job.message}: {job.bin_path}"
+            for name, old, new in job.diffs or ():
+                text += f"\n    {name}: {old!r} -> {new!r}"
+        else:
+            text = f"[{job.port}] [Error] - Flash job {job.id} failed after {job.attempts} attempt(s): {job.message}"
+        self.root.after(0, lambda: self.log(text))
+        self.root.after(0, self.dispatch_pipeline)
+
+    def on_flash_status(self, status):
+        """Scheduler status of one port; called from flash worker threads."""
+        if threading.current_thread() is not threading.main_thread():
+            self.root.after(0, lambda: self.on_flash_status(status))
+            return
+
+        job = status.job
+        message = status.message
+        if job is not None:
+            message = f"job {job.id} attempt {job.attempts}: {os.path.basename(job.bin_path)}"
+        values = (status.state, status.queued, status.done, status.failed, message)
+        if self.port_tree.exists(status.port):
+            self.port_tree.item(status.port, values=values)
+        else:
+            self.port_tree.insert("", tk.END, iid=status.port, text=status.port, values=values)
+
+    # =========================================================================
+    #                               METRICS
+    # =========================================================================
+    def refresh_metrics(self):
+        summary = self.metrics.summary()
+        parts = [f"Throughput: {self.metrics.per_hour('generated'):.0f} generated/h, "
+                 f"{self.metrics.per_hour('flashed'):.0f} flashed/h"]
+        for name, stage in summary["stages"].items():
+            parts.append(f"{name} p50 {format_seconds(stage['p50'])} p95 {format_seconds(stage['p95'])}")
+        self.metrics_label.config(text="  |  ".join(parts))
+        try:
+            self.metrics.export(self.metrics_file)
+        except OSError:
+            pass
+        self.root.after(METRICS_REFRESH_MS, self.refresh_metrics)
 
     # =========================================================================
     #                               CLEANUP
     # =========================================================================
     def on_close(self):
+        self.flasher.shutdown(wait=False)
+        if self.scanner is not None:
+            self.scanner.stop()
         try:
-            if self.proc and self.proc.poll() is None:
-                try:
-                    if os.name != "nt":
-                        os.kill(self.proc.pid, signal.SIGINT)
-                    else:
-                        self.proc.terminate()
-                except Exception:
-                    try:
-                        self.proc.terminate()
-                    except Exception:
-                        pass
-
-                try:
-                    self.proc.wait(timeout=1)
-                except Exception:
-                    try:
-                        self.proc.kill()
-                    except Exception:
-                        pass
+            if self.store is not None:
+                self.store.close()
+            if self.mac_pool is not None:
+                self.mac_pool.close()
         except Exception:
             pass
+        if self.extract_dir is not None:
+            shutil.rmtree(self.extract_dir, ignore_errors=True)
 
         try:
             self.root.destroy()
@@ -0,0 +1,54 @@
+"""Bin store tests: versions, refused collisions, daily archives and record paths"""
+import os
+from datetime import datetime
+
+import pytest
+
+import MI_bin_generator as mi_gen
+import mi_bin_store
+import mi_record_store
+from mi_benchmark import board_row
+
+def image_of(template, layout, row):
+    return bytes(mi_gen.build_mi(template, layout, row))
+
+def test_bin_store_versions(tmp_path, template, layout):
+    row = board_row(0)
+    first, rework = image_of(template, layout, row), image_of(template, layout, dict(row, brd_ver="9"))
+    with mi_bin_store.BinStore(str(tmp_path)) as bins:
+        path = mi_gen.write_bin(bins, row["fazit_id_string"], first)
+        assert path.endswith(os.path.join(mi_bin_store.shard_of(row["fazit_id_string"]), row["fazit_id_string"] + ".bin"))
+        # The same image again writes nothing, a changed image gets a new version next to it
+        assert mi_gen.write_bin(bins, row["fazit_id_string"], first) == path
+        assert mi_gen.write_bin(bins, row["fazit_id_string"], rework).endswith(row["fazit_id_string"] + ".v2.bin")
+        assert [entry["version"] for entry in bins.versions(row["fazit_id_string"])] == [1, 2]
+        assert bins.read(row["fazit_id_string"]) == rework and bins.read(row["fazit_id_string"], 1) == first
+        assert len(bins.find_image(mi_bin_store.content_hash(first))) == 1
+
+def test_bin_store_refuses_changed_image(tmp_path, template, layout):
+    row = board_row(0)
+    with mi_bin_store.BinStore(str(tmp_path), collisions="refuse") as bins:
+        path = mi_gen.write_bin(bins, row["fazit_id_string"], image_of(template, layout, row))
+        with pytest.raises(mi_bin_store.BinCollisionError):
+            mi_gen.write_bin(bins, row["fazit_id_string"], image_of(template, layout, dict(row, brd_ver="9")))
+        assert len(bins.versions(row["fazit_id_string"])) == 1
+        assert os.listdir(os.path.dirname(path)) == [row["fazit_id_string"] + ".bin"]
+
+def test_bin_store_archive_moves_records(tmp_path, template, layout):
+    today = datetime.now().strftime(mi_bin_store.DAY_FORMAT)
+    rows = [board_row(i) for i in range(5)]
+    with mi_bin_store.BinStore(str(tmp_path)) as bins, \
+            mi_record_store.RecordStore(str(tmp_path / "records.db")) as records:
+        for row in rows:
+            image = image_of(template, layout, row)
+            records.add(row, mi_gen.write_bin(bins, row["fazit_id_string"], image), 0)
+        archive_path = bins.archive(today, records)
+        assert os.path.isfile(archive_path) and not os.path.exists(bins.day_folder(today))
+        for row in rows:
+            entry = bins.find(row["fazit_id_string"])
+            assert entry["archived"] and bins.read(row["fazit_id_string"]) == image_of(template, layout, row)
+            assert records.find("fazit_id_string", row["fazit_id_string"])["path"] == entry["path"]
+        # An archived board generated again goes back into the day folder with its version
+        path = mi_gen.write_bin(bins, rows[0]["fazit_id_string"], image_of(template, layout, rows[0]))
+        assert os.path.isfile(path) and bins.find(rows[0]["fazit_id_string"])["version"] == 1
+        assert bins.rollup(today) == []
@@ -0,0 +1,30 @@
+"""Container tests: batch round trip, index lookups and damaged files"""
+import pytest
+
+import MI_bin_generator as mi_gen
+import mi_container
+from mi_benchmark import board_row
+
+def test_container_round_trip(tmp_path, mi_data, template, layout, manifest):
+    container = str(tmp_path / "boards.mic")
+    assert mi_gen.generate_batch(mi_data, layout, manifest, str(tmp_path), container=container) == (40, 0)
+    with mi_container.Container(container) as boards:
+        boards.check_layout(layout)
+        assert len(boards) == 40
+        for i in (0, 17, 39):
+            record_no = boards.lookup(board_row(i)["ecu_serial_number"])
+            assert boards.find("fazit_id_string", board_row(i)["fazit_id_string"]) == record_no
+            assert bytes(boards.record(record_no)) == bytes(mi_gen.build_mi(template, layout, board_row(i)))
+        assert boards.lookup("NO-SUCH-BOARD") is None
+
+def test_container_rejects_damaged_file(tmp_path, template, layout):
+    path = str(tmp_path / "boards.mic")
+    with mi_container.ContainerWriter(path, layout) as writer:
+        image = bytes(mi_gen.build_mi(template, layout, board_row(0)))
+        writer.add(image)
+        with pytest.raises(ValueError):
+            writer.add(image)
+    with open(path, "r+b") as f:
+        f.truncate(mi_container.HEADER_SIZE + layout.size // 2)
+    with pytest.raises(mi_container.ContainerError):
+        mi_container.Container(path)
@@ -0,0 +1,106 @@
+"""Flash scheduler tests without hardware: SimulatorBackend, and S32Backend against fake_s32flashtool.py"""
+import os
+import sys
+import time
+import shlex
+
+import MI_bin_generator as mi_gen
+import mi_flasher
+from mi_benchmark import board_row
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def write_image(path, template, layout, i):
+    path.write_bytes(bytes(mi_gen.build_mi(template, layout, board_row(i))))
+    return str(path)
+
+def test_scheduler_retries_failed_flash(tmp_path, template, layout):
+    bin_path = write_image(tmp_path / "a.bin", template, layout, 0)
+    backend = mi_flasher.SimulatorBackend(script={"COM1": ["fail", "ok"], "COM2": ["fail", "fail"]})
+    scheduler = mi_flasher.FlashScheduler(policy=mi_flasher.PortPolicy(retries=1, timeout=5), backend=backend)
+    recovered, failed = scheduler.submit("COM1", bin_path), scheduler.submit("COM2", bin_path)
+    assert scheduler.wait(10)
+    scheduler.shutdown()
+    assert recovered.state == mi_flasher.DONE and recovered.attempts == 2
+    assert failed.state == mi_flasher.FAILED and failed.attempts == 2
+    assert scheduler.status("COM2").failed == 1
+
+def test_scheduler_times_out_hanging_port(tmp_path, template, layout):
+    bin_path = write_image(tmp_path / "a.bin", template, layout, 0)
+    scheduler = mi_flasher.FlashScheduler(backend=mi_flasher.SimulatorBackend(script={"COM1": ["hang"]}))
+    scheduler.set_policy("COM1", retries=0, timeout=0.1)
+    job = scheduler.submit("COM1", bin_path)
+    assert scheduler.wait(10)
+    scheduler.shutdown()
+    assert job.state == mi_flasher.FAILED and "timeout" in job.message
+
+def test_scheduler_keeps_port_order(tmp_path, template, layout):
+    bins = [write_image(tmp_path / "{}.bin".format(i), template, layout, i) for i in range(4)]
+    finished = []
+    backend = mi_flasher.SimulatorBackend(delay=0.01)
+    scheduler = mi_flasher.FlashScheduler(max_workers=2, backend=backend, on_done=finished.append)
+    jobs = [scheduler.submit(port, path) for path in bins for port in ("COM1", "COM2")]
+    assert scheduler.wait(10)
+    scheduler.shutdown()
+    for port in ("COM1", "COM2"):
+        order = [job.id for job in finished if job.port == port]
+        assert order == sorted(order) and len(order) == len(bins)
+    assert all(job.ok for job in jobs)
+    with open(bins[-1], "rb") as f:
+        assert backend.memory["COM1"][int(mi_flasher.MI_FLASH_ADDR, 0)] == f.read()
+
+def test_s32_backend_with_fake_tool(tmp_path, monkeypatch, template, layout):
+    bin_path = write_image(tmp_path / "a.bin", template, layout, 0)
+    tool = "{} {}".format(shlex.quote(sys.executable), shlex.quote(os.path.join(here, "fake_s32flashtool.py")))
+    monkeypatch.setenv("MI_FLASH_TOOL", tool)
+    monkeypatch.setenv("FAKE_FLASH_DIR", str(tmp_path / "fake"))
+    monkeypatch.setenv("FAKE_FLASH_DELAY", "0")
+    monkeypatch.setenv("FAKE_FLASH_FAIL", "COM9")
+    scheduler = mi_flasher.FlashScheduler(policy=mi_flasher.PortPolicy(retries=0, timeout=30),
+                                          backend=mi_flasher.S32Backend())
+    good, bad = scheduler.submit("COM1", bin_path), scheduler.submit("COM9", bin_path)
+    assert scheduler.wait(60)
+    assert good.ok and not bad.ok
+    # The read-back compare finds the flash already holding the image
+    again = scheduler.submit("COM1", bin_path, layout)
+    assert scheduler.wait(60)
+    scheduler.shutdown()
+    assert again.ok and again.skipped
+
+def test_scheduler_wait_timeout_is_total(tmp_path, template, layout):
+    bin_path = write_image(tmp_path / "a.bin", template, layout, 0)
+    scheduler = mi_flasher.FlashScheduler(backend=mi_flasher.SimulatorBackend(delay=0.2))
+    for _ in range(4):
+        scheduler.submit("COM1", bin_path)
+    start = time.monotonic()
+    assert not scheduler.wait(0.3)
+    assert time.monotonic() - start < 0.5
+    assert scheduler.wait(10)
+    scheduler.shutdown()
+
+def test_readback_and_program_share_one_download(tmp_path, template, layout):
+    first = write_image(tmp_path / "a.bin", template, layout, 0)
+    second = write_image(tmp_path / "b.bin", template, layout, 1)
+    backend = mi_flasher.SimulatorBackend()
+    scheduler = mi_flasher.FlashScheduler(backend=backend)
+    jobs = [scheduler.submit("COM1", first, layout), scheduler.submit("COM1", second, layout)]
+    assert scheduler.wait(10)
+    scheduler.shutdown()
+    assert all(job.ok for job in jobs)
+    assert backend.commands == [("COM1", "read"), ("COM1", "program")] * 2
+    # One download per job: the program reuses the read-back session, the next job starts a new one
+    assert backend.downloads["COM1"] == 2
+
+def test_failed_readback_still_programs(tmp_path, template, layout):
+    bin_path = write_image(tmp_path / "a.bin", template, layout, 0)
+    backend = mi_flasher.SimulatorBackend(script={"COM1": ["fail", "ok"]})
+    output = []
+    scheduler = mi_flasher.FlashScheduler(policy=mi_flasher.PortPolicy(retries=0, timeout=5), backend=backend,
+                                          on_output=lambda port, line: output.append(line))
+    job = scheduler.submit("COM1", bin_path, layout)
+    assert scheduler.wait(10)
+    scheduler.shutdown()
+    assert job.ok and job.attempts == 1 and "read-back failed" in job.message
+    assert any(line.startswith("Warning: read-back failed") for line in output)
+    with open(bin_path, "rb") as f:
+        assert backend.memory["COM1"][int(mi_flasher.MI_FLASH_ADDR, 0)] == f.read()
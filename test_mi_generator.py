@@ -0,0 +1,109 @@
+"""Generator tests: layout compilation and checks, batch validation and generation"""
+import json
+
+import pytest
+
+import MI_bin_generator as mi_gen
+import mi_record_store
+from mi_benchmark import board_row
+
+def write_manifest(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    return str(path)
+
+def bad_rows():
+    """Rows 2, 4 and 5 invalid (row numbers as in read_manifest)"""
+    rows = [board_row(i) for i in range(6)]
+    rows[1]["brd_ver"] = "256"
+    rows[1]["production_date"] = "31022025"
+    rows[3]["fazit_id_string"] = "A*B"
+    rows[4]["ecu_serial_number"] = rows[0]["ecu_serial_number"]
+    return rows
+
+def test_check_column_rules():
+    assert mi_gen.check_column("brd_ver", ["7", "0xFF", "256", "x"], 1, "byte") == \
+        [(2, "brd_ver must be in the range of [0 to 255]!"), (3, "brd_ver must be a number!")]
+    assert [i for i, _ in mi_gen.check_column("production_date", ["01012025", "31022025", "1012025"], 8)] == [1, 2]
+    assert [i for i, _ in mi_gen.check_column("brd_pn", ["PN1", "PNé", "P" * 11], 10)] == [1, 2]
+
+def test_validate_rows_reports_every_error(tmp_path, template, layout):
+    manifest = write_manifest(tmp_path / "rows.jsonl", bad_rows())
+    with mi_record_store.RecordStore(str(tmp_path / "records.db")) as store:
+        store.add(board_row(9), "x.bin", 0)
+        rows = list(mi_gen.read_manifest(manifest)) + [(7, dict(board_row(10), ecu_serial_number="ECU00000009"), None)]
+        valid, errors = mi_gen.validate_rows(template, layout, rows, store)
+    assert [row_no for row_no, _, _ in valid] == [1, 3, 6]
+    assert [(row_no, fld) for row_no, fld, _ in errors] == [
+        (2, "brd_ver"), (2, "production_date"), (4, "fazit_id_string"), (5, "ecu_serial_number"), (7, None)]
+
+def test_batch_generates_the_valid_rows(tmp_path, mi_data, layout):
+    manifest = write_manifest(tmp_path / "rows.jsonl", bad_rows())
+    folder = tmp_path / "out"
+    folder.mkdir()
+    assert mi_gen.generate_batch(mi_data, layout, manifest, str(folder)) == (3, 3)
+    assert sorted(path.name for path in folder.iterdir()) == \
+        sorted("{}.bin".format(board_row(i)["fazit_id_string"]) for i in (0, 2, 5))
+
+def test_strict_batch_generates_nothing(tmp_path, mi_data, layout):
+    manifest = write_manifest(tmp_path / "rows.jsonl", bad_rows())
+    folder = tmp_path / "out"
+    folder.mkdir()
+    assert mi_gen.generate_batch(mi_data, layout, manifest, str(folder), strict=True) == (0, 3)
+    assert list(folder.iterdir()) == []
+
+def test_parallel_batch_matches_single_process(tmp_path, manifest, mi_data, layout):
+    images = []
+    for jobs in (1, 2):
+        folder = tmp_path / "jobs{}".format(jobs)
+        folder.mkdir()
+        assert mi_gen.generate_batch(mi_data, layout, manifest, str(folder), jobs=jobs) == (40, 0)
+        images.append({path.name: path.read_bytes() for path in folder.iterdir()})
+    assert images[0] == images[1] and len(images[0]) == 40
+
+def test_compile_layout_reports_every_error():
+    lines = ["magic_id,uint,4", "version,uint", "board_name,text,8", "size,uint,x", "reserved,uint,3",
+             "magic_id,uint,4", "", "crc,str,4"]
+    with pytest.raises(mi_gen.LayoutError) as e:
+        mi_gen.compile_layout(lines, "bad.csv")
+    message = str(e.value)
+    assert message.startswith("bad.csv: line 2: expected 'name,type,size'")
+    for error in ("line 3: unknown field type 'text'", "line 4: invalid size 'x'", "line 5: uint field reserved cannot be 3",
+                  "line 6: duplicate field magic_id", "last field must be"):
+        assert error in message
+    with pytest.raises(mi_gen.LayoutError, match="no fields defined"):
+        mi_gen.compile_layout([], "empty.csv")
+
+def test_compile_layout_offsets(layout):
+    lines = ["{},{},{}".format(fld.name, fld.type, fld.size) for fld in layout]
+    assert mi_gen.layout_fields(mi_gen.compile_layout(lines, "copy.csv")) == mi_gen.layout_fields(layout)
+    assert layout.crc.offset == layout.size - layout.crc.size
+
+def mi_data_with(mi_data, section, **changes):
+    """Copy of the MI data with fields of one section changed (None removes a field)"""
+    copy = {mi_section: dict(fields) for mi_section, fields in mi_data.items()}
+    for fld, value in changes.items():
+        if value is None:
+            del copy[section][fld]
+        else:
+            copy[section][fld] = value
+    return copy
+
+def test_prepare_template_rejects_mismatched_mi_data(mi_data, layout):
+    header = mi_gen.MI_GLOBAL_HEADER
+    with pytest.raises(mi_gen.LayoutError, match="does not match config size"):
+        mi_gen.prepare_template(mi_data_with(mi_data, header, size=str(layout.size - 1)), layout)
+    with pytest.raises(mi_gen.LayoutError, match="invalid 'size' header"):
+        mi_gen.prepare_template(mi_data_with(mi_data, header, size="big"), layout)
+    with pytest.raises(mi_gen.LayoutError, match="field extra_field not found in config file"):
+        mi_gen.prepare_template(mi_data_with(mi_data, header, extra_field="1"), layout)
+    with pytest.raises(mi_gen.LayoutError, match="missing field.s. version"):
+        mi_gen.prepare_template(mi_data_with(mi_data, header, version=None), layout)
+
+def test_check_layout_field_order(mi_data, layout):
+    mi = {mi_section: dict(fields) for mi_section, fields in mi_data.items()}
+    mi_gen.set_reserved_fields(mi)
+    fields = mi_gen.mi_fields(mi)
+    mi_gen.check_layout(fields, layout)
+    fields[0], fields[1] = fields[1], fields[0]
+    with pytest.raises(mi_gen.LayoutError, match="field {} at offset 0, config expects 4".format(fields[0][0])):
+        mi_gen.check_layout(fields, layout)
@@ -0,0 +1,59 @@
+"""Layout registry and compiled layout cache tests"""
+import os
+import shutil
+
+import pytest
+
+import MI_bin_generator as mi_gen
+import mi_layouts
+from mi_benchmark import board_row
+from conftest import INI, CONFIG
+
+def write_registry(tmp_path, versions):
+    """Registry with one product per MI data file version, all on the repository's MI config"""
+    shutil.copy(CONFIG, str(tmp_path / "mi_config.csv"))
+    with open(INI) as f:
+        ini = f.read()
+    sections = []
+    for i, version in enumerate(versions):
+        name = "product{}".format(i)
+        (tmp_path / (name + ".ini")).write_text(ini.replace("version=2", "version={}".format(version), 1))
+        sections.append("[{0}]\nini = {0}.ini\nconfig = mi_config.csv\n".format(name))
+    path = tmp_path / "mi_layouts.ini"
+    path.write_text("\n".join(sections))
+    return str(path)
+
+def test_registry_selects_product_by_header(tmp_path, template, layout):
+    registry = mi_layouts.LayoutRegistry.load(write_registry(tmp_path, [2, 3]), str(tmp_path / "cache"))
+    image = bytes(mi_gen.build_mi(template, layout, board_row(0)))
+    product = registry.for_image(image)
+    assert product.name == "product0" and product.version == 2
+    assert registry.template(product) is registry.template(product)
+    assert registry.find(product.magic, 3).name == "product1"
+    with pytest.raises(mi_gen.LayoutError):
+        registry.find(product.magic, 4)
+    with pytest.raises(mi_gen.LayoutError):
+        registry.for_image(image[:8])
+
+def test_registry_rejects_shared_header(tmp_path):
+    with pytest.raises(mi_gen.LayoutError, match="both use"):
+        mi_layouts.LayoutRegistry.load(write_registry(tmp_path, [2, 2]))
+
+def test_layout_cache(tmp_path, monkeypatch, layout):
+    cache_dir = str(tmp_path / "cache")
+    assert mi_gen.layout_fields(mi_gen.load_layout(CONFIG, cache_dir)) == mi_gen.layout_fields(layout)
+    cache_files = os.listdir(cache_dir)
+    assert len(cache_files) == 1
+
+    # A cached config is not compiled again
+    compile_layout = mi_gen.compile_layout
+    monkeypatch.setattr(mi_gen, "compile_layout", lambda lines, source: pytest.fail("compiled again"))
+    assert mi_gen.layout_fields(mi_gen.load_layout(CONFIG, cache_dir)) == mi_gen.layout_fields(layout)
+
+    # An unreadable cache file is compiled again and rewritten
+    monkeypatch.setattr(mi_gen, "compile_layout", compile_layout)
+    with open(os.path.join(cache_dir, cache_files[0]), "w") as f:
+        f.write("{")
+    assert mi_gen.layout_fields(mi_gen.load_layout(CONFIG, cache_dir)) == mi_gen.layout_fields(layout)
+    monkeypatch.setattr(mi_gen, "compile_layout", lambda lines, source: pytest.fail("compiled again"))
+    mi_gen.load_layout(CONFIG, cache_dir)
@@ -0,0 +1,57 @@
+"""MAC pool tests: unique allocation across pools, giving back the unused block, exhaustion"""
+import pytest
+
+import MI_bin_generator as mi_gen
+import mi_mac_pool
+import mi_record_store
+import mi_service
+from mi_benchmark import board_row
+
+FIELDS = ("eth_mac_add_2.5g_0", "eth_mac_add_2.5g_1", "eth_mac_add_tda")
+
+@pytest.fixture
+def pool_config(tmp_path):
+    """MAC pool config of 16 addresses per field, block size 4"""
+    path = tmp_path / "mac_pools.ini"
+    sections = "".join("[{}]\nstart=02:00:00:00:{:02X}:00\nend=02:00:00:00:{:02X}:0F\n\n".format(fld, i, i)
+                       for i, fld in enumerate(FIELDS))
+    path.write_text("[pool]\nstate=mac_pools.db\nblock_size=4\n\n" + sections)
+    return str(path)
+
+def test_pools_never_share_an_address(pool_config):
+    with mi_mac_pool.MacPool(pool_config) as first, mi_mac_pool.MacPool(pool_config) as second:
+        macs = [pool.allocate() for _ in range(6) for pool in (first, second)]
+    for fld in FIELDS:
+        assert len({board[fld] for board in macs}) == 12
+
+def test_close_gives_back_the_unused_block(pool_config):
+    with mi_mac_pool.MacPool(pool_config) as pool:
+        pool.allocate()
+        assert pool.remaining()[FIELDS[0]] == 12     # one block of 4 claimed
+    with mi_mac_pool.MacPool(pool_config) as pool:
+        assert pool.remaining()[FIELDS[0]] == 15
+        assert pool.allocate()[FIELDS[0]] == mi_mac_pool.format_mac(mi_mac_pool.parse_mac("02:00:00:00:00:01"))
+
+def test_exhausted_range(pool_config):
+    with mi_mac_pool.MacPool(pool_config) as pool:
+        for _ in range(16):
+            pool.allocate()
+        with pytest.raises(mi_mac_pool.MacPoolError):
+            pool.allocate()
+
+def test_rejected_boards_take_no_addresses(tmp_path, pool_config, template, layout):
+    with mi_mac_pool.MacPool(pool_config) as pool, \
+            mi_record_store.RecordStore(str(tmp_path / "records.db")) as store:
+        mi_gen.generate_board(template, layout, board_row(0), str(tmp_path), store=store, mac_pool=pool)
+        for bad in (dict(board_row(1), debug_level="x"), dict(board_row(1), fazit_id_string="A:B"),
+                    dict(board_row(1), ecu_serial_number=board_row(0)["ecu_serial_number"])):
+            with pytest.raises(ValueError):
+                mi_gen.generate_board(template, layout, bad, str(tmp_path), store=store, mac_pool=pool)
+        with mi_service.GenerationService(template, layout, str(tmp_path), store, pool) as service:
+            with pytest.raises(mi_service.BoardError):
+                service.generate(dict(board_row(2), debug_level="x"))
+            with pytest.raises(mi_record_store.DuplicateError):
+                service.generate(dict(board_row(2), fazit_id_string=board_row(0)["fazit_id_string"]))
+            service.generate(board_row(2))
+        second = store.find("fazit_id_string", board_row(2)["fazit_id_string"])
+        assert second["values"][FIELDS[0]] == mi_mac_pool.format_mac(mi_mac_pool.parse_mac("02:00:00:00:00:01"))
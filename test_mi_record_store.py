@@ -0,0 +1,31 @@
+"""Record store tests: duplicate rules, rework and transactions"""
+import pytest
+
+import mi_record_store
+from mi_benchmark import board_row
+
+def test_record_store_duplicate_rules(tmp_path):
+    with mi_record_store.RecordStore(str(tmp_path / "records.db")) as store:
+        first = store.add(board_row(1), "a.bin", 1)
+        assert store.check(board_row(1)) is None
+        # Rework: all unique serials unchanged updates the record
+        assert store.add(board_row(1), "a2.bin", 2) == first
+        record = store.find("fazit_id_string", board_row(1)["fazit_id_string"])
+        assert record["generation"] == 2 and record["path"] == "a2.bin"
+        # Reusing one serial of another board is rejected
+        clash = dict(board_row(2), ecu_serial_number=board_row(1)["ecu_serial_number"])
+        assert "already recorded" in store.check(clash)
+        with pytest.raises(mi_record_store.DuplicateError):
+            store.add(clash, "b.bin", 3)
+        assert store.add(board_row(2), "b.bin", 3) != first
+        assert len(list(store.records())) == 2
+
+def test_record_store_transaction_rolls_back(tmp_path):
+    with mi_record_store.RecordStore(str(tmp_path / "records.db")) as store:
+        with pytest.raises(mi_record_store.DuplicateError):
+            with store.transaction():
+                store.add(board_row(1), "a.bin", 1)
+                store.add(dict(board_row(2), fazit_id_string=board_row(1)["fazit_id_string"]), "b.bin", 2)
+        assert list(store.records()) == []
+        with pytest.raises(ValueError):
+            store.find("brd_pn", "PN1")
@@ -0,0 +1,56 @@
+"""Scanner label parsing tests, and ScannerReader on a pty"""
+import os
+import sys
+import threading
+
+import pytest
+
+import mi_scanner
+
+def test_named_label(template, layout):
+    values, errors = mi_scanner.parse_label("]d2fazit_id_string=FZ-0001\x1decu_serial_number=ECU0001", template, layout)
+    assert values == {"fazit_id_string": "FZ-0001", "ecu_serial_number": "ECU0001"} and errors == []
+
+def test_positional_label_uses_label_fields(template, layout):
+    values, errors = mi_scanner.parse_label("FZ-0001|ECU0001", template, layout)
+    assert values == {"fazit_id_string": "FZ-0001", "ecu_serial_number": "ECU0001"} and errors == []
+    values, errors = mi_scanner.parse_label("1|PN1", template, layout, fields=["debug_level", "brd_pn"])
+    assert values == {"debug_level": "1", "brd_pn": "PN1"} and errors == []
+
+def test_single_value_goes_to_target(template, layout):
+    assert mi_scanner.parse_label("ECU0001", template, layout, target="ecu_serial_number") == \
+        ({"ecu_serial_number": "ECU0001"}, [])
+    assert mi_scanner.parse_label("FZ-0001", template, layout) == ({"fazit_id_string": "FZ-0001"}, [])
+
+def test_rejected_values_are_left_out(template, layout):
+    values, errors = mi_scanner.parse_label("A:B|ECU0001", template, layout)
+    assert values == {"ecu_serial_number": "ECU0001"}
+    assert [fld for fld, _ in errors] == ["fazit_id_string"]
+    values, errors = mi_scanner.parse_label("x=1|ecu_serial_number=E1", template, layout)
+    assert values == {"ecu_serial_number": "E1"} and errors[0][0] == "x"
+
+def test_too_many_positional_values(template, layout):
+    values, errors = mi_scanner.parse_label("FZ-0001|ECU0001|extra", template, layout)
+    assert values == {} and "3 values" in errors[0][1]
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs a pty")
+def test_reader_splits_labels():
+    master, slave = os.openpty()
+    labels = []
+    received = threading.Event()
+
+    def on_scan(label):
+        labels.append(label)
+        if len(labels) == 2:
+            received.set()
+
+    reader = mi_scanner.ScannerReader(os.ttyname(slave), on_scan)
+    try:
+        os.write(master, b"FZ-0001|ECU0001\r\nFZ-0002")
+        os.write(master, b"|ECU0002\r\n")
+        assert received.wait(5)
+    finally:
+        reader.stop()
+        os.close(master)
+        os.close(slave)
+    assert labels == ["FZ-0001|ECU0001", "FZ-0002|ECU0002"]
@@ -0,0 +1,69 @@
+"""Generation service tests: request batching and the HTTP answers"""
+import json
+import threading
+import http.client
+
+import pytest
+
+import MI_bin_generator as mi_gen
+import mi_bin_store
+import mi_mac_pool
+import mi_record_store
+import mi_service
+from mi_benchmark import board_row
+
+@pytest.fixture
+def service(tmp_path, template, layout):
+    """Service on a refusing bin store and a record store, with a MAC pool of two boards"""
+    pool_config = tmp_path / "mac_pools.ini"
+    pool_config.write_text("[pool]\nstate=mac_pools.db\nblock_size=1\n\n" + "".join(
+        "[{}]\nstart=02:00:00:00:{:02X}:00\nend=02:00:00:00:{:02X}:01\n\n".format(fld, i, i)
+        for i, fld in enumerate(("eth_mac_add_2.5g_0", "eth_mac_add_2.5g_1", "eth_mac_add_tda"))))
+    with mi_bin_store.BinStore(str(tmp_path), "refuse") as bins, \
+            mi_record_store.RecordStore(str(tmp_path / "records.db")) as store, \
+            mi_mac_pool.MacPool(str(pool_config)) as pool, \
+            mi_service.GenerationService(template, layout, bins, store, pool) as service:
+        yield service
+
+def test_concurrent_requests_are_batched(tmp_path, template, layout):
+    with mi_record_store.RecordStore(str(tmp_path / "records.db")) as store, \
+            mi_service.GenerationService(template, layout, str(tmp_path), store, batch_window=0.5) as service:
+        rows = [board_row(i) for i in range(6)] + [dict(board_row(9), fazit_id_string=board_row(0)["fazit_id_string"])]
+        futures = [service.submit(row) for row in rows]
+        boards = [future.result(10) for future in futures[:-1]]
+        with pytest.raises(mi_service.BoardError, match="same batch"):
+            futures[-1].result(10)
+        status = service.status()
+        assert status["batches"] == 1 and status["largest_batch"] == 7
+        assert (status["generated"], status["failed"]) == (6, 1)
+        for i, board in enumerate(boards):
+            assert board.image == bytes(mi_gen.build_mi(template, layout, board_row(i)))
+            assert store.find("fazit_id_string", board.name)["id"] == board.record
+
+def test_http_error_codes(service, template, layout):
+    server = mi_service.ServiceServer(("127.0.0.1", 0), mi_service.make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def post(values, path="/boards"):
+        body = values if isinstance(values, bytes) else json.dumps(values).encode()
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+        conn.request("POST", path, body, {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        return response.status, response.getheader("X-MI-Name"), data
+
+    try:
+        code, name, image = post(board_row(0))
+        assert (code, name) == (200, board_row(0)["fazit_id_string"]) and len(image) == layout.size
+        code, _, body = post(dict(board_row(1), brd_ver="x"))
+        assert code == 400 and json.loads(body)["field"] == "brd_ver"
+        assert post(b"{")[0] == 400 and post(board_row(1), "/other")[0] == 404
+        # Serial of another board, then a changed image of a board the refusing bin store holds
+        assert post(dict(board_row(1), ecu_serial_number=board_row(0)["ecu_serial_number"]))[0] == 409
+        assert post(dict(board_row(0), brd_ver="9"))[0] == 409
+        # The two boards' worth of MAC addresses went to the first board and the refused rework
+        assert post(board_row(1))[0] == 503
+    finally:
+        server.shutdown()
+        server.server_close()